@@ -45,7 +45,7 @@ if __name__ == '__main__':
 	
 	lsKeys = ['open', 'high', 'low', 'close', 'volume']
 	
-	ldfData = norObj.get_data( ldtTimestamps, lsSym, lsKeys ) #this line is important even though the ret value is not used
+	ldfData = norObj.get_data( ldtTimestamps, lsSym, lsKeys ) #warms the cache, the train and test reads below are sliced from it
 	
 	for temp in ldfData:
 		temp.fillna(method="ffill").fillna(method="bfill")
@@ -93,9 +93,12 @@ if __name__ == '__main__':
 				]
 	
 	
+	''' Features are cached on disk, runs with another selection method reuse them '''
+	cCache = ftu.FeatureCache( sDir='featcache' )
+	
 	''' Generate a list of DataFrames, one for each feature, with the same index/column structure as price data '''
-	ldfFeaturesTrain = ftu.applyFeatures( dDataTrain, lfcFeatures, ldArgs, '$SPX')
-	ldfFeaturesTest = ftu.applyFeatures( dDataTest, lfcFeatures, ldArgs, '$SPX')
+	ldfFeaturesTrain = ftu.applyFeatures( dDataTrain, lfcFeatures, ldArgs, '$SPX', cCache=cCache)
+	ldfFeaturesTest = ftu.applyFeatures( dDataTest, lfcFeatures, ldArgs, '$SPX', cCache=cCache)
 
 	''' Pick Test and Training Points '''		
 	dtStartTrain = dt.datetime(2008,01,01)
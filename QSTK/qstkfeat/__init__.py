@@ -1,3 +1,4 @@
 from classes import *
 from featutil import *
 from features import *
+from incremental import *
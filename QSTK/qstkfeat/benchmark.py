@@ -0,0 +1,283 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Benchmarks the feature functions on synthetic data, see featutil.speedTest
+          for timing them on database data.
+          Usage: python benchmark.py [results.json] [DAYSxSYMBOLS ...]
+'''
+
+''' Python imports '''
+import os
+import sys
+import json
+import time
+import inspect
+import platform
+import multiprocessing as mp
+import datetime as dt
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+''' 3rd party imports '''
+import numpy as np
+import pandas as pand
+
+''' Our Imports '''
+from qstkfeat import features
+from qstkfeat.classes import class_fut_ret
+
+
+# Panel sizes run by default, (days, symbols)
+BENCH_SIZES = [(250, 10), (2500, 10), (2500, 500)]
+
+
+def syntheticData( lDays, lSyms, lSeed=0 ):
+    '''
+    @summary: Random walk OHLCV data, stands in for DataAccess.get_data
+    @param lDays: Number of trading days, weekdays from 1990 on at 16:00
+    @param lSyms: Number of symbols, the last one is '$SPX'
+    @param lSeed: Seed of the random numbers
+    @return: Dictionary of dataframes keyed open/high/low/close/volume/actual_close
+    '''
+    naRand = np.random.RandomState( lSeed )
+
+    ldtIndex = []
+    dtDay = dt.datetime(1990, 1, 1, 16)
+    while len(ldtIndex) < lDays:
+        if dtDay.weekday() < 5:
+            ldtIndex.append( dtDay )
+        dtDay += dt.timedelta(days=1)
+    lsSym = ['SYM%d' % i for i in range(lSyms - 1)] + ['$SPX']
+
+    naClose = 50. * np.exp( np.cumsum(naRand.normal(0., 0.02, (lDays, lSyms)), axis=0) )
+    naOpen = naClose * np.exp( naRand.normal(0., 0.005, (lDays, lSyms)) )
+    naSpread = np.abs( naRand.normal(0., 0.01, (lDays, lSyms)) )
+    naHigh = np.maximum( naOpen, naClose ) * (1. + naSpread)
+    naLow = np.minimum( naOpen, naClose ) * (1. - naSpread)
+    naVolume = np.round( naRand.lognormal(13., 1., (lDays, lSyms)) )
+
+    dData = {}
+    for sKey, naVal in [('open', naOpen), ('high', naHigh), ('low', naLow),
+                        ('close', naClose), ('volume', naVolume), ('actual_close', naClose.copy())]:
+        dData[sKey] = pand.DataFrame( index=ldtIndex, columns=lsSym, data=naVal )
+    return dData
+
+
+def getBenchFeatures():
+    '''
+    @summary: Every feature function in features.py and class_fut_ret, with default arguments
+    @return: Tuple containing (list of functions, list of arguments)
+    '''
+    lfcFeatures = [fcFeature for sName, fcFeature in inspect.getmembers( features, inspect.isfunction )
+                   if sName.startswith('feat') and fcFeature.__module__ == features.__name__]
+    lfcFeatures.append( class_fut_ret )
+    return lfcFeatures, [{} for fcFeature in lfcFeatures]
+
+
+def _rss():
+    ''' Resident memory of this process in bytes, None if it cannot be read '''
+    try:
+        with open( '/proc/self/statm', 'r' ) as fFile:
+            return int(fFile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _maxRss():
+    ''' Peak resident memory of this process in bytes, None without the resource module '''
+    if resource == None:
+        return None
+    lMax = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    if sys.platform == 'darwin':
+        return lMax
+    return lMax * 1024
+
+
+def _timeFeature( fcFeature, dArgs, dData, lRepeat ):
+    '''
+    @summary: Runs a feature lRepeat times
+    @return: (best seconds, bytes the peak memory grew by or None)
+    '''
+    lBefore = _rss()
+    if lBefore == None:
+        lBefore = _maxRss()
+
+    fBest = None
+    for i in range(lRepeat):
+        fStart = time.time()
+        fcFeature( dData, **dict(dArgs) )
+        fSeconds = time.time() - fStart
+        if fBest == None or fSeconds < fBest:
+            fBest = fSeconds
+
+    lAfter = _maxRss()
+    if lBefore == None or lAfter == None:
+        return fBest, None
+    return fBest, max(0, lAfter - lBefore)
+
+
+def _isolatedWorker( cConn, fcFeature, dArgs, dData, lRepeat ):
+    try:
+        cConn.send( _timeFeature(fcFeature, dArgs, dData, lRepeat) )
+    except Exception, e:
+        cConn.send( e )
+    cConn.close()
+
+
+def benchFeature( fcFeature, dArgs, dData, lRepeat=1, bIsolate=True ):
+    '''
+    @summary: Times one feature function
+    @param fcFeature: Feature function to time
+    @param dArgs: Arguments to pass into feature function
+    @param dData: Data to run it on, see syntheticData
+    @param lRepeat: Number of runs, the fastest one is reported
+    @param bIsolate: If True, runs in a child process so the peak memory of the
+                     feature alone is measured. Otherwise the peak is only seen
+                     when it passes the earlier peak of this process.
+    @return: Dictionary with the feature name, arguments, days, symbols, seconds,
+             cells per second and peak memory growth in bytes (None if unknown)
+    '''
+    if bIsolate:
+        cParent, cChild = mp.Pipe( duplex=False )
+        pWorker = mp.Process( target=_isolatedWorker, args=(cChild, fcFeature, dArgs, dData, lRepeat) )
+        pWorker.start()
+        oResult = cParent.recv()
+        pWorker.join()
+        if isinstance(oResult, Exception):
+            raise oResult
+        fSeconds, lPeak = oResult
+    else:
+        fSeconds, lPeak = _timeFeature( fcFeature, dArgs, dData, lRepeat )
+
+    lDays, lSyms = dData['close'].values.shape
+    return {'feature': fcFeature.__name__, 'args': dArgs, 'days': lDays, 'symbols': lSyms,
+            'seconds': fSeconds, 'cells_per_sec': lDays * lSyms / max(fSeconds, 1e-9),
+            'peak_bytes': lPeak}
+
+
+def runBenchmark( ltSizes=BENCH_SIZES, lfcFeatures=None, ldArgs=None, sOut=None,
+                  lRepeat=1, bIsolate=True, bVerbose=True ):
+    '''
+    @summary: Times feature functions on synthetic data of several sizes
+    @param ltSizes: List of (days, symbols) to run on
+    @param lfcFeatures: Feature functions, if None, those of getBenchFeatures
+    @param ldArgs: Arguments of each feature function
+    @param sOut: If not None, JSON file to save the results to
+    @param lRepeat: Runs per feature and size, see benchFeature
+    @param bIsolate: Run each feature in a child process, see benchFeature
+    @param bVerbose: Print each result as it is measured
+    @return: Dictionary with the machine, the results of benchFeature and the
+             scaling exponent of every feature, see scalingExponents
+    '''
+    if lfcFeatures == None:
+        lfcFeatures, ldArgs = getBenchFeatures()
+    if ldArgs == None:
+        ldArgs = [{} for fcFeature in lfcFeatures]
+
+    ldResults = []
+    for lDays, lSyms in ltSizes:
+        dData = syntheticData( lDays, lSyms )
+        for i, fcFeature in enumerate(lfcFeatures):
+            dResult = benchFeature( fcFeature, ldArgs[i], dData, lRepeat, bIsolate )
+            ldResults.append( dResult )
+            if bVerbose:
+                print '%-16s %-28s %6dx%-5d %9.4fs %12.0f cells/s %s' % (
+                      dResult['feature'], str(ldArgs[i]), lDays, lSyms, dResult['seconds'],
+                      dResult['cells_per_sec'], _formatBytes(dResult['peak_bytes']))
+        del dData
+
+    dBench = {'date': str(dt.datetime.now()), 'python': platform.python_version(),
+              'numpy': np.__version__, 'pandas': pand.__version__,
+              'machine': platform.platform(), 'cpus': mp.cpu_count(),
+              'results': ldResults, 'scaling': scalingExponents( ldResults )}
+
+    if sOut != None:
+        with open( sOut, 'w' ) as fFile:
+            json.dump( dBench, fFile, indent=1 )
+    return dBench
+
+
+def _benchName( dResult ):
+    ''' Feature name and arguments of a result '''
+    return '%s %s' % (dResult['feature'], json.dumps(dResult['args'], sort_keys=True))
+
+
+def scalingExponents( ldResults ):
+    '''
+    @summary: Fits seconds = c * cells^k for each feature, k near 1 is linear scaling
+    @param ldResults: Results of benchFeature
+    @return: Dictionary of feature name and arguments to k, None with fewer than 2 sizes
+    '''
+    dPoints = {}
+    for dResult in ldResults:
+        dPoints.setdefault( _benchName(dResult), [] ).append(
+            (dResult['days'] * dResult['symbols'], max(dResult['seconds'], 1e-9)) )
+
+    dScaling = {}
+    for sName, ltPoints in dPoints.iteritems():
+        naCells, naSeconds = np.log( np.array(ltPoints, dtype=float) ).T
+        if len(np.unique(naCells)) < 2:
+            dScaling[sName] = None
+        else:
+            dScaling[sName] = float( np.polyfit(naCells, naSeconds, 1)[0] )
+    return dScaling
+
+
+def compareBenchmarks( sOld, sNew, fSlower=1.25 ):
+    '''
+    @summary: Finds features that got slower between two saved benchmarks
+    @param sOld: JSON file of the earlier runBenchmark
+    @param sNew: JSON file of the later runBenchmark
+    @param fSlower: Ratio of seconds reported as a regression
+    @return: List of (feature name and arguments, days, symbols, old seconds, new seconds)
+    '''
+    with open( sOld, 'r' ) as fFile:
+        ldOld = json.load( fFile )['results']
+    with open( sNew, 'r' ) as fFile:
+        ldNew = json.load( fFile )['results']
+
+    dOld = dict( ((_benchName(dResult), dResult['days'], dResult['symbols']), dResult['seconds'])
+                 for dResult in ldOld )
+
+    ltRet = []
+    for dResult in ldNew:
+        tKey = (_benchName(dResult), dResult['days'], dResult['symbols'])
+        if tKey in dOld and dResult['seconds'] > fSlower * dOld[tKey]:
+            ltRet.append( tKey + (dOld[tKey], dResult['seconds']) )
+    return ltRet
+
+
+def _formatBytes( lBytes ):
+    if lBytes == None:
+        return '?'
+    return '%.1fMB' % (lBytes / 2.**20)
+
+
+def main():
+    '''
+    @summary: Runs the benchmark, arguments are an optional output file and panel sizes
+    '''
+    sOut = None
+    ltSizes = []
+    for sArg in sys.argv[1:]:
+        if 'x' in sArg and sArg.replace('x', '').isdigit():
+            ltSizes.append( tuple(int(s) for s in sArg.split('x')) )
+        else:
+            sOut = sArg
+
+    dBench = runBenchmark( ltSizes or BENCH_SIZES, sOut=sOut )
+
+    print
+    for sName, fScaling in sorted( dBench['scaling'].iteritems() ):
+        if fScaling != None:
+            print '%-45s scales as cells^%.2f' % (sName, fScaling)
+
+
+if __name__ == '__main__':
+    main()
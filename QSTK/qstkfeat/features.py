@@ -13,6 +13,7 @@ Created on Nov 7, 2011
 
 #''' Python imports '''
 import random
+import bisect
 
 #''' 3rd Party Imports '''
 import pandas as pand
@@ -24,6 +25,21 @@ import QSTK.qstkutil.tsutil as tsu
 from QSTK.qstkutil import DataAccess as da
 import QSTK.qstkutil.qsdateutil as du
 
+
+class FeatureData(dict):
+    '''
+    @summary: Data dictionary that keeps the intermediate results features
+    have in common, such as returns and rolling windows, so features applied
+    to the same data compute each of them once. Features accept a plain
+    dictionary as well, they then compute everything themselves.
+    '''
+    def __init__(self, dData):
+        '''
+        @param dData: Dictionary of data, open/high/low/close/volume
+        '''
+        dict.__init__(self, dData)
+        self.dShared = {}
+
 def featMomentum(dData, lLookback=20, b_human=False ):
     '''
     @summary: N day cumulative return (based on 1) indicator
@@ -37,13 +53,8 @@ def featMomentum(dData, lLookback=20, b_human=False ):
             x=1000/dData['close'][sym][0]
             dData['close'][sym]=dData['close'][sym]*x
         return dData['close']
-    dfPrice = dData['close'].copy()
-    
-    #Calculate Returns
-    tsu.returnize0(dfPrice.values)
-    
-    #Calculate rolling sum
-    dfRet = pand.rolling_sum(dfPrice, lLookback)
+    #Calculate rolling sum of the returns
+    dfRet = _rolling(dData, 'sum', 'close', lLookback, lReturns=0).copy()
     
     
     return dfRet
@@ -64,10 +75,10 @@ def featHiLow(dData, lLookback=20, b_human=False ):
     dfPrice = dData['close']
     
     #Find Max for each price for lookback
-    maxes = pand.rolling_max(dfPrice, lLookback, 1)
+    maxes = _rolling(dData, 'max', 'close', lLookback, lMinPeriods=1)
     
     #Find Min
-    mins = pand.rolling_min(dfPrice, lLookback, 1)
+    mins = _rolling(dData, 'min', 'close', lLookback, lMinPeriods=1)
     
     #Find Range
     ranges = maxes - mins
@@ -92,23 +103,17 @@ def featDate(dData, b_human=False ):
         return dData['close']
     
     dfPrice = dData['close']
-    dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )
-    
-    for sStock in dfPrice.columns:
-        tsPrice = dfPrice[sStock]
-        tsRet = dfRet[sStock]
-        #'' Loop over time '''
-        for i in range(len(tsPrice.index)):
-            #get current date
-            today = tsPrice.index[i]
-            
-            #get days since January 1st
-            days = today - dt.datetime(today.year, 1, 1)
-            
-            # multiply by 2, divide by 365, subtract 1
-            tsRet[i] = float(days.days * 2) / 365 - 1
-            
-    return dfRet
+
+    #''' The value only depends on the date, compute it once per day '''
+    lfDays = []
+    for today in dfPrice.index:
+        #get days since January 1st
+        days = today - dt.datetime(today.year, 1, 1)
+
+        # multiply by 2, divide by 365, subtract 1
+        lfDays.append(float(days.days * 2) / 365 - 1)
+
+    return _broadcast_days(dfPrice, lfDays)
 
 
 def featOption(dData, b_human=False ):
@@ -125,32 +130,33 @@ def featOption(dData, b_human=False ):
             dData['close'][sym]=dData['close'][sym]*x
         return dData['close']
     dfPrice = dData['close']
-    dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )
-    
-    for sStock in dfPrice.columns:
-        tsPrice = dfPrice[sStock]
-        tsRet = dfRet[sStock]
-        #'' Loop over time '''
-        for i in range(len(tsPrice.index)):
-            #get current date
-            today = tsPrice.index[i]
-            
-            #get last option close
-            last_close = du.getLastOptionClose(today, tsPrice.index)
-            
-            #get next option close
-            next_close = du.getNextOptionClose(today, tsPrice.index)
-            
-            #get days between
-            days_between = next_close - last_close
-            
-            #get days since last close
-            days = today - last_close
-            
-            # multiply by 2, divide by 365, subtract 1
-            tsRet[i] = float(days.days * 2) / days_between.days - 1
-            
-    return dfRet
+    if len(dfPrice.index) == 0:
+        return _broadcast_days(dfPrice, [])
+
+    #''' Option closes around the index, looked up once per day instead of
+    #stepping back a day at a time for every symbol '''
+    ldtCloses = du.getOptionCloses(dfPrice.index[0], dfPrice.index[-1], dfPrice.index)
+
+    lfDays = []
+    for today in dfPrice.index:
+        #get last option close, the latest one before today
+        i_next = bisect.bisect_left(ldtCloses, today)
+        last_close = ldtCloses[i_next - 1]
+
+        #get next option close, the first one on or after today
+        next_close = ldtCloses[i_next]
+
+        #get days between
+        days_between = next_close - last_close
+
+        #get days since last close
+        days = today - last_close
+
+        # multiply by 2, divide by 365, subtract 1
+        lfDays.append(float(days.days * 2) / days_between.days - 1)
+
+    return _broadcast_days(dfPrice, lfDays)
+
 
 def featMA( dData, lLookback=30, bRel=True, b_human=False ):
     '''
@@ -163,10 +169,12 @@ def featMA( dData, lLookback=30, bRel=True, b_human=False ):
     
     dfPrice = dData['close']
     
-    dfRet = pand.rolling_mean(dfPrice, lLookback)
+    dfRet = _rolling(dData, 'mean', 'close', lLookback)
     
     if bRel:
         dfRet = dfRet / dfPrice
+    else:
+        dfRet = dfRet.copy()
     if b_human:  
         data2 = dfRet * dData['close']
         data3 = pand.DataFrame({"Raw":data2[data2.columns[0]]})
@@ -214,13 +222,13 @@ def featSTD( dData, lLookback=20, bRel=True,  b_human=False ):
     @return: DataFrame array containing values
     '''
     
-    dfPrice = dData['close'].copy()
-    
-    tsu.returnize1(dfPrice.values)
-    dfRet = pand.rolling_std(dfPrice, lLookback)
+    dfPrice = _returns(dData, 1, 'close')
+    dfRet = _rolling(dData, 'std', 'close', lLookback, lReturns=1)
     
     if bRel:
         dfRet = dfRet / dfPrice
+    else:
+        dfRet = dfRet.copy()
     if b_human:
         for sym in dData['close']:
             x=1000/dData['close'][sym][0]
@@ -242,16 +250,14 @@ def featRSI( dData, lLookback=14,  b_human=False):
     dfDelta.ix[1:,:] -= dfDelta.ix[:-1,:].values
     dfDelta.ix[0,:] = np.NAN
 
-    dfDeltaUp = dfDelta
-    dfDeltaDown = dfDelta.copy()
-    
-    # seperate data into positive and negative for easy calculations
-    for sColumn in dfDeltaUp.columns:
-        tsColDown = dfDeltaDown[sColumn]
-        tsColDown[tsColDown >= 0] = 0 
-        
-        tsColUp = dfDeltaUp[sColumn]
-        tsColUp[tsColUp <= 0] = 0
+    # seperate data into positive and negative for easy calculations, nans are kept
+    naDelta = dfDelta.values
+    naDeltaUp = naDelta.copy()
+    naDeltaUp[naDelta <= 0] = 0
+    naDeltaDown = naDelta.copy()
+    naDeltaDown[naDelta >= 0] = 0
+    dfDeltaUp = pand.DataFrame( index=dfDelta.index, columns=dfDelta.columns, data=naDeltaUp )
+    dfDeltaDown = pand.DataFrame( index=dfDelta.index, columns=dfDelta.columns, data=naDeltaDown )
     
     # Note we take abs() of negative values, all should be positive now
     dfRolUp = pand.rolling_mean(dfDeltaUp, lLookback, min_periods=1)
@@ -285,7 +291,7 @@ def featDrawDown( dData, lLookback=30,  b_human=False):
     #''' Feature DataFrame will be 1:1, we can use the price as a template '''
     dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )
     
-    dfMax = pand.rolling_max(dfPrice, lLookback)
+    dfMax = _rolling(dData, 'max', 'close', lLookback)
     return (dfMax - dfPrice) / dfMax;
     
     if b_human:
@@ -307,7 +313,7 @@ def featRunUp( dData, lLookback=30, b_human=False ):
     
     dfPrice = dData['close']
     
-    dfMax = pand.rolling_min(dfPrice, lLookback)
+    dfMax = _rolling(dData, 'min', 'close', lLookback)
     return dfPrice / dfMax;
             
     if b_human:
@@ -329,8 +335,8 @@ def featVolumeDelta( dData, lLookback=30, b_human=False ):
     
     dfVolume = dData['volume']
     
-    dfRet = pand.rolling_mean(dfVolume, lLookback)
-    dfRet /= dfVolume
+    dfRet = _rolling(dData, 'mean', 'volume', lLookback)
+    dfRet = dfRet / dfVolume
         
     if b_human:
         for sym in dData['close']:
@@ -350,21 +356,33 @@ def featAroon( dData, bDown=False, lLookback=25, b_human=False ):
     '''
     
     dfPrice = dData['close']
+    naPrice = dfPrice.values
+    lRows = naPrice.shape[0]
+
+    #''' Row i looks at prices i+1 back to i-lLookback+2, newest first. Those
+    #are windows of the reversed prices, taken as strided views '''
+    naRet = np.zeros(dfPrice.shape)
+    naRet[:lLookback - 1, :] = np.NAN
+    if lRows > lLookback:
+        naRev = naPrice[::-1, :]
+        naWindows = np.lib.stride_tricks.as_strided(naRev,
+                        shape=(lRows - lLookback, lLookback, naPrice.shape[1]),
+                        strides=(naRev.strides[0],) + naRev.strides)
+        if bDown:
+            naRet[lLookback - 1:-1, :] = naWindows.argmin(axis=1)[::-1, :]
+        else:
+            naRet[lLookback - 1:-1, :] = naWindows.argmax(axis=1)[::-1, :]
 
-    #''' Feature DataFrame will be 1:1, we can use the price as a template '''
-    dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, 
-                            data=np.zeros(dfPrice.shape) )
-    
-    #''' Loop through time '''
-    for i in range(dfPrice.shape[0]):
-        if( (i-lLookback)+1 < 0 ):
-            dfRet.ix[i,:] = np.NAN
+    #''' The last row has no next day, so its window is one shorter '''
+    if lRows >= lLookback:
+        if bDown:
+            naRet[-1, :] = naPrice[:lRows - lLookback:-1, :].argmin(axis=0)
         else:
-            if bDown:
-                dfRet.ix[i,:] = dfPrice.values[i+1:(i-lLookback)+1:-1,:].argmin(axis=0)
-            else:
-                dfRet.ix[i,:] = dfPrice.values[i+1:(i-lLookback)+1:-1,:].argmax(axis=0)
-    
+            naRet[-1, :] = naPrice[:lRows - lLookback:-1, :].argmax(axis=0)
+
+    #''' Feature DataFrame will be 1:1, we can use the price as a template '''
+    dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=naRet )
+
     dfRet = ((lLookback - 1.) - dfRet) / (lLookback - 1.) * 100.
 
     if b_human:
@@ -397,8 +415,8 @@ def featStochastic( dData, lLookback=14, bFast=True, lMA=3, b_human=False ):
 
     
     #''' Loop through stocks '''
-    dfLows = pand.rolling_min(dfLow, lLookback)
-    dfHighs = pand.rolling_max(dfHigh, lLookback)
+    dfLows = _rolling(dData, 'min', 'low', lLookback)
+    dfHighs = _rolling(dData, 'max', 'high', lLookback)
     
     dfStoch = (dfPrice - dfLows) / (dfHighs - dfLows)
             
@@ -426,8 +444,7 @@ def featBeta( dData, lLookback=14, sMarket='$SPX', b_human=False ):
     dfPrice = dData['close']
 
     #''' Calculate returns '''
-    dfRets = dfPrice.copy()
-    tsu.returnize1(dfRets.values)
+    dfRets = _returns(dData, 1, 'close')
 
     tsMarket = dfRets[sMarket]
 
@@ -451,38 +468,27 @@ def featBollinger( dData, lLookback=20, b_human=False ):
     '''
     if b_human:
         dfPrice = dData['close']
-        nstdsRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )
-        #average minus standard deviation
-        pstdsRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )      
-        data3 = pand.DataFrame({"Raw":dfPrice[dfPrice.columns[0]]})
-        for sym in dfPrice.columns:
+        
+        #''' Bands are taken over the prices each window has, std is the population std '''
+        naAvg, naStd = _windowMoments( dfPrice.values, lLookback, 0, 1 )
+        
+        #average plus and minus two standard deviations
+        dBands = {}
+        lsColumns = []
+        for i, sym in enumerate(dfPrice.columns):
             if sym != '$SPX' and sym != '$VIX':
-                tsPrice = dfPrice[sym]
-                nstdRet = nstdsRet[sym]
-                pstdRet = pstdsRet[sym]
-                for i in range(len(tsPrice.index)):
-                    if i < lLookback - 1:
-                        nstdRet[i] = float('nan')
-                        pstdRet[i] = float('nan')
-                        continue    
-                    fAvg = np.average( tsPrice[ i-(lLookback-1):i+1 ] )
-                    fStd = np.std( tsPrice[ i-(lLookback-1):i+1 ] )
-                    pstdRet[i] = fAvg+2.0*fStd
-                    nstdRet[i] = fAvg-2.0*fStd  
-                data3[sym] = dfPrice[sym]
-                data3[sym + " Lower"] = nstdsRet[sym]
-                data3[sym + " Upper"] = pstdsRet[sym]
-        del data3['Raw']
-        return data3
+                dBands[sym] = dfPrice[sym]
+                dBands[sym + " Lower"] = naAvg[:, i] - 2.0*naStd[:, i]
+                dBands[sym + " Upper"] = naAvg[:, i] + 2.0*naStd[:, i]
+                lsColumns.extend( [sym, sym + " Lower", sym + " Upper"] )
+        return pand.DataFrame( dBands, index=dfPrice.index, columns=lsColumns )
     else:
         dfPrice = dData['close']
-        #''' Feature DataFrame will be 1:1, we can use the price as a template '''
-        dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )
         
-        #''' Loop through stocks '''
-        dfAvg = pand.rolling_mean(dfPrice, lLookback)
-        dfStd = pand.rolling_std(dfPrice, lLookback)
-        return (dfPrice - dfAvg) / (2.0*dfStd)
+        #''' Mean and sample std of each window, shared with later calls '''
+        naAvg, naStd = _shared(dData, ('moments', 'close', lLookback, 1),
+                               lambda: _windowMoments( dfPrice.values, lLookback, 1 ))
+        return (dfPrice - naAvg) / (2.0*naStd)
 
 
 def featCorrelation( dData, lLookback=20, sRel='$SPX', b_human=False ):
@@ -500,9 +506,7 @@ def featCorrelation( dData, lLookback=20, sRel='$SPX', b_human=False ):
         raise KeyError( "%s not found in data provided to featCorrelation"%sRel )
        
     #''' Calculate returns '''
-    naRets = dfPrice.values.copy()
-    tsu.returnize1(naRets)
-    dfHistReturns = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=naRets )
+    dfHistReturns = _returns(dData, 1, 'close')
 
     #''' Feature DataFrame will be 1:1, we can use the price as a template '''
     dfRet = pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns, data=np.zeros(dfPrice.shape) )
@@ -584,5 +588,130 @@ def featRand( dData, b_human=False ):
     return dfRet
 
 
+def _shared( dData, tKey, fcCompute ):
+    '''
+    @summary: Returns the intermediate result tKey of a FeatureData, computed
+    by fcCompute the first time it is asked for
+    @param dData: Dictionary of data, results are only kept for FeatureData
+    @param tKey: Tuple naming the result
+    @param fcCompute: Function without arguments computing the result
+    @return: The result, which must not be modified
+    '''
+    dShared = getattr(dData, 'dShared', None)
+    if dShared is None:
+        return fcCompute()
+    if tKey not in dShared:
+        dShared[tKey] = fcCompute()
+    return dShared[tKey]
+
+
+def _returns( dData, lBase, sKey ):
+    '''
+    @summary: Daily returns of a data frame, see tsu.returnize0/returnize1
+    @param lBase: 0 for returns relative to 0, 1 for returns relative to 1
+    @param sKey: Data to take the returns of, e.g. 'close'
+    @return: DataFrame which must not be modified
+    '''
+    def fcCompute():
+        dfRet = dData[sKey].copy()
+        if lBase == 0:
+            tsu.returnize0(dfRet.values)
+        else:
+            tsu.returnize1(dfRet.values)
+        return dfRet
+    return _shared(dData, ('returns', lBase, sKey), fcCompute)
+
+
+def _rolling( dData, sStat, sKey, lLookback, lMinPeriods=None, lReturns=None ):
+    '''
+    @summary: Rolling statistic of a data frame, e.g. pand.rolling_mean
+    @param sStat: One of 'mean', 'std', 'sum', 'min' or 'max'
+    @param sKey: Data to take the statistic of, e.g. 'close'
+    @param lLookback: Window length
+    @param lMinPeriods: Passed on as min_periods if not None
+    @param lReturns: If 0 or 1, the statistic is taken over the returns of the
+                     data relative to 0 or 1
+    @return: DataFrame which must not be modified
+    '''
+    def fcCompute():
+        if lReturns is None:
+            dfData = dData[sKey]
+        else:
+            dfData = _returns(dData, lReturns, sKey)
+        fcRolling = getattr(pand, 'rolling_' + sStat)
+        if lMinPeriods is None:
+            return fcRolling(dfData, lLookback)
+        return fcRolling(dfData, lLookback, lMinPeriods)
+    return _shared(dData, ('rolling', sStat, sKey, lLookback, lMinPeriods, lReturns),
+                   fcCompute)
+
+
+def _windowMoments( naData, lLookback, lDdof, lMinPeriods=None ):
+    '''
+    @summary: Mean and std of the valid values in each lLookback day window of
+              every column. Both are taken from the deviations of the values
+              from the first valid one in the window, so unlike sums of squares
+              they do not cancel, and flat windows give the exact mean and a
+              std of 0.
+    @param naData: Days x symbols array, missing values are NaN
+    @param lDdof: 1 for the sample std, 0 for the population std
+    @param lMinPeriods: Windows with fewer valid values are NaN, if None a
+                        missing value makes the window NaN, like pand.rolling_std
+    @return: (means, stds) days x symbols arrays, NaN until the first full window
+    '''
+    naData = np.ascontiguousarray( naData, dtype=float )
+    if lMinPeriods is None:
+        lMinPeriods = lLookback
+    naAvg = np.zeros(naData.shape) + np.NAN
+    naStd = np.zeros(naData.shape) + np.NAN
+    lRows = naData.shape[0]
+    lWindows = lRows - lLookback + 1
+    if lWindows <= 0:
+        return naAvg, naStd
+
+    #''' Row of the first valid value at or after each day, lRows if there is none '''
+    naMissing = np.isnan( naData )
+    naNext = np.where( naMissing, lRows, np.arange(lRows)[:, np.newaxis] )
+    naNext = np.minimum.accumulate( naNext[::-1], axis=0 )[::-1]
+    naFirst = naData[np.minimum( naNext[:lWindows], lRows - 1 ), np.arange(naData.shape[1])]
+
+    naDev = np.zeros(naFirst.shape)
+    naSum = np.zeros(naFirst.shape)
+    naCount = np.zeros(naFirst.shape, dtype=int)
+    for i in range(lLookback):
+        np.subtract( naData[i:i + lWindows], naFirst, naDev )
+        naDev[naMissing[i:i + lWindows]] = 0.
+        naSum += naDev
+        naCount += ~naMissing[i:i + lWindows]
+    naMean = naFirst + naSum / np.maximum( naCount, 1 )
+
+    naSumSq = naSum
+    naSumSq[:] = 0.
+    for i in range(lLookback):
+        np.subtract( naData[i:i + lWindows], naMean, naDev )
+        naDev[naMissing[i:i + lWindows]] = 0.
+        np.multiply( naDev, naDev, naDev )
+        naSumSq += naDev
+
+    naShort = naCount < max( lMinPeriods, 1 )
+    naMean[naShort] = np.NAN
+    naSumSq[naShort | (naCount <= lDdof)] = np.NAN
+    naAvg[lLookback - 1:] = naMean
+    naStd[lLookback - 1:] = np.sqrt( naSumSq / np.maximum( naCount - lDdof, 1 ) )
+    return naAvg, naStd
+
+
+def _broadcast_days( dfPrice, lfDays ):
+    '''
+    @summary: Builds a feature that has the same value for every symbol
+    @param dfPrice: Price DataFrame to use as a template
+    @param lfDays: One value per day of the index
+    @return: DataFrame array containing values
+    '''
+    naDays = np.array(lfDays, dtype=float).reshape(-1, 1)
+    return pand.DataFrame( index=dfPrice.index, columns=dfPrice.columns,
+                           data=np.repeat(naDays, dfPrice.shape[1], axis=1) )
+
+
 if __name__ == '__main__':
     pass
@@ -12,14 +12,19 @@ Created on Nov 7, 2011
 '''
 
 ''' Python imports '''
-import math
+import os
+import json
 import pickle
+import hashlib
 import inspect
+import ctypes
+import multiprocessing as mp
 import datetime as dt
 from dateutil.relativedelta import relativedelta
 
 ''' 3rd Party Imports '''
 import numpy as np
+import pandas as pand
 import matplotlib.pyplot as plt
 
 
@@ -29,71 +34,303 @@ from qstkutil import DataAccess as da
 from qstkutil import DataEvolved as de
 from qstkutil import qsdateutil as du
 from qstkutil import tsutil as tsu
+from qstkutil import utils
 
 from qstkfeat.features import *
 from qstkfeat.classes import class_fut_ret
 
 
 
-def getMarketRel( dData, sRel='$SPX' ):
+def getMarketRel( dData, sRel='$SPX', lsKeys=None ):
     '''
     @summary: Calculates market relative data.
     @param dData - Dictionary containing data to be used, requires specific naming: open/high/low/close/volume
     @param sRel - Stock ticker to make the data relative to, $SPX is default.
+    @param lsKeys - Keys of dData to make market relative, if None, all of them
     @return: Dictionary of market relative values
     '''
     
+    _checkMarketRel( dData, sRel )
+    
+    if lsKeys == None:
+        lsKeys = dData.keys()
+    
+    dRet = {}
+    naCloseMark = _closeMark( dData['close'], sRel )
+    
+    #Make all data market relative, except for volume
+    for sKey in lsKeys:
+        dRet[sKey] = _marketRelKey( dData, sKey, sRel, naCloseMark )
+
+    #print dRet 
+    return dRet
+
+
+def _checkMarketRel( dData, sRel ):
     # the close dataframe is assumed to be in the dictionary data
     # otherwise the function will NOT WORK!
     if sRel not in dData['close'].columns:
         raise KeyError( 'Market relative stock %s not found in getMR()'%sRel )
+
+
+def _closeMark( dfClose, sRel ):
+    '''
+    @summary: Close of every symbol if its daily returns had been its returns
+              over those of sRel, starting from 100
+    @return: Days x symbols array
+    '''
+    naCloseMark = dfClose.values.copy()
+    tsu.returnize0( naCloseMark )
+    iRel = list(dfClose.columns).index( sRel )
+    naCloseMark = (naCloseMark - naCloseMark[:, iRel:iRel + 1]) + 1.
+    naCloseMark[0, :] = 100.
     
+    ''' Nans are skipped over, as DataFrame.cumprod does '''
+    naNan = np.isnan( naCloseMark )
+    np.putmask( naCloseMark, naNan, 1. )
+    naCloseMark = naCloseMark.cumprod( axis=0 )
+    np.putmask( naCloseMark, naNan, np.NAN )
+    return naCloseMark
+
+
+def _marketRelKey( dData, sKey, sRel, naCloseMark ):
+    '''
+    @summary: Makes one key of dData market relative, see getMarketRel
+    @param naCloseMark: Market relative close, see _closeMark
+    @return: DataFrame
+    '''
+    # Don't calculate market relative volume, but still copy it over 
+    if sKey == 'volume':
+        return dData['volume']
     
-    dRet = {}
+    dfKey = dData[sKey]
+    dfClose = dData['close']
+    
+    ''' Frames with other dates or symbols than close are aligned by pandas '''
+    if not (dfKey.index.equals(dfClose.index) and list(dfKey.columns) == list(dfClose.columns)):
+        dfRet = pand.DataFrame( index=dfClose.index, columns=dfClose.columns,
+                                data=naCloseMark ) * (dfKey / dfClose)
+        dfRet[sRel] = dfKey[sRel]
+        return dfRet
+    
+    naRet = naCloseMark * (dfKey.values / dfClose.values)
+    
+    #Comment the line below to convert the sRel as well, uncomment it
+    #to keep the relative symbol's raw data
+    iRel = list(dfClose.columns).index( sRel )
+    naRet[:, iRel] = dfKey.values[:, iRel]
+    return pand.DataFrame( index=dfClose.index, columns=dfClose.columns, data=naRet )
+
 
-    dfClose = dData['close'].copy()
+class MarketRelData(FeatureData):
+    '''
+    @summary: Market relative data, see getMarketRel. Each key is only made
+    market relative the first time it is read, features that only read close
+    never pay for the other keys.
+    '''
+    def __init__(self, dData, sRel='$SPX'):
+        '''
+        @param dData: Dictionary of data to make market relative
+        @param sRel: Stock ticker to make the data relative to
+        '''
+        _checkMarketRel( dData, sRel )
+        FeatureData.__init__(self, dict.fromkeys(dData))
+        self.dData = dData
+        self.sRel = sRel
+        self.naCloseMark = None
     
-    dfCloseMark = dfClose.copy()
-    tsu.returnize0(  dfCloseMark.values )
-    dfCloseMark = (dfCloseMark - dfCloseMark[sRel]) + 1.
-    dfCloseMark.ix[0, :] = 100.
-    dfCloseMark = dfCloseMark.cumprod(axis=0)
+    def __getitem__(self, sKey):
+        dfRet = dict.__getitem__(self, sKey)
+        if dfRet is None:
+            if self.naCloseMark is None:
+                self.naCloseMark = _closeMark( self.dData['close'], self.sRel )
+            dfRet = _marketRelKey( self.dData, sKey, self.sRel, self.naCloseMark )
+            dict.__setitem__(self, sKey, dfRet)
+        return dfRet
     
-    #print dfCloseMark
-    #Make all data market relative, except for volume
-    for sKey in dData.keys():
-        
-        # Don't calculate market relative volume, but still copy it over 
-        if sKey == 'volume':
-            dRet['volume'] = dData['volume']
-            continue
+    def get(self, sKey, oDefault=None):
+        if sKey in self:
+            return self[sKey]
+        return oDefault
+    
+    def values(self):
+        return [self[sKey] for sKey in self]
+    
+    def items(self):
+        return [(sKey, self[sKey]) for sKey in self]
+    
+    def itervalues(self):
+        return iter(self.values())
+    
+    def iteritems(self):
+        return iter(self.items())
 
-        dfKey = dData[sKey]
-        dfRatio = dfKey/dfClose
-        
-        
-        #Add dataFrame to dictionary to return, move to next key 
-        dRet[sKey] = dfCloseMark * dfRatio
-        
-        #Comment the line below to convert the sRel as well, uncomment it
-        #to keep the relative symbol's raw data
-        dRet[sKey][sRel] = dData[sKey][sRel]
 
-    #print dRet 
-    return dRet
 
+# Files of a feature store, see saveFeatures
+FEATURE_MANIFEST = 'manifest.json'
+FEATURE_DATES = 'dates.npy'
+FEATURE_SYMBOLS = 'symbols.txt'
+
+_DT_EPOCH = dt.datetime(1970, 1, 1)
+
+# Arguments naming the symbol a feature compares every other symbol with
+_MARKET_ARGS = ['sMarket', 'sRel', 's_rel']
 
+# Inputs and features of a feature worker process, see _initFeatureWorker
+_dFeatureWorker = {}
+
+
+def _initFeatureWorker( rawData, tShape, lsKeys, ldtIndex, lsColumns, lfcFeatures, ldArgs ):
+    '''
+    @summary: Pool initializer, maps the shared input arrays in the worker.
+    '''
+    naAll = np.frombuffer(rawData).reshape(tShape)
+    _dFeatureWorker['data'] = [dict(zip(lsKeys, naSet)) for naSet in naAll]
+    _dFeatureWorker['index'] = ldtIndex
+    _dFeatureWorker['columns'] = lsColumns
+    _dFeatureWorker['features'] = lfcFeatures
+    _dFeatureWorker['args'] = ldArgs
+    _dFeatureWorker['shards'] = {}
 
-def applyFeatures( dData, lfcFeatures, ldArgs, sMarketRel=None, sLog=None, bMin=False ):
+
+def _featureWorker( tTask ):
+    '''
+    @summary: Applies one feature to one shard of columns.
+    @param tTask: (feature number, data set number, columns, columns to keep)
+    @return: DataFrame of the feature values of the kept columns
+    '''
+    iFeature, iSet, tiCols, lKeep = tTask
+
+    #''' Features on the same shard share intermediate results '''
+    dShards = _dFeatureWorker['shards']
+    if (iSet, tiCols) not in dShards:
+        lsCols = [_dFeatureWorker['columns'][i] for i in tiCols]
+        #''' A block of adjacent columns is a view of the shared arrays '''
+        if list(tiCols) == range(tiCols[0], tiCols[-1] + 1):
+            oCols = slice(tiCols[0], tiCols[-1] + 1)
+        else:
+            oCols = list(tiCols)
+        dShards[(iSet, tiCols)] = FeatureData( dict(
+            (sKey, pand.DataFrame( index=_dFeatureWorker['index'], columns=lsCols,
+                                   data=naData[:, oCols] ))
+            for sKey, naData in _dFeatureWorker['data'][iSet].iteritems()) )
+
+    dfRet = _dFeatureWorker['features'][iFeature]( dShards[(iSet, tiCols)],
+                                                   **_dFeatureWorker['args'][iFeature] )
+    if lKeep < len(tiCols):
+        dfRet = dfRet.reindex( columns=[_dFeatureWorker['columns'][i] for i in tiCols[:lKeep]] )
+    return dfRet
+
+
+def _marketSymbol( fcFeature, dArgs ):
+    '''
+    @summary: Symbol the feature compares every other symbol with, if any.
+    '''
+    lsArgs, _, _, tDefaults = inspect.getargspec(fcFeature)
+    tDefaults = tDefaults or ()
+    dDefaults = dict(zip(lsArgs[len(lsArgs) - len(tDefaults):], tDefaults))
+    for sArg in _MARKET_ARGS:
+        if sArg in dArgs:
+            return dArgs[sArg]
+        if sArg in dDefaults:
+            return dDefaults[sArg]
+    return None
+
+
+def _applyParallel( ldData, lbRelative, lfcFeatures, ldArgs, lWorkers, lShards ):
+    '''
+    @summary: Applies features on a pool of processes, see applyFeatures.
+    The data is copied once into shared memory, every feature and shard of
+    columns is a separate task.
+    @param ldData: Data dictionaries, raw and possibly market relative
+    @param lbRelative: For each feature, True if it uses the market relative data
+    @return: list of dataframes containing values, in the order of lfcFeatures
+    '''
+    dfClose = ldData[0]['close']
+    lsKeys = ldData[0].keys()
+    tShape = (len(ldData), len(lsKeys)) + dfClose.shape
+    rawData = mp.RawArray(ctypes.c_double, int(np.prod(tShape)))
+    naAll = np.frombuffer(rawData).reshape(tShape)
+    for iSet, dSet in enumerate(ldData):
+        for iKey, sKey in enumerate(lsKeys):
+            naAll[iSet, iKey] = dSet[sKey].values
+
+    lsColumns = list(dfClose.columns)
+    lShards = max(1, min(lShards, len(lsColumns)))
+    liBounds = np.linspace(0, len(lsColumns), lShards + 1).astype(int)
+
+    #''' Shards include the market symbol of features that compare against it '''
+    ltTasks = []
+    for i, fcFeature in enumerate(lfcFeatures):
+        sMarket = _marketSymbol( fcFeature, ldArgs[i] )
+        for iStart, iEnd in zip(liBounds[:-1], liBounds[1:]):
+            liCols = range(iStart, iEnd)
+            if lShards > 1 and sMarket in lsColumns and \
+               lsColumns.index(sMarket) not in liCols:
+                liCols.append( lsColumns.index(sMarket) )
+            ltTasks.append( (i, int(lbRelative[i]), tuple(liCols), iEnd - iStart) )
+
+    pool = mp.Pool( lWorkers, _initFeatureWorker, (rawData, tShape, lsKeys,
+                    dfClose.index, lsColumns, lfcFeatures, ldArgs) )
+    try:
+        ldfShards = pool.map( _featureWorker, ltTasks, 1 )
+    finally:
+        pool.close()
+        pool.join()
+
+    #''' Put the shards of each feature back side by side '''
+    ldfRet = []
+    for i in range(len(lfcFeatures)):
+        ldfFeat = ldfShards[i * lShards:(i + 1) * lShards]
+        if len(ldfFeat) == 1:
+            ldfRet.append( ldfFeat[0] )
+        else:
+            ldfRet.append( pand.DataFrame( index=ldfFeat[0].index,
+                columns=[sCol for dfFeat in ldfFeat for sCol in dfFeat.columns],
+                data=np.hstack([dfFeat.values for dfFeat in ldfFeat]) ) )
+    return ldfRet
+
+
+def _popMarketRel( dArgs, sMarketRel ):
+    '''
+    @summary: Checks for the special 'MR' argument and removes it
+    @return: True if the feature is to use market relative data
+    '''
+    if 'MR' not in dArgs:
+        return False
+
+    if dArgs['MR'] == False:
+        print 'Warning, setting MR to false will still be Market Relative',\
+              'simply do not include MR key in args'
+
+    if sMarketRel == None:
+        raise AssertionError('Functions require market relative stock but sMarketRel=None')
+    del dArgs['MR']
+    return True
+
+
+def applyFeatures( dData, lfcFeatures, ldArgs, sMarketRel=None, sLog=None, bMin=False,
+                   lWorkers=1, lShards=1, cCache=None ):
     '''
     @summary: Calculates the feature values using a list of feature functions and arguments.
     @param dData - Dictionary containing data to be used, requires specific naming: open/high/low/close/volume
+                   If it is a FeatureData, intermediate results and market relative
+                   data are kept in it for later calls on the same data
     @param lfcFeatures: List of feature functions, most likely coming from features.py
     @param ldArgs: List of dictionaries containing arguments, passed as **kwargs
                    There is a special argument 'MR', if it exists, the data will be made market relative
     @param sMarketRel: If not none, the data will all be made relative to the symbol provided
-    @param sLog: If not None, will be filename to log all of the features to 
+    @param sLog: If not None, directory to write a feature store with all of the
+                 features to, see saveFeatures and loadFeatures
     @param bMin: If true, only run for the last day
+    @param lWorkers: If more than 1, features are applied on that many processes.
+                     The data frames are then passed as floats, through shared memory.
+                     Not used with bMin.
+    @param lShards: Number of column shards each feature is split into when
+                    lWorkers is more than 1. Features must treat columns independently,
+                    except for the symbol named by their sMarket/sRel argument.
+    @param cCache: If not None, a FeatureCache, only features it does not have are calculated
     @return: list of dataframes containing values
     '''
 
@@ -102,103 +339,357 @@ def applyFeatures( dData, lfcFeatures, ldArgs, sMarketRel=None, sLog=None, bMin=
         
     ldfRet = []
     
-    ''' Calculate market relative data '''
-    if sMarketRel != None:
-        dDataRelative = getMarketRel( dData, sRel=sMarketRel )
+    ''' Log the arguments as given, MR is removed from them below '''
+    if not sLog == None:
+        ldArgsLog = [dict(dArgs) for dArgs in ldArgs]
+    
+    ''' Only calculate the features missing from the cache '''
+    if cCache != None:
+        sData = cCache.fingerprint( dData )
+        lsKeys = [cCache.key( fcFeature, ldArgs[i], sData, sMarketRel, bMin )
+                  for i, fcFeature in enumerate(lfcFeatures)]
+        ldfRet = [cCache.get( sKey ) for sKey in lsKeys]
+        liMissing = [i for i, dfFeat in enumerate(ldfRet) if dfFeat is None]
+        
+        ''' MR is removed from cached features' arguments too '''
+        for i in range(len(lfcFeatures)):
+            if ldfRet[i] is not None:
+                _popMarketRel( ldArgs[i], sMarketRel )
+        
+        ldfNew = applyFeatures( dData, [lfcFeatures[i] for i in liMissing],
+                                [ldArgs[i] for i in liMissing], sMarketRel, bMin=bMin,
+                                lWorkers=lWorkers, lShards=lShards )
+        for i, dfFeat in zip(liMissing, ldfNew):
+            cCache.put( lsKeys[i], dfFeat )
+            ldfRet[i] = dfFeat
+        
+        if not sLog == None:
+            saveFeatures( sLog, ldfRet, lfcFeatures, ldArgsLog )
+        return ldfRet
     
+    ''' Features applied to the same data share returns and rolling windows,
+    pass a FeatureData to share them with later calls as well '''
+    if not isinstance(dData, FeatureData):
+        dData = FeatureData( dData )
     
-    ''' Loop though feature functions, pass each data dictionary and arguments '''
-    for i, fcFeature in enumerate(lfcFeatures):
-        #dt_start = dt.datetime.now()
-        #print fcFeature, ldArgs[i], ' in:',
-        ''' Check for special arguments '''
-        if 'MR' in ldArgs[i]:
-            
-            if ldArgs[i]['MR'] == False:
-                print 'Warning, setting MR to false will still be Market Relative',\
-                      'simply do not include MR key in args'
-        
-            if sMarketRel == None:
-                raise AssertionError('Functions require market relative stock but sMarketRel=None')
-            del ldArgs[i]['MR']
-            if bMin:
-                # bMin means only calculate the LAST row of the stock
-                dTmp = {}
-                for sKey in dDataRelative:
-                    if 'i_bars' in ldArgs[i]:
-                        dTmp[sKey] = dDataRelative[sKey].ix[ 
-                                     -(ldArgs[i]['lLookback'] + 
-                                     ldArgs[i]['i_bars']+1):]
-                    else:  
-                        if 'lLookback' not in ldArgs[i]:
-                            d_defaults = inspect.getargspec(fcFeature).defaults
-                            d_args = inspect.getargspec(fcFeature).args
-                            i_diff = len(d_args) - len(d_defaults)
-                            i_index = d_args.index('lLookback') - i_diff
-                            i_cut = -(d_defaults[i_index]+1)
-                            dTmp[sKey] = dDataRelative[sKey].ix[i_cut:]
-                            #print fcFeature.__name__ + ":" + str(i_cut)
-                            
-                        else:   
+    ''' Market relative data, each key is calculated when a feature first reads it '''
+    if sMarketRel != None:
+        tRelKey = ('market_rel', sMarketRel)
+        if tRelKey not in dData.dShared:
+            dData.dShared[tRelKey] = MarketRelData( dData, sMarketRel )
+        dDataRelative = dData.dShared[tRelKey]
+    
+    
+    ''' Run the features on a pool of processes '''
+    if lWorkers > 1 and not bMin:
+        lbRelative = [_popMarketRel( dArgs, sMarketRel ) for dArgs in ldArgs]
+        ldData = [dData]
+        if sMarketRel != None:
+            ldData.append( dDataRelative )
+        ldfRet = _applyParallel( ldData, lbRelative, lfcFeatures, ldArgs, lWorkers, lShards )
+    else:
+        ''' Loop though feature functions, pass each data dictionary and arguments '''
+        for i, fcFeature in enumerate(lfcFeatures):
+            #dt_start = dt.datetime.now()
+            #print fcFeature, ldArgs[i], ' in:',
+            ''' Check for special arguments '''
+            if _popMarketRel( ldArgs[i], sMarketRel ):
+                if bMin:
+                    # bMin means only calculate the LAST row of the stock
+                    dTmp = {}
+                    for sKey in dDataRelative:
+                        if 'i_bars' in ldArgs[i]:
                             dTmp[sKey] = dDataRelative[sKey].ix[ 
-                                         -(ldArgs[i]['lLookback'] + 1):]  
-                ldfRet.append( fcFeature( dTmp, **ldArgs[i] ).ix[-1:] )
-            else:
-                ldfRet.append( fcFeature( dDataRelative, **ldArgs[i] ) )
+                                         -(ldArgs[i]['lLookback'] + 
+                                         ldArgs[i]['i_bars']+1):]
+                        else:  
+                            if 'lLookback' not in ldArgs[i]:
+                                d_defaults = inspect.getargspec(fcFeature).defaults
+                                d_args = inspect.getargspec(fcFeature).args
+                                i_diff = len(d_args) - len(d_defaults)
+                                i_index = d_args.index('lLookback') - i_diff
+                                i_cut = -(d_defaults[i_index]+1)
+                                dTmp[sKey] = dDataRelative[sKey].ix[i_cut:]
+                                #print fcFeature.__name__ + ":" + str(i_cut)
+                            
+                            else:   
+                                dTmp[sKey] = dDataRelative[sKey].ix[ 
+                                             -(ldArgs[i]['lLookback'] + 1):]  
+                    ldfRet.append( fcFeature( dTmp, **ldArgs[i] ).ix[-1:] )
+                else:
+                    ldfRet.append( fcFeature( dDataRelative, **ldArgs[i] ) )
         
 
                 
-        else:
-            if bMin:
-                # bMin means only calculate the LAST row of the stock
-                dTmp = {}
-                for sKey in dData:
-                    if 'i_bars' in ldArgs[i]:
-                        dTmp[sKey] = dData[sKey].ix[ 
-                                     -(ldArgs[i]['lLookback'] + 
-                                     ldArgs[i]['i_bars']+1):]
-                       
-                    else:    
-                        if 'lLookback' not in ldArgs[i]:
-                            d_defaults = inspect.getargspec(fcFeature).defaults
-                            d_args = inspect.getargspec(fcFeature).args
-                            i_diff = len(d_args) - len(d_defaults)
-                            i_index = d_args.index('lLookback') - i_diff
-                            i_cut = -(d_defaults[i_index]+1)
-                            dTmp[sKey] = dData[sKey].ix[i_cut:]
-                            #print fcFeature.__name__ + ":" + str(i_cut)
-                        else:   
+            else:
+                if bMin:
+                    # bMin means only calculate the LAST row of the stock
+                    dTmp = {}
+                    for sKey in dData:
+                        if 'i_bars' in ldArgs[i]:
                             dTmp[sKey] = dData[sKey].ix[ 
-                                     -(ldArgs[i]['lLookback'] + 1):]
+                                         -(ldArgs[i]['lLookback'] + 
+                                         ldArgs[i]['i_bars']+1):]
+                       
+                        else:    
+                            if 'lLookback' not in ldArgs[i]:
+                                d_defaults = inspect.getargspec(fcFeature).defaults
+                                d_args = inspect.getargspec(fcFeature).args
+                                i_diff = len(d_args) - len(d_defaults)
+                                i_index = d_args.index('lLookback') - i_diff
+                                i_cut = -(d_defaults[i_index]+1)
+                                dTmp[sKey] = dData[sKey].ix[i_cut:]
+                                #print fcFeature.__name__ + ":" + str(i_cut)
+                            else:   
+                                dTmp[sKey] = dData[sKey].ix[ 
+                                         -(ldArgs[i]['lLookback'] + 1):]
                    
-                ldfRet.append( fcFeature( dTmp, **ldArgs[i] ).ix[-1:] )
-            else:
-                ldfRet.append( fcFeature( dData, **ldArgs[i] ) )
-        #print  dt.datetime.now() - dt_start
+                    ldfRet.append( fcFeature( dTmp, **ldArgs[i] ).ix[-1:] )
+                else:
+                    ldfRet.append( fcFeature( dData, **ldArgs[i] ) )
+            #print  dt.datetime.now() - dt_start
 
     
     if not sLog == None:
-        with open( sLog, 'wb' ) as fFile:
-            pickle.dump( ldfRet, fFile, -1 )
+        saveFeatures( sLog, ldfRet, lfcFeatures, ldArgsLog )
         
     return ldfRet
 
-def loadFeatures( sLog ):
+
+def _dateKeys( ldtDates ):
+    ''' Microseconds since 1970 of each timestamp '''
+    ltdSince = [dtDate - _DT_EPOCH for dtDate in ldtDates]
+    return np.array([(tdSince.days * 86400 + tdSince.seconds) * 10**6 + tdSince.microseconds
+                     for tdSince in ltdSince], dtype=np.int64)
+
+
+def _readManifest( sLog ):
+    ''' Entries of a feature store manifest '''
+    with open( os.path.join(sLog, FEATURE_MANIFEST), 'r' ) as fFile:
+        return json.load( fFile )
+
+
+def _manifestArgs( dArgs ):
+    '''
+    @summary: Arguments as a feature store manifest holds them. Values json
+              can not hold are kept as their repr, tuples come back as lists.
+    '''
+    dRet = {}
+    for sArg, oVal in dArgs.iteritems():
+        try:
+            json.dumps( oVal )
+        except (TypeError, ValueError):
+            oVal = repr( oVal )
+        dRet[str(sArg)] = oVal
+    return dict( (str(sArg), oVal) for sArg, oVal in json.loads( json.dumps(dRet) ).iteritems() )
+
+
+def saveFeatures( sLog, ldfFeatures, lfcFeatures, ldArgs ):
+    '''
+    @summary: Writes features to a feature store. That is a directory with one
+    dates x columns float64 file per feature, the dates all of them share, the
+    symbols of the first one, and a manifest with the function name, arguments
+    and columns of each feature.
+    @param sLog: Directory to write to, created if needed
+    @param ldfFeatures: List of feature dataframes, all with the index of the first
+    @param lfcFeatures: Feature functions the dataframes come from
+    @param ldArgs: Arguments the feature functions were called with
+    @return: None
+    '''
+    if not os.path.isdir( sLog ):
+        os.makedirs( sLog )
+    
+    ldtIndex = []
+    lsSym = []
+    if len(ldfFeatures) > 0:
+        ldtIndex = ldfFeatures[0].index
+        lsSym = list(ldfFeatures[0].columns)
+    
+    ldEntries = []
+    for i, dfFeat in enumerate(ldfFeatures):
+        if not dfFeat.index.equals(ldfFeatures[0].index):
+            raise ValueError('Feature %d does not have the dates of the first one' % i)
+        sFile = 'feature%d.dat' % i
+        np.asarray(dfFeat.values, dtype=np.float64).tofile( os.path.join(sLog, sFile) )
+        ldEntries.append( {'name': lfcFeatures[i].__name__, 'args': _manifestArgs(ldArgs[i]),
+                           'columns': [str(sCol) for sCol in dfFeat.columns], 'file': sFile} )
+    
+    np.save( os.path.join(sLog, FEATURE_DATES), _dateKeys(ldtIndex) )
+    with open( os.path.join(sLog, FEATURE_SYMBOLS), 'w' ) as fFile:
+        for sSym in lsSym:
+            fFile.write( sSym + '\n' )
+    
+    ''' Manifest last, a store without one is incomplete '''
+    with open( os.path.join(sLog, FEATURE_MANIFEST), 'w' ) as fFile:
+        json.dump( ldEntries, fFile, indent=1 )
+
+
+def listFeatures( sLog ):
+    '''
+    @summary: Lists the features in a feature store.
+    @param sLog: Directory written by saveFeatures
+    @return: List of (function name, arguments) pairs, in the order of the store.
+             Arguments json can not hold are given as their repr.
+    '''
+    return [(str(dEntry['name']), dict((str(sArg), oVal) for sArg, oVal in dEntry['args'].iteritems()))
+            for dEntry in _readManifest( sLog )]
+
+
+def loadFeatures( sLog, lFeatures=None, dtStart=None, dtEnd=None ):
     '''
     @summary: Loads cached features.
-    @param sLog: Filename of features.
-    @return: Numpy array containing values
+    @param sLog: Feature store written by applyFeatures, older pickled logs are loaded whole
+    @param lFeatures: Features to load, each either a position in the store or a
+                      (function name, arguments) pair, as passed to saveFeatures
+                      or as returned by listFeatures.
+                      If None, all are loaded.
+    @param dtStart: First day to load, if None, from the first day in the store
+    @param dtEnd: Last day to load, if None, to the last day in the store
+    @return: list of dataframes containing values
     '''
     
     ldfRet = []
     
-    if not sLog == None:
+    if sLog == None:
+        return ldfRet
+    
+    if os.path.isfile( sLog ):
         with open( sLog, 'rb' ) as fFile:
             ldfRet = pickle.load( fFile )
+        return ldfRet
+    
+    ltFeatures = listFeatures( sLog )
+    ldEntries = _readManifest( sLog )
+    if lFeatures == None:
+        lFeatures = range(len(ltFeatures))
+    
+    naDates = np.load( os.path.join(sLog, FEATURE_DATES) )
+    with open( os.path.join(sLog, FEATURE_SYMBOLS), 'r' ) as fFile:
+        lsSym = [sLine.strip() for sLine in fFile if sLine.strip()]
+    
+    ''' Stores written before features had their own columns hold the symbols '''
+    llsColumns = [[str(sCol) for sCol in dEntry.get('columns', lsSym)] for dEntry in ldEntries]
+    
+    ''' Only the rows of the requested days are read from each file '''
+    iStart = 0
+    iEnd = len(naDates)
+    if dtStart != None:
+        iStart = np.searchsorted( naDates, _dateKeys([dtStart])[0], side='left' )
+    if dtEnd != None:
+        iEnd = np.searchsorted( naDates, _dateKeys([dtEnd])[0], side='right' )
+    ldtIndex = [_DT_EPOCH + dt.timedelta(microseconds=int(iKey)) for iKey in naDates[iStart:iEnd]]
+    
+    for oFeature in lFeatures:
+        if isinstance(oFeature, tuple):
+            sName, dArgs = oFeature
+            if (sName, _manifestArgs(dArgs)) not in ltFeatures:
+                raise KeyError( 'Feature %s %s not found in %s' % (sName, dArgs, sLog) )
+            oFeature = ltFeatures.index( (sName, _manifestArgs(dArgs)) )
+        
+        lsColumns = llsColumns[oFeature]
+        if len(naDates) * len(lsColumns) == 0:
+            naFeat = np.zeros( (iEnd - iStart, len(lsColumns)) )
+        else:
+            naFeat = np.memmap( os.path.join(sLog, ldEntries[oFeature]['file']), dtype=np.float64,
+                                mode='r', shape=(len(naDates), len(lsColumns)) )
+            naFeat = np.array( naFeat[iStart:iEnd] )
+        ldfRet.append( pand.DataFrame( index=ldtIndex, columns=lsColumns, data=naFeat ) )
         
     return ldfRet
 
 
+class FeatureCache(object):
+    '''
+    @summary: Keeps feature results so the same feature, with the same arguments,
+    on the same data is only calculated once. Results are kept in memory up to
+    lMaxBytes, least recently used first out, and optionally also written to
+    a directory so other runs can reuse them. Pass one to applyFeatures.
+    '''
+    
+    def __init__( self, lMaxBytes=2**29, sDir=None ):
+        '''
+        @param lMaxBytes: Size of the feature values kept in memory
+        @param sDir: If not None, directory every result is also pickled to,
+                     results evicted from memory are read back from it
+        '''
+        self.lMaxBytes = lMaxBytes
+        self.sDir = sDir
+        self.cResults = utils.LRUCache( lMaxBytes )
+        self.lHits = 0
+        self.lMisses = 0
+        if sDir != None and not os.path.isdir( sDir ):
+            os.makedirs( sDir )
+    
+    def fingerprint( self, dData ):
+        '''
+        @summary: Hashes the values, dates and symbols of a data dictionary
+        @return: Key, see utils.cache_key
+        '''
+        #''' The arrays are hashed on their own, a repr of their bytes would be as large again '''
+        ltParts = []
+        for sKey in sorted(dData):
+            dfData = dData[sKey]
+            naValues = np.ascontiguousarray( dfData.values, dtype=np.float64 )
+            ltParts.append( (sKey, list(dfData.columns),
+                             hashlib.sha1( _dateKeys(dfData.index).tostring() ).hexdigest(),
+                             hashlib.sha1( naValues.tostring() ).hexdigest()) )
+        return utils.cache_key( 'qstk-data', ltParts )
+    
+    def key( self, fcFeature, dArgs, sData, sMarketRel=None, bMin=False ):
+        '''
+        @summary: Key of a feature result, the arguments include the defaults
+                  of the feature function and the market symbol of 'MR' features
+        @param sData: Fingerprint of the data the feature is applied to
+        @return: Key, see utils.cache_key
+        '''
+        dKey = {}
+        tSpec = inspect.getargspec( fcFeature )
+        if tSpec.defaults != None:
+            dKey.update( zip(tSpec.args[-len(tSpec.defaults):], tSpec.defaults) )
+        dKey.update( dArgs )
+        if 'MR' in dKey:
+            dKey['MR'] = sMarketRel
+        
+        return utils.cache_key( 'qstk-feature', fcFeature.__module__, fcFeature.__name__,
+                                sorted(dKey.items()), bMin, sData )
+    
+    def get( self, sKey ):
+        '''
+        @return: Copy of the cached dataframe, None if there is none
+        '''
+        dfFeat = self.cResults.get( sKey )
+        if dfFeat is None and self.sDir != None and os.path.isfile( self._file(sKey) ):
+            with open( self._file(sKey), 'rb' ) as fFile:
+                dfFeat = pickle.load( fFile )
+            self.cResults.put( sKey, dfFeat )
+        
+        if dfFeat is None:
+            self.lMisses += 1
+            return None
+        
+        self.lHits += 1
+        return dfFeat.copy()
+    
+    def put( self, sKey, dfFeat ):
+        '''
+        @summary: Caches a copy of a feature dataframe
+        '''
+        dfFeat = dfFeat.copy()
+        if self.sDir != None:
+            with open( self._file(sKey), 'wb' ) as fFile:
+                pickle.dump( dfFeat, fFile, -1 )
+        self.cResults.put( sKey, dfFeat )
+    
+    def clear( self ):
+        '''
+        @summary: Empties the memory, files in sDir are kept
+        '''
+        self.cResults.clear()
+    
+    def _file( self, sKey ):
+        return os.path.join( self.sDir, sKey + '.pkl' )
+
+
 def stackSyms( ldfFeatures, dtStart=None, dtEnd=None, lsSym=None, sDelNan='ALL', bShowRemoved=False ):
     '''
     @summary: Remove symbols from the dataframes, effectively stacking all stocks on top of each other.
@@ -217,44 +708,33 @@ def stackSyms( ldfFeatures, dtStart=None, dtEnd=None, lsSym=None, sDelNan='ALL',
     if dtEnd == None:
         dtEnd = ldfFeatures[0].index[-1]
     
-    naRet = None
-    ''' Stack stocks vertically '''
-    for sStock in ldfFeatures[0].columns:
-        
-        if lsSym != None and sStock not in lsSym:
-            continue
+    lsStocks = [sStock for sStock in ldfFeatures[0].columns if lsSym == None or sStock in lsSym]
+    if len(lsStocks) == 0:
+        return None
 
-        naStkData = None
-        ''' Loop through all features, stacking columns horizontally '''
-        for dfFeat in ldfFeatures:
-            
-            dfFeat = dfFeat.ix[dtStart:dtEnd]
-            
-            if naStkData == None:
-                naStkData = np.array( dfFeat[sStock].values.reshape(-1,1) )
-            else:
-                naStkData = np.hstack( (naStkData, dfFeat[sStock].values.reshape(-1,1)) )
-   
-        ''' Remove nan rows possibly'''
-        if 'ALL' == sDelNan or 'FEAT' == sDelNan:
-            llValidRows = []
-            for i in range(naStkData.shape[0]):
-                
-                
-                if 'ALL' == sDelNan and not math.isnan( np.sum(naStkData[i,:]) ) or\
-                  'FEAT' == sDelNan and not math.isnan( np.sum(naStkData[i,:-1]) ):
-                    llValidRows.append(i)
-                elif  bShowRemoved:
-                    print 'Removed', sStock, naStkData[i,:]
-                        
-            naStkData = naStkData[llValidRows,:]
-            
-    
-        ''' Now stack each block of stock data vertically '''
-        if naRet == None:
-            naRet = naStkData
+    ''' Slice each feature once, stocks x days x features, then stack stocks vertically '''
+    naRet = None
+    for i, dfFeat in enumerate(ldfFeatures):
+        dfFeat = dfFeat.ix[dtStart:dtEnd]
+        naFeat = dfFeat.values[:, [dfFeat.columns.get_loc(sStock) for sStock in lsStocks]]
+        if naRet is None:
+            naRet = np.empty( (len(lsStocks), naFeat.shape[0], len(ldfFeatures)) )
+        naRet[:, :, i] = naFeat.T
+    lDays = naRet.shape[1]
+    naRet = naRet.reshape(-1, len(ldfFeatures))
+
+    ''' Remove nan rows possibly'''
+    if 'ALL' == sDelNan or 'FEAT' == sDelNan:
+        if 'ALL' == sDelNan:
+            naValid = ~np.isnan( np.sum(naRet, axis=1) )
         else:
-            naRet = np.vstack( (naRet, naStkData) )
+            naValid = ~np.isnan( np.sum(naRet[:, :-1], axis=1) )
+        
+        if bShowRemoved:
+            for i in np.where(~naValid)[0]:
+                print 'Removed', lsStocks[i // lDays], naRet[i, :]
+        
+        naRet = naRet[naValid, :]
 
     return naRet
 
@@ -406,11 +886,12 @@ def getFeatureFuncs():
     return lfcFeatures, ldArgs, lsNames
       
 
-def testFeature( fcFeature, dArgs ):
+def testFeature( fcFeature, dArgs, cCache=None ):
     '''
     @summary: Quick function to run a feature on some data and plot it to see if it works.
     @param fcFeature: Feature function to test
     @param dArgs: Arguments to pass into feature function 
+    @param cCache: Optional FeatureCache passed to applyFeatures
     @return: Void
     '''
     
@@ -439,7 +920,7 @@ def testFeature( fcFeature, dArgs ):
     
     ''' Generate a list of DataFrames, one for each feature, with the same index/column structure as price data '''
     dtStart = dt.datetime.now()
-    ldfFeatures = applyFeatures( dData, [fcFeature], [dArgs], sMarketRel='$SPX' )
+    ldfFeatures = applyFeatures( dData, [fcFeature], [dArgs], sMarketRel='$SPX', cCache=cCache )
     print 'Runtime:', dt.datetime.now() - dtStart
     
     ''' Use last 3 months of index, to avoid lookback nans '''
@@ -462,36 +943,40 @@ def testFeature( fcFeature, dArgs ):
 
     
     
-def speedTest(lfcFeature,ldArgs):
+def speedTest(lfcFeature,ldArgs,cCache=None,dData=None):
     '''
     @Author: Tingyu Zhu
     @summary: Function to test the runtime for a list of features, and output them by speed
     @param lfcFeature: a list of features that will be sorted by runtime
     @param dArgs: Arguments to pass into feature function
+    @param cCache: Optional FeatureCache passed to applyFeatures
+    @param dData: Data to run on instead of 2 years from the database,
+                  e.g. benchmark.syntheticData
     @return: A list of sorted tuples of format (time, function name/param string)
     '''     
 
-    '''pulling out 2 years data to run test'''
-    daData = de.DataAccess('mysql')
-    dtStart = dt.datetime(2010, 1, 1)
-    dtEnd = dt.datetime(2011, 12, 31)
-    dtTimeofday = dt.timedelta(hours=16)
-    lsSym = ['AAPL', 'GOOG', 'XOM', 'AMZN', 'BA', 'GILD', '$SPX']
+    if dData == None:
+        '''pulling out 2 years data to run test'''
+        daData = de.DataAccess('mysql')
+        dtStart = dt.datetime(2010, 1, 1)
+        dtEnd = dt.datetime(2011, 12, 31)
+        dtTimeofday = dt.timedelta(hours=16)
+        lsSym = ['AAPL', 'GOOG', 'XOM', 'AMZN', 'BA', 'GILD', '$SPX']
 
-    #print lsSym
+        #print lsSym
 
-    '''set up variables for applyFeatures'''
-    lsKeys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
-    ldtTimestamps = du.getNYSEdays( dtStart, dtEnd, dtTimeofday)
-    ldfData = daData.get_data( ldtTimestamps, lsSym, lsKeys)
-    dData = dict(zip(lsKeys, ldfData))
+        '''set up variables for applyFeatures'''
+        lsKeys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
+        ldtTimestamps = du.getNYSEdays( dtStart, dtEnd, dtTimeofday)
+        ldfData = daData.get_data( ldtTimestamps, lsSym, lsKeys)
+        dData = dict(zip(lsKeys, ldfData))
     
     '''loop through features'''
     ltResults = []
     for i in range(len(lfcFeature)):
         dtFuncStart = dt.datetime.now()
         ldfFeatures = applyFeatures( dData, [lfcFeature[i]], [ldArgs[i]], 
-                                     sMarketRel='$SPX')
+                                     sMarketRel='$SPX', cCache=cCache)
         ltResults.append((dt.datetime.now() - dtFuncStart, 
                          lfcFeature[i].__name__ + ' : ' + str(ldArgs[i])))
     ltResults.sort()
@@ -0,0 +1,516 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Features updated one day at a time, for refreshing the last row
+          of features without recomputing them over the history
+'''
+
+#''' Python imports '''
+from collections import deque
+
+#''' 3rd Party Imports '''
+import pandas as pand
+import numpy as np
+
+
+class IncrementalFeature(object):
+    '''
+    @summary: Base class of features that are updated one day at a time.
+    update takes the newest bar of every symbol and returns the feature
+    values of that day, the last row the function in features.py it stands
+    for would return. The state kept is constant per symbol.
+    '''
+    def __init__(self, lsSym):
+        '''
+        @param lsSym: Symbols, bars hold one value per symbol in this order
+        '''
+        self.lsSym = list(lsSym)
+
+    def update(self, dBar):
+        '''
+        @summary: Adds the data of a new day
+        @param dBar: Dictionary of data of the day, open/high/low/close/volume,
+                     each with one value per symbol in the order of lsSym
+        @return: Numpy array with the feature value of every symbol
+        '''
+        raise NotImplementedError
+
+    def prime(self, dData):
+        '''
+        @summary: Feeds the history in dData to update, one day at a time
+        @param dData: Dictionary of DataFrames, as passed to applyFeatures
+        @return: Feature values of the last day
+        '''
+        dValues = dict((sKey, dfData.reindex(columns=self.lsSym).values)
+                       for sKey, dfData in dData.iteritems())
+        naRet = np.NAN * np.ones(len(self.lsSym))
+        for i in range(len(dData['close'].index)):
+            naRet = self.update(dict((sKey, naData[i]) for sKey, naData in dValues.iteritems()))
+        return naRet
+
+
+class _Window(object):
+    '''
+    @summary: Running sums over the last lLookback days of one or more series
+    per symbol. Days where any of the series is missing or infinite are left
+    out, like pand.rolling_mean leaves them out.
+    '''
+    def __init__(self, lLookback, lSyms, lSeries=1):
+        self.lLookback = lLookback
+        self.naRing = np.zeros((lLookback, lSeries, lSyms))
+        self.naValid = np.zeros((lLookback, lSyms), dtype=int)
+        self.naSum = np.zeros((lSeries, lSyms))
+        self.naCount = np.zeros(lSyms, dtype=int)
+        self.lNext = 0
+
+    def push(self, naValues):
+        '''
+        @param naValues: Series x symbols array of the new day
+        '''
+        naValues = np.asarray(naValues, dtype=float).reshape(self.naRing.shape[1:])
+        naValid = np.isfinite(naValues).all(axis=0)
+        naValues = np.where(naValid, naValues, 0.)
+
+        self.naSum += naValues - self.naRing[self.lNext]
+        self.naCount += naValid - self.naValid[self.lNext]
+        self.naRing[self.lNext] = naValues
+        self.naValid[self.lNext] = naValid
+
+        #''' Sum the stored days again once per lap so rounding errors do not add up '''
+        self.lNext = (self.lNext + 1) % self.lLookback
+        if self.lNext == 0:
+            self.naSum = self.naRing.sum(axis=0)
+
+    def sums(self, lMinPeriods):
+        '''
+        @return: Series x symbols sums, NaN where fewer than lMinPeriods days count
+        '''
+        naRet = self.naSum.copy()
+        naRet[:, self.naCount < lMinPeriods] = np.NAN
+        return naRet
+
+    def means(self, lMinPeriods):
+        '''
+        @return: Series x symbols means, NaN where fewer than lMinPeriods days count
+        '''
+        return self.sums(lMinPeriods) / np.maximum(self.naCount, 1)
+
+
+class _MomentWindow(_Window):
+    '''
+    @summary: Running means and co-moments, the sums of products of the
+    deviations from the means, of the series over the last lLookback days.
+    The day leaving the window is removed and the new one added with
+    Welford's updates, which unlike sums of squares do not cancel. They are
+    taken from the stored days again once per lap, and a series that had the
+    same value on all of the last lLookback days has exactly that value as
+    mean and no deviation, as _windowMoments in features.py gives it.
+    '''
+    def __init__(self, lLookback, lSyms, lSeries=1):
+        _Window.__init__(self, lLookback, lSyms, lSeries)
+        self.naAvg = np.zeros((lSeries, lSyms))
+        self.naCoMoment = np.zeros((lSeries, lSeries, lSyms))
+        self.naLast = np.zeros((lSeries, lSyms))
+        self.naRun = np.zeros((lSeries, lSyms), dtype=int)
+
+    def push(self, naValues):
+        '''
+        @param naValues: Series x symbols array of the new day
+        '''
+        naOld = self.naRing[self.lNext].copy()
+        naOldValid = self.naValid[self.lNext] > 0
+        naCount = self.naCount - naOldValid
+        _Window.push(self, naValues)
+        naNew = self.naRing[self.lNext - 1]
+        naValid = self.naValid[self.lNext - 1] > 0
+
+        self._update(naOld, naOldValid, naCount, -1)
+        self._update(naNew, naValid, self.naCount, 1)
+
+        #''' Days in a row each series has had its last value '''
+        self.naRun = np.where(naValid & (naNew == self.naLast), self.naRun + 1, naValid.astype(int))
+        self.naLast = naNew.copy()
+
+        #''' Once per lap, like the sums, so rounding errors do not add up '''
+        if self.lNext == 0:
+            self._resync()
+
+    def _update(self, naDay, naDayValid, naCount, lSign):
+        '''
+        @summary: Adds a day to the moments, or removes it if lSign is -1
+        @param naCount: Days counted once the day is added or removed
+        '''
+        naDev = naDay - self.naAvg
+        naAvg = self.naAvg + lSign * naDev / np.maximum(naCount, 1)
+        naCoMoment = self.naCoMoment + lSign * naDev[:, np.newaxis, :] * (naDay - naAvg)[np.newaxis, :, :]
+        self.naAvg = np.where(naDayValid & (naCount > 0), naAvg, np.where(naCount > 0, self.naAvg, 0.))
+        self.naCoMoment = np.where(naDayValid & (naCount > 0), naCoMoment,
+                                   np.where(naCount > 0, self.naCoMoment, 0.))
+
+    def _resync(self):
+        '''
+        @summary: Takes the moments from the stored days, with deviations from
+        the oldest valid day first, then from the mean
+        '''
+        lSyms = self.naRing.shape[2]
+        naValid = self.naValid[:, np.newaxis, :] > 0
+        naFirst = self.naRing[naValid[:, 0, :].argmax(axis=0), :, np.arange(lSyms)].T
+        naDev = np.where(naValid, self.naRing - naFirst, 0.)
+        self.naAvg = naFirst + naDev.sum(axis=0) / np.maximum(self.naCount, 1)
+        naDev = np.where(naValid, self.naRing - self.naAvg, 0.)
+        self.naCoMoment = (naDev[:, :, np.newaxis, :] * naDev[:, np.newaxis, :, :]).sum(axis=0)
+
+    def moments(self, lMinPeriods):
+        '''
+        @return: (series x symbols means, series x series x symbols sample
+                 covariances), NaN where fewer than lMinPeriods days count
+        '''
+        naFlat = self.naRun >= self.lLookback
+        naAvg = np.where(naFlat, self.naLast, self.naAvg)
+        naCov = self.naCoMoment / np.maximum(self.naCount - 1, 1)
+        naCov = np.where(naFlat[:, np.newaxis, :] | naFlat[np.newaxis, :, :], 0., naCov)
+
+        naAvg[:, self.naCount < lMinPeriods] = np.NAN
+        naCov[:, :, self.naCount < max(lMinPeriods, 2)] = np.NAN
+        return naAvg, naCov
+
+
+class _Extreme(object):
+    '''
+    @summary: Running maximum or minimum over the last lLookback days of
+    every symbol, on one monotonic deque per symbol. Missing values are left
+    out, amongst equal values the latest one is kept.
+    '''
+    def __init__(self, lLookback, lSyms, bMax=True):
+        self.lLookback = lLookback
+        self.bMax = bMax
+        self.ldqExtreme = [deque() for i in range(lSyms)]
+        self.lDay = 0
+
+    def push(self, naValues):
+        lFirst = self.lDay - self.lLookback + 1
+        for dqExtreme, fValue in zip(self.ldqExtreme, naValues):
+            while dqExtreme and dqExtreme[0][0] < lFirst:
+                dqExtreme.popleft()
+            if fValue != fValue:
+                continue
+            if self.bMax:
+                while dqExtreme and dqExtreme[-1][1] <= fValue:
+                    dqExtreme.pop()
+            else:
+                while dqExtreme and dqExtreme[-1][1] >= fValue:
+                    dqExtreme.pop()
+            dqExtreme.append((self.lDay, fValue))
+        self.lDay += 1
+
+    def values(self):
+        '''
+        @return: (day of the extreme, extreme) arrays, -1 and NaN without values
+        '''
+        naDays = np.array([dqExtreme[0][0] if dqExtreme else -1
+                           for dqExtreme in self.ldqExtreme])
+        naValues = np.array([dqExtreme[0][1] if dqExtreme else np.NAN
+                             for dqExtreme in self.ldqExtreme])
+        return naDays, naValues
+
+
+class _RollingExtreme(object):
+    '''
+    @summary: pand.rolling_max/rolling_min of the days pushed
+    '''
+    def __init__(self, lLookback, lSyms, bMax, lMinPeriods=None):
+        self.cExtreme = _Extreme(lLookback, lSyms, bMax)
+        self.cCount = _Window(lLookback, lSyms)
+        self.lMinPeriods = lLookback if lMinPeriods is None else lMinPeriods
+
+    def push(self, naValues):
+        naValues = np.where(np.isfinite(naValues), naValues, np.NAN)
+        self.cExtreme.push(naValues)
+        self.cCount.push(naValues)
+        naRet = self.cExtreme.values()[1]
+        naRet[self.cCount.naCount < self.lMinPeriods] = np.NAN
+        return naRet
+
+
+class _Returns(object):
+    '''
+    @summary: Daily returns relative to 1 of the days pushed, see tsu.returnize1
+    '''
+    def __init__(self):
+        self.naLast = None
+
+    def push(self, naValues):
+        if self.naLast is None:
+            naRet = np.ones(len(naValues))
+        else:
+            naRet = naValues / self.naLast
+        self.naLast = naValues
+        return naRet
+
+
+def _bar( dBar, sKey ):
+    return np.asarray(dBar[sKey], dtype=float)
+
+
+class IncrementalMA(IncrementalFeature):
+    '''
+    @summary: Moving average, see featMA
+    '''
+    def __init__(self, lsSym, lLookback=30, bRel=True):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.bRel = bRel
+        self.cWindow = _Window(lLookback, len(lsSym))
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        self.cWindow.push(naPrice)
+        naRet = self.cWindow.means(self.lLookback)[0]
+        if self.bRel:
+            naRet = naRet / naPrice
+        return naRet
+
+
+class IncrementalSTD(IncrementalFeature):
+    '''
+    @summary: Standard deviation of the daily returns, see featSTD
+    '''
+    def __init__(self, lsSym, lLookback=20, bRel=True):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.bRel = bRel
+        self.cReturns = _Returns()
+        self.cWindow = _MomentWindow(lLookback, len(lsSym))
+
+    def update(self, dBar):
+        naRets = self.cReturns.push(_bar(dBar, 'close'))
+        self.cWindow.push(naRets)
+        naRet = np.sqrt(self.cWindow.moments(self.lLookback)[1][0, 0])
+        if self.bRel:
+            naRet = naRet / naRets
+        return naRet
+
+
+class IncrementalMomentum(IncrementalFeature):
+    '''
+    @summary: N day cumulative return, see featMomentum
+    '''
+    def __init__(self, lsSym, lLookback=20):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.cReturns = _Returns()
+        self.cWindow = _Window(lLookback, len(lsSym))
+
+    def update(self, dBar):
+        self.cWindow.push(self.cReturns.push(_bar(dBar, 'close')) - 1.)
+        return self.cWindow.sums(self.lLookback)[0]
+
+
+class IncrementalHiLow(IncrementalFeature):
+    '''
+    @summary: Position between the high and low of the lookback, see featHiLow
+    '''
+    def __init__(self, lsSym, lLookback=20):
+        IncrementalFeature.__init__(self, lsSym)
+        self.cMax = _RollingExtreme(lLookback, len(lsSym), True, 1)
+        self.cMin = _RollingExtreme(lLookback, len(lsSym), False, 1)
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        naMax = self.cMax.push(naPrice)
+        naMin = self.cMin.push(naPrice)
+        return (((naPrice - naMin) * 2) / (naMax - naMin)) - 1
+
+
+class IncrementalDrawDown(IncrementalFeature):
+    '''
+    @summary: Drawdown from the high of the lookback, see featDrawDown
+    '''
+    def __init__(self, lsSym, lLookback=30):
+        IncrementalFeature.__init__(self, lsSym)
+        self.cMax = _RollingExtreme(lLookback, len(lsSym), True)
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        naMax = self.cMax.push(naPrice)
+        return (naMax - naPrice) / naMax
+
+
+class IncrementalRunUp(IncrementalFeature):
+    '''
+    @summary: Runup from the low of the lookback, see featRunUp
+    '''
+    def __init__(self, lsSym, lLookback=30):
+        IncrementalFeature.__init__(self, lsSym)
+        self.cMin = _RollingExtreme(lLookback, len(lsSym), False)
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        return naPrice / self.cMin.push(naPrice)
+
+
+class IncrementalVolumeDelta(IncrementalFeature):
+    '''
+    @summary: Moving average of the volume over the volume, see featVolumeDelta
+    '''
+    def __init__(self, lsSym, lLookback=30):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.cWindow = _Window(lLookback, len(lsSym))
+
+    def update(self, dBar):
+        naVolume = _bar(dBar, 'volume')
+        self.cWindow.push(naVolume)
+        return self.cWindow.means(self.lLookback)[0] / naVolume
+
+
+class IncrementalAroon(IncrementalFeature):
+    '''
+    @summary: Aroon up or down, see featAroon. On the last day featAroon
+    counts back over lLookback - 1 days, missing prices count as the extreme.
+    '''
+    def __init__(self, lsSym, bDown=False, lLookback=25):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.cExtreme = _Extreme(lLookback - 1, len(lsSym), not bDown)
+        self.naLastNan = -np.ones(len(lsSym), dtype=int) * lLookback
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        lDay = self.cExtreme.lDay
+        self.cExtreme.push(naPrice)
+        self.naLastNan[np.isnan(naPrice)] = lDay
+
+        naDays = self.cExtreme.values()[0]
+        naDays = np.where(self.naLastNan > lDay - (self.lLookback - 1), self.naLastNan, naDays)
+        naRet = ((self.lLookback - 1.) - (lDay - naDays)) / (self.lLookback - 1.) * 100.
+        if lDay < self.lLookback - 1:
+            naRet[:] = np.NAN
+        return naRet
+
+
+class IncrementalRSI(IncrementalFeature):
+    '''
+    @summary: RSI on simple moving averages of the gains and losses, see featRSI
+    '''
+    def __init__(self, lsSym, lLookback=14):
+        IncrementalFeature.__init__(self, lsSym)
+        self.naLast = np.NAN * np.ones(len(lsSym))
+        self.cUp = _Window(lLookback, len(lsSym))
+        self.cDown = _Window(lLookback, len(lsSym))
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        naDelta = naPrice - self.naLast
+        self.naLast = naPrice
+
+        self.cUp.push(np.where(naDelta <= 0, 0., naDelta))
+        self.cDown.push(np.where(naDelta >= 0, 0., naDelta))
+        naRS = self.cUp.means(1)[0] / np.abs(self.cDown.means(1)[0])
+        return 100.0 - (100.0 / (1.0 + naRS))
+
+
+class IncrementalBeta(IncrementalFeature):
+    '''
+    @summary: Beta relative to a given stock/index, see featBeta
+    '''
+    def __init__(self, lsSym, lLookback=14, sMarket='$SPX'):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.iMarket = self.lsSym.index(sMarket)
+        self.cReturns = _Returns()
+        self.cWindow = _MomentWindow(lLookback, len(lsSym), 2)
+
+    def update(self, dBar):
+        naRets = self.cReturns.push(_bar(dBar, 'close'))
+        naMarket = naRets[self.iMarket] * np.ones(len(naRets))
+        self.cWindow.push([naMarket, naRets])
+
+        naCov = self.cWindow.moments(self.lLookback)[1]
+        return naCov[0, 1] / naCov[0, 0]
+
+
+class IncrementalCorrelation(IncrementalFeature):
+    '''
+    @summary: Correlation of the daily returns with a given stock, see featCorrelation
+    '''
+    def __init__(self, lsSym, lLookback=20, sRel='$SPX'):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.iRel = self.lsSym.index(sRel)
+        self.cReturns = _Returns()
+        self.cWindow = _MomentWindow(lLookback, len(lsSym), 2)
+
+    def update(self, dBar):
+        naRets = self.cReturns.push(_bar(dBar, 'close'))
+        naRel = naRets[self.iRel] * np.ones(len(naRets))
+        self.cWindow.push([naRel, naRets])
+
+        naCov = self.cWindow.moments(self.lLookback)[1]
+        return naCov[0, 1] / np.sqrt(naCov[0, 0] * naCov[1, 1])
+
+
+class IncrementalBollinger(IncrementalFeature):
+    '''
+    @summary: Bollinger position in standard deviations, see featBollinger
+    '''
+    def __init__(self, lsSym, lLookback=20):
+        IncrementalFeature.__init__(self, lsSym)
+        self.lLookback = lLookback
+        self.cWindow = _MomentWindow(lLookback, len(lsSym))
+
+    def update(self, dBar):
+        naPrice = _bar(dBar, 'close')
+        self.cWindow.push(naPrice)
+        naAvg, naCov = self.cWindow.moments(self.lLookback)
+        return (naPrice - naAvg[0]) / (2.0 * np.sqrt(naCov[0, 0]))
+
+
+# Incremental class of each feature function, by name
+_dINCREMENTAL = {'featMA': IncrementalMA, 'featSTD': IncrementalSTD,
+                 'featMomentum': IncrementalMomentum, 'featHiLow': IncrementalHiLow,
+                 'featDrawDown': IncrementalDrawDown, 'featRunUp': IncrementalRunUp,
+                 'featVolumeDelta': IncrementalVolumeDelta, 'featAroon': IncrementalAroon,
+                 'featRSI': IncrementalRSI, 'featBeta': IncrementalBeta,
+                 'featCorrelation': IncrementalCorrelation, 'featBollinger': IncrementalBollinger}
+
+
+def createIncremental( lfcFeatures, ldArgs, lsSym ):
+    '''
+    @summary: Creates the incremental versions of features, see applyFeatures
+    @param lfcFeatures: List of feature functions from features.py
+    @param ldArgs: List of dictionaries containing arguments
+    @param lsSym: Symbols the bars will hold values for
+    @return: List of IncrementalFeature objects
+    '''
+    lcRet = []
+    for fcFeature, dArgs in zip(lfcFeatures, ldArgs):
+        sName = fcFeature.__name__
+        if sName == 'featAroonDown':
+            sName = 'featAroon'
+            dArgs = dict(dArgs, bDown=True)
+        if sName not in _dINCREMENTAL:
+            raise ValueError('No incremental version of %s' % fcFeature.__name__)
+        if 'MR' in dArgs:
+            raise ValueError('Market relative features can not be updated incrementally')
+        lcRet.append( _dINCREMENTAL[sName](lsSym, **dArgs) )
+    return lcRet
+
+
+def updateFeatures( lcFeatures, dtDate, dBar ):
+    '''
+    @summary: Adds a new day to incremental features
+    @param lcFeatures: List of IncrementalFeature objects, see createIncremental
+    @param dtDate: Timestamp of the day
+    @param dBar: Dictionary of data of the day, see IncrementalFeature.update
+    @return: list of one row dataframes, like applyFeatures with bMin
+    '''
+    ldfRet = []
+    for cFeature in lcFeatures:
+        naRet = cFeature.update(dBar)
+        ldfRet.append( pand.DataFrame( index=[dtDate], columns=cFeature.lsSym,
+                                       data=naRet.reshape(1, -1) ) )
+    return ldfRet
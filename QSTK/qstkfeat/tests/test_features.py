@@ -0,0 +1,91 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for the feature functions
+'''
+
+# Python imports
+import unittest
+
+# 3rd party imports
+import numpy as np
+
+# QSTK imports
+from QSTK.qstkfeat import features
+from QSTK.qstkfeat.benchmark import syntheticData
+
+
+class Test(unittest.TestCase):
+
+    def test_bollinger_bands(self):
+        ''' Human Bollinger bands are the window mean plus and minus two stds '''
+        d_data = syntheticData(60, 4)
+        na_price = d_data['close'].values
+        df_bands = features.featBollinger(d_data, lLookback=10, b_human=True)
+
+        self.assertEqual(list(df_bands.columns)[:3], ['SYM0', 'SYM0 Lower', 'SYM0 Upper'])
+        self.assertTrue(np.all(np.isnan(df_bands.values[:9, 1:3])))
+        for i in range(9, 60):
+            na_window = na_price[i - 9:i + 1, 1]
+            f_avg = np.average(na_window)
+            f_std = np.std(na_window)
+            self.assertAlmostEqual(df_bands['SYM1 Lower'][i], f_avg - 2.0 * f_std, 10)
+            self.assertAlmostEqual(df_bands['SYM1 Upper'][i], f_avg + 2.0 * f_std, 10)
+
+    def test_bollinger_gaps(self):
+        ''' Human bands are taken over the prices each window has '''
+        d_data = syntheticData(60, 4)
+        na_price = d_data['close'].values
+        na_price[10, 0] = np.NAN
+        na_price[20:32, 1] = np.NAN
+        na_price[40, 1] = na_price[45:47, 1] = np.NAN
+        df_bands = features.featBollinger(d_data, lLookback=10, b_human=True)
+
+        for i_sym in range(3):
+            s_sym = 'SYM%d' % i_sym
+            for i in range(9, 60):
+                na_window = na_price[i - 9:i + 1, i_sym]
+                na_window = na_window[~np.isnan(na_window)]
+                if len(na_window) == 0:
+                    self.assertTrue(np.isnan(df_bands[s_sym + ' Lower'][i]))
+                    self.assertTrue(np.isnan(df_bands[s_sym + ' Upper'][i]))
+                    continue
+                f_avg = np.average(na_window)
+                f_std = np.std(na_window)
+                self.assertAlmostEqual(df_bands[s_sym + ' Lower'][i], f_avg - 2.0 * f_std, 10)
+                self.assertAlmostEqual(df_bands[s_sym + ' Upper'][i], f_avg + 2.0 * f_std, 10)
+
+        # Positions still need prices over the whole window
+        df_position = features.featBollinger(d_data, lLookback=10)
+        self.assertTrue(np.all(np.isnan(df_position['SYM0'].values[10:20])))
+        self.assertFalse(np.any(np.isnan(df_position['SYM0'].values[20:])))
+
+    def test_bollinger_flat_prices(self):
+        ''' Flat prices give bands equal to the price, not nan '''
+        d_data = syntheticData(40, 4)
+        for i, f_price in enumerate([33.33, 0.1, 101.37]):
+            d_data['close'].values[:, i] = f_price
+
+        for l_lookback in [2, 5, 14, 20]:
+            df_bands = features.featBollinger(d_data, lLookback=l_lookback, b_human=True)
+            for i, f_price in enumerate([33.33, 0.1, 101.37]):
+                na_bands = df_bands.values[l_lookback - 1:, 3 * i:3 * i + 3]
+                self.assertTrue(np.all(na_bands == f_price))
+
+    def test_shared_results(self):
+        ''' Changing a feature does not change the data shared with later features '''
+        d_data = features.FeatureData(syntheticData(60, 4))
+        for fc_feature in [features.featMomentum, features.featMA, features.featSTD]:
+            df_first = fc_feature(d_data, lLookback=5)
+            na_first = df_first.values.copy()
+            df_first.values[:] = 0.
+            na_second = fc_feature(d_data, lLookback=5).values
+            self.assertTrue(np.all((na_first == na_second) |
+                                   (np.isnan(na_first) & np.isnan(na_second))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for featutil
+'''
+
+# Python imports
+import shutil
+import tempfile
+import datetime as dt
+import unittest
+
+# 3rd party imports
+import numpy as np
+
+# QSTK imports
+from QSTK.qstkfeat import features
+from QSTK.qstkfeat import featutil
+from QSTK.qstkfeat.benchmark import syntheticData
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.d_data = syntheticData(80, 7)
+        self.lfc_features = [features.featMA, features.featSTD, features.featBeta,
+                             features.featCorrelation, features.featBollinger,
+                             features.featRSI]
+        self.ld_args = [{'lLookback': 10}, {'lLookback': 5, 'MR': True},
+                        {'lLookback': 14}, {'lLookback': 20, 'sRel': 'SYM2'},
+                        {}, {'MR': True}]
+
+    def assert_frames_equal(self, ldf_first, ldf_second):
+        self.assertEqual(len(ldf_first), len(ldf_second))
+        for df_first, df_second in zip(ldf_first, ldf_second):
+            self.assertEqual(list(df_first.index), list(df_second.index))
+            self.assertEqual(list(df_first.columns), list(df_second.columns))
+            na_first = df_first.values
+            na_second = df_second.values
+            self.assertTrue(np.all((na_first == na_second) |
+                                   (np.isnan(na_first) & np.isnan(na_second))))
+
+    def test_apply_parallel(self):
+        ''' Features applied on a pool of processes equal the serial ones '''
+        ldf_serial = featutil.applyFeatures(self.d_data, self.lfc_features,
+                                            [dict(d_args) for d_args in self.ld_args],
+                                            sMarketRel='$SPX')
+        for l_shards in [1, 3]:
+            ldf_parallel = featutil.applyFeatures(self.d_data, self.lfc_features,
+                                                  [dict(d_args) for d_args in self.ld_args],
+                                                  sMarketRel='$SPX', lWorkers=2,
+                                                  lShards=l_shards)
+            self.assert_frames_equal(ldf_serial, ldf_parallel)
+
+    def test_feature_store(self):
+        ''' Features read back from a store equal the ones written '''
+        s_log = tempfile.mkdtemp()
+        try:
+            lfc_features = [features.featMA, features.featBollinger, features.featMA]
+            ld_args = [{'lLookback': 10}, {'lLookback': 5, 'b_human': True},
+                       {'lLookback': 5, 'dtStart': dt.datetime(1990, 1, 5), 'tWeights': (1, 2)}]
+            ldf_features = [features.featMA(self.d_data, lLookback=10),
+                            features.featBollinger(self.d_data, lLookback=5, b_human=True),
+                            features.featMA(self.d_data, lLookback=5)]
+            featutil.saveFeatures(s_log, ldf_features, lfc_features, ld_args)
+
+            self.assert_frames_equal(featutil.loadFeatures(s_log), ldf_features)
+            self.assertEqual(list(featutil.loadFeatures(s_log)[1].columns)[:3],
+                             ['SYM0', 'SYM0 Lower', 'SYM0 Upper'])
+            self.assertEqual(featutil.listFeatures(s_log)[2],
+                             ('featMA', {'lLookback': 5, 'tWeights': [1, 2],
+                                         'dtStart': repr(dt.datetime(1990, 1, 5))}))
+
+            # Features are found by the arguments they were saved with
+            dt_start = self.d_data['close'].index[20]
+            dt_end = self.d_data['close'].index[39]
+            ldf_loaded = featutil.loadFeatures(s_log, [('featMA', ld_args[2]), 1],
+                                               dt_start, dt_end)
+            self.assert_frames_equal(ldf_loaded, [ldf_features[2].ix[20:40],
+                                                  ldf_features[1].ix[20:40]])
+            self.assertRaises(KeyError, featutil.loadFeatures, s_log,
+                              [('featMA', {'lLookback': 6})])
+        finally:
+            shutil.rmtree(s_log)
+
+    def test_feature_cache(self):
+        ''' Features already in the cache are not calculated again '''
+        s_dir = tempfile.mkdtemp()
+        try:
+            c_cache = featutil.FeatureCache(sDir=s_dir)
+            ldf_first = featutil.applyFeatures(self.d_data, self.lfc_features,
+                                               [dict(d_args) for d_args in self.ld_args],
+                                               sMarketRel='$SPX', cCache=c_cache)
+            self.assertEqual((c_cache.lHits, c_cache.lMisses), (0, 6))
+
+            # Results handed out are copies
+            ldf_first[0].values[:] = 0.
+            ldf_first = featutil.applyFeatures(self.d_data, self.lfc_features,
+                                               [dict(d_args) for d_args in self.ld_args],
+                                               sMarketRel='$SPX')
+            ldf_second = featutil.applyFeatures(self.d_data, self.lfc_features,
+                                                [dict(d_args) for d_args in self.ld_args],
+                                                sMarketRel='$SPX', cCache=c_cache)
+            self.assertEqual((c_cache.lHits, c_cache.lMisses), (6, 6))
+            self.assert_frames_equal(ldf_first, ldf_second)
+
+            # Default arguments given explicitly are the same feature
+            featutil.applyFeatures(self.d_data, [features.featBollinger], [{'lLookback': 20}],
+                                   cCache=c_cache)
+            self.assertEqual((c_cache.lHits, c_cache.lMisses), (7, 6))
+
+            # Other data or arguments are not
+            self.d_data['close'].values[-1, 0] += 1.
+            featutil.applyFeatures(self.d_data, self.lfc_features[:2],
+                                   [{'lLookback': 10}, {'lLookback': 6, 'MR': True}],
+                                   sMarketRel='$SPX', cCache=c_cache)
+            self.assertEqual((c_cache.lHits, c_cache.lMisses), (7, 8))
+
+            # Results evicted from memory are read back from the directory
+            c_cache.clear()
+            self.assertEqual(len(c_cache.cResults), 0)
+            ldf_second = featutil.applyFeatures(self.d_data, self.lfc_features[:1],
+                                                [{'lLookback': 10}], cCache=c_cache)
+            self.assertEqual((c_cache.lHits, c_cache.lMisses), (8, 8))
+
+            c_small = featutil.FeatureCache(lMaxBytes=ldf_second[0].values.nbytes * 2)
+            featutil.applyFeatures(self.d_data, self.lfc_features,
+                                   [dict(d_args) for d_args in self.ld_args],
+                                   sMarketRel='$SPX', cCache=c_small)
+            self.assertTrue(len(c_small.cResults) < 6)
+            self.assertTrue(c_small.cResults.i_bytes <= c_small.lMaxBytes)
+        finally:
+            shutil.rmtree(s_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for the incremental features
+'''
+
+# Python imports
+import unittest
+
+# 3rd party imports
+import numpy as np
+
+# QSTK imports
+from QSTK.qstkfeat import features
+from QSTK.qstkfeat import featutil
+from QSTK.qstkfeat import incremental
+from QSTK.qstkfeat.benchmark import syntheticData
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        ''' History with gaps, flat prices and tied highs and lows '''
+        self.d_data = syntheticData(120, 6, 1)
+        na_close = self.d_data['close'].values
+        na_close[:] = np.round(na_close, 1)
+        na_close[10:14, 1] = np.NAN
+        na_close[50, 2] = np.NAN
+        na_close[:, 3] = 33.33
+        na_close[60:, 4] = 0.1
+        self.d_data['volume'].values[30:33, 0] = np.NAN
+
+        self.lfc_features = []
+        self.ld_args = []
+        for l_lookback in [3, 14]:
+            for fc_feature, d_args in [(features.featMA, {}), (features.featMA, {'bRel': False}),
+                                       (features.featSTD, {}), (features.featSTD, {'bRel': False}),
+                                       (features.featMomentum, {}), (features.featHiLow, {}),
+                                       (features.featDrawDown, {}), (features.featRunUp, {}),
+                                       (features.featVolumeDelta, {}), (features.featAroon, {}),
+                                       (features.featAroonDown, {}), (features.featRSI, {}),
+                                       (features.featBeta, {}), (features.featCorrelation, {}),
+                                       (features.featBollinger, {})]:
+                self.lfc_features.append(fc_feature)
+                self.ld_args.append(dict(d_args, lLookback=l_lookback))
+
+    def assert_row(self, fc_feature, na_update, na_batch, s_case=None):
+        ''' Incremental values match the batch ones, NaN where they are NaN '''
+        if fc_feature is features.featSTD:
+            # pand.rolling_std leaves rounding residue on windows that turned flat,
+            # or NaN when it makes the variance a little negative
+            na_residue = np.isnan(na_batch) | (np.abs(na_batch) < 1e-7)
+            na_batch = np.where((na_update == 0) & na_residue, 0., na_batch)
+        self.assertTrue(np.all(np.isnan(na_update) == np.isnan(na_batch)), s_case)
+        na_valid = ~np.isnan(na_batch)
+        self.assertTrue(np.allclose(na_update[na_valid], na_batch[na_valid],
+                                    rtol=1e-6, atol=1e-9), s_case)
+
+    def test_replay(self):
+        ''' Replaying the history gives the last row of applyFeatures every day '''
+        ls_symbols = list(self.d_data['close'].columns)
+        lc_features = incremental.createIncremental(self.lfc_features, self.ld_args, ls_symbols)
+        ldt_days = list(self.d_data['close'].index)
+
+        for i, dt_day in enumerate(ldt_days):
+            d_bar = dict((s_key, df_data.values[i]) for s_key, df_data in self.d_data.items())
+            ldf_update = incremental.updateFeatures(lc_features, dt_day, d_bar)
+            if i % 7 != 6 and i != len(ldt_days) - 1:
+                continue
+
+            d_history = dict((s_key, df_data.ix[:i + 1]) for s_key, df_data in self.d_data.items())
+            ldf_batch = featutil.applyFeatures(d_history, self.lfc_features,
+                                               [dict(d_args) for d_args in self.ld_args])
+            for fc_feature, d_args, df_update, df_batch in zip(self.lfc_features, self.ld_args,
+                                                               ldf_update, ldf_batch):
+                s_case = '%s %s on day %d' % (fc_feature.__name__, d_args, i)
+                self.assertEqual(list(df_update.index), [dt_day])
+                self.assertEqual(list(df_update.columns), ls_symbols)
+                self.assert_row(fc_feature, df_update.values[0], df_batch.values[-1], s_case)
+
+    def test_prime(self):
+        ''' Priming with the history gives the same values as replaying it '''
+        ls_symbols = list(self.d_data['close'].columns)
+        lc_features = incremental.createIncremental(self.lfc_features[:4], self.ld_args[:4],
+                                                    ls_symbols)
+        ldf_batch = featutil.applyFeatures(self.d_data, self.lfc_features[:4],
+                                           [dict(d_args) for d_args in self.ld_args[:4]])
+        for fc_feature, c_feature, df_batch in zip(self.lfc_features, lc_features, ldf_batch):
+            self.assert_row(fc_feature, c_feature.prime(self.d_data), df_batch.values[-1])
+
+    def test_unsupported(self):
+        ''' Features without an incremental version and market relative ones are refused '''
+        self.assertRaises(ValueError, incremental.createIncremental,
+                          [features.featDate], [{}], ['A'])
+        self.assertRaises(ValueError, incremental.createIncremental,
+                          [features.featMA], [{'MR': True}], ['A'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,26 +11,35 @@ import numpy,scipy.spatial.distance
 from scipy.spatial import cKDTree
 import cProfile,pstats,gendata
 import numpy as np
+from parallelknn import aggregate
 
 class kdtknn(object):
     """
     A simple wrapper of scipy.spatial.kdtree.KDTree
     
     Since the scipy KDTree implementation does not allow for incrementally adding
-    data points, the entire KD-tree is rebuilt on the first call to 'query' after a
-    call to 'addEvidence'. For this reason it is more efficient to add training data
-    in batches.
+    data points, the data is kept in a forest of KD-trees, each over a contiguous
+    block of rows, with block sizes growing geometrically. Rows added by 'addEvidence'
+    wait in a delta that queries search by brute force. Once the delta holds
+    'deltasize' rows it gets its own tree, and trees no larger than the one after
+    them are merged into one, so each row is only built into a tree a logarithmic
+    number of times. Queries merge the neighbors found in every tree and the delta.
     """
-    def __init__(self,k=3,method='mean',leafsize=10):
+    def __init__(self,k=3,method='mean',leafsize=10,deltasize=1024,weighted=False):
         """
-        Basic setup.
+        Basic setup. If 'weighted' is True, neighbors are weighted by the inverse
+        of their distance when their classes are combined.
         """
         self.leafsize = leafsize
+        self.deltasize = deltasize
         self.data = None
+        self.buffer = None
         self.kdt = None
+        self.trees = []
         self.rebuild_tree = True
         self.k = k
         self.method = method
+        self.weighted = weighted
 
     def addEvidence(self,dataX,dataY=None):
         """
@@ -45,70 +54,121 @@ class kdtknn(object):
         """
         
         ''' Slap on Y column if it is provided, if not assume it is there '''
-        if not dataY == None:
+        if dataY is not None:
             data = numpy.zeros([dataX.shape[0],dataX.shape[1]+1])
             data[:,0:dataX.shape[1]]=dataX
             data[:,(dataX.shape[1])]=dataY
         else:
             data = dataX
         
+        ''' Rows go into a buffer that doubles when full, self.data is a view of the filled part '''
         self.rebuild_tree = True
         if self.data is None:
-            self.data = data
-        else:
-            self.data = numpy.append(self.data,data,axis=0)
+            self.buffer = numpy.array(data)
+            self.data = self.buffer
+            return
+        
+        rows = self.data.shape[0]
+        dtype = numpy.promote_types(self.buffer.dtype, data.dtype)
+        if rows + data.shape[0] > self.buffer.shape[0] or dtype != self.buffer.dtype:
+            buf = numpy.zeros((max(2*self.buffer.shape[0], rows + data.shape[0]), self.buffer.shape[1]), dtype=dtype)
+            buf[:rows] = self.data
+            self.buffer = buf
+        self.buffer[rows:rows + data.shape[0]] = data
+        self.data = self.buffer[:rows + data.shape[0]]
 
     def rebuildKDT(self):
         """
-        Force the internal KDTree to be rebuilt.
+        Force the internal KDTree to be rebuilt, as a single tree over all the data.
         """
-        self.kdt = cKDTree(self.data[:,:-1],leafsize=self.leafsize)
+        self.trees = [(0, self.data.shape[0], cKDTree(self.data[:,:-1],leafsize=self.leafsize))]
+        self.kdt = self.trees[0][2]
         self.rebuild_tree = False
+
+    def updateKDT(self):
+        """
+        Builds a tree over the delta once it holds 'deltasize' rows, merging it with
+        the trees before it that are no larger.
+        """
+        tree_rows = self.trees[-1][1] if self.trees else 0
+        if self.data.shape[0] - tree_rows >= self.deltasize:
+            start = tree_rows
+            while self.trees and self.trees[-1][1] - self.trees[-1][0] <= self.data.shape[0] - start:
+                start = self.trees.pop()[0]
+            self.trees.append((start, self.data.shape[0], cKDTree(self.data[start:,:-1],leafsize=self.leafsize)))
+        self.kdt = self.trees[0][2] if self.trees else None
+        self.rebuild_tree = False
+
+    def _neighbors(self,points,k):
+        """
+        The k nearest neighbors of each point over all trees and the delta.
+        Returns (distances, indexes into self.data), both shaped like points x k,
+        nearest first.
+        """
+        points = numpy.atleast_2d(points)
+        ldist = []
+        lindex = []
+        for start, end, tree in self.trees:
+            dist, index = tree.query(points, min(k, end - start))
+            ldist.append(dist.reshape(points.shape[0], -1))
+            lindex.append(index.reshape(points.shape[0], -1) + start)
+        
+        ''' Delta distances are summed one dimension at a time, as the trees do '''
+        tree_rows = self.trees[-1][1] if self.trees else 0
+        delta = self.data[tree_rows:,:-1]
+        if delta.shape[0] > 0:
+            dist = numpy.zeros((points.shape[0], delta.shape[0]))
+            for dim in range(delta.shape[1]):
+                diff = points[:,dim:dim+1] - delta[:,dim]
+                dist += diff * diff
+            ldist.append(numpy.sqrt(dist))
+            lindex.append(numpy.tile(numpy.arange(tree_rows, self.data.shape[0]), (points.shape[0], 1)))
+        
+        dist = numpy.hstack(ldist)
+        index = numpy.hstack(lindex)
+        order = numpy.argsort(dist, axis=1, kind='mergesort')[:,:k]
+        rows = numpy.arange(points.shape[0])[:,numpy.newaxis]
+        return dist[rows, order], index[rows, order]
     
-    def query(self,points,k=None,method=None):
+    def query(self,points,k=None,method=None,weighted=None):
         """
         Classify a set of test points given their k nearest neighbors.
         
         'points' should be a numpy array with each row corresponding to a specific query.
-        Returns the estimated class according to supplied method (currently only 'mode'
-        and 'mean' are supported)
+        Returns the estimated class of every point according to supplied method, 'mode',
+        'mean' or 'median', see parallelknn.aggregate. 'raw' returns the classes of the
+        neighbors, one row per point, and 'all' returns those and their distances.
+        If 'weighted' is True, closer neighbors count for more, points on top of
+        training points only take those into account.
         """
         if k is None:
             k = self.k
         if method is None:
             method = self.method
+        if weighted is None:
+            weighted = self.weighted
         if self.rebuild_tree is True:
             if self.data is None:
                 return None
-            self.rebuildKDT()
-        #kdt.query returns a list of distances and a list of indexes into the
-        #data array
-        if k == 1:
-            tmp = self.kdt.query(points,k)
-            #in the case of k==1, numpy fudges an array of 1 dimension into
-            #a scalar, so we handle it seperately. tmp[1] is the list of
-            #indecies, tmp[1][0] is the first one (we only need one),
-            #self.data[tmp[1][0]] is the data point corresponding to the
-            #first neighbor, and self.data[tmp[1][0]][-1] is the last column
-            #which is the class of the neighbor.
-            return self.data[tmp[1][0]][-1]
-        #for all the neighbors returned by kdt.query, get their class and stick that into a list
-        
-        na_dist, na_neighbors =  self.kdt.query(points,k)
+            self.updateKDT()
+        #_neighbors returns a list of distances and a list of indexes into the
+        #data array, one row per point
+        na_dist, na_neighbors =  self._neighbors(points,k)
         
-        n_clsses = map(lambda rslt: map(lambda p: p[-1], self.data[rslt]), na_neighbors)
-        #print n_clsses
+        #the class of every neighbor is the last column of its row in the data
+        n_clsses = self.data[na_neighbors, -1]
 
-        if method=='mode':
-            return map(lambda x: scipy.stats.stats.mode(x)[0],n_clsses)[0]
-        elif method=='mean':
-            return numpy.array(map(lambda x: numpy.mean(x),n_clsses))
-        elif method=='median':
-            return numpy.array(map(lambda x: numpy.median(x),n_clsses))
-        elif method=='raw':
-            return numpy.array(n_clsses)
+        if method=='raw':
+            return n_clsses
         elif method=='all':
-            return numpy.array(n_clsses), na_dist
+            return n_clsses, na_dist
+        
+        na_weights = None
+        if weighted:
+            na_exact = na_dist == 0
+            with numpy.errstate(divide='ignore'):
+                na_weights = numpy.where(na_exact.any(axis=1)[:,numpy.newaxis], na_exact, 1. / na_dist)
+        return aggregate(n_clsses, method, na_weights)
 
 def getflatcsv(fname):
     inf = open(fname)
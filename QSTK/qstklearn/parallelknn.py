@@ -13,18 +13,21 @@ Created on Feb 1, 2011
           also provides some coarse parallelism. If the par_query function is used then the query points are split up equally amongst threads and their
           near neighbors are calculated in parallel. If the number of threads to use is not specified then no of threads  = no of cores as returned by
           the cpu_count function. This may not be ideal.    
+          BlockedKNN keeps the learner on an object instead of the global data and answers queries a block at a time,
+          with the distances of a whole block from one matrix product. KNNPool keeps worker processes and a shared
+          memory copy of a BlockedKNN's training data between calls.
 @status: complete. "mode" untested
 '''
 
 import numpy as np
-import scipy as sc
-import math
 import sys
 import time
+import ctypes
 from multiprocessing import Pool
+from multiprocessing import RawArray
 from multiprocessing import cpu_count
 data = np.zeros (0)#this is the global data
-import scipy.stats
+_poolData = {} #training data of a KNNPool worker, see _initPool
 
 def par_query (allQueries, k, method='mean', noOfThreads=None):
     '''
@@ -46,15 +49,12 @@ def par_query (allQueries, k, method='mean', noOfThreads=None):
     pool = Pool (processes=noOfThreads)
     
     resultList = []
-    query_per_thread = allQueries.shape[0] / noOfThreads
+    bounds = _chunkBounds (allQueries.shape[0], noOfThreads)
     
     #time_start = time.time();
-    for thread_ctr in range (0, noOfThreads - 1):
-        resultList.append(pool.apply_async(query, (allQueries[math.floor(query_per_thread * thread_ctr): (math.floor(query_per_thread * (thread_ctr + 1 ))),:], k,)))
-        #NOTE: we may need a -1 in above. Possible bug
+    for start, end in zip (bounds[:-1], bounds[1:]):
+        resultList.append(pool.apply_async(query, (allQueries[start:end, :], k, method)))
         #for ends
-    #the "remaining" query points go to the last thread
-    resultList.append (pool.apply_async(query , (allQueries[(math.floor(query_per_thread* (noOfThreads - 1))):, :] ,k ,)))    
     
     pool.close()
     pool.join()
@@ -62,10 +62,9 @@ def par_query (allQueries, k, method='mean', noOfThreads=None):
     #time_finish = time.time()
     #print "Time taken (secs): " + str (time_finish - time_start)
     
-    answer = resultList[0].get()
-    
-    for thread_ctr  in range (1, noOfThreads):
-        answer = np.hstack((answer, resultList[thread_ctr].get()))
+    answer = np.zeros (allQueries.shape[0])
+    for start, result in zip (bounds[:-1], resultList):
+        answer[start:start + len (result.get())] = result.get()
         #for ends
 
     #print "par_query done"
@@ -82,14 +81,27 @@ def query(allQueries, k, method='mean'):
     @return: A numpy array with the predicted 'y' values for the query points. The ith element in the array is the 'y' value for the ith query point. If there is more than one mode then only the first mode is returned.
     '''
     
-    limit = allQueries.shape [0]
-    data_limit = data.shape[0]
-    omitLastCol = data.shape [1] - 1; #It must have two columns at least. Possibly add a check for this?
-    answer = np.zeros (limit) #initialize the answer array to all zeros
-    temp1 = np.zeros ((data.shape[0], (data.shape[1] -1)))
-    temp2= np.zeros (data.shape[0])
+    _checkQuery (data, allQueries, k)
     
-    if (allQueries.shape[1] != (data.shape[1] -1) ):
+    index = neighbors (data[:, :-1], allQueries, k)[1]
+    return aggregate (data[index, -1], method)
+    #getAnswer ends
+
+
+def _chunkBounds (limit, chunks):
+    '''
+    @summary: Splits 0..limit into at most 'chunks' nearly equal, non empty ranges
+    @return: List of bounds, range i is bounds[i]:bounds[i+1]
+    '''
+    chunks = max (1, min (chunks, limit))
+    return [int (bound) for bound in np.linspace (0, limit, chunks + 1)]
+
+
+def _checkQuery (trainData, allQueries, k):
+    '''
+    @summary: Checks the query points and k against training data that has 'y' values in its last column
+    '''
+    if (allQueries.shape[1] != (trainData.shape[1] -1) ):
         print "ERROR: Data and query points are not of the same dimension"
         raise ValueError
         #if ends
@@ -97,44 +109,288 @@ def query(allQueries, k, method='mean'):
         print "ERROR: K should be >= 1"
         raise ValueError
         #if ends    
-    if (k > data.shape[0]):
+    if (k > trainData.shape[0]):
         print "ERROR: K is greater than the total number of data points."
         raise ValueError
         #if ends
+
+
+def neighbors (trainX, allQueries, k, trainNorms=None, maxCells=2**22, center=None):
+    '''
+    @summary: Finds the k nearest training points of every query point. Queries are taken a block at a time. The squared
+              distances of a block are ||q||^2 - 2 q.x + ||x||^2, one matrix product, and the nearest k are picked out
+              with argpartition instead of sorting all of them. The points are moved by -center first, so data far from
+              the origin, such as prices or volumes, keeps its precision.
+    @param trainX: 2D numpy array of training points, without 'y' values
+    @param allQueries: 2D numpy array of query points
+    @param k: no. of neighbors to find
+    @param trainNorms: optional squared lengths of the training points minus center, computed if None
+    @param maxCells: no. of distances computed at a time, sets the block size
+    @param center: optional point near the training data. Default is the mean of trainX, it must be given with trainNorms.
+    @return: Tuple of (squared distances, indices into trainX), both no. of queries x k, nearest first
+    '''
+    trainX = np.asarray (trainX, dtype=float)
+    allQueries = np.atleast_2d (np.asarray (allQueries, dtype=float))
+    if (center is None):
+        center = trainX.mean (axis=0)
+        #if ends
+    trainX = trainX - center
+    allQueries = allQueries - center
+    if (trainNorms is None):
+        trainNorms = (trainX * trainX).sum (axis=1)
+    
+    limit = allQueries.shape[0]
+    dist = np.zeros ((limit, k))
+    index = np.zeros ((limit, k), dtype=int)
+    block = max (1, maxCells / max (1, trainX.shape[0]))
+    
+    for start in range (0, limit, block):
+        queries = allQueries[start:start + block]
+        #||q||^2 is the same for a whole row, it is only added to the k nearest
+        blockDist = np.dot (-2. * queries, trainX.T)
+        blockDist += trainNorms
+        
+        if (k < trainX.shape[0]):
+            blockIndex = np.argpartition (blockDist, k - 1, axis=1)[:, :k]
+        else:
+            blockIndex = np.tile (np.arange (trainX.shape[0]), (queries.shape[0], 1))
+        rows = np.arange (queries.shape[0])[:, np.newaxis]
+        blockIndex = blockIndex[rows, np.argsort (blockDist[rows, blockIndex], axis=1)]
+        
+        dist[start:start + block] = blockDist[rows, blockIndex] + (queries * queries).sum (axis=1)[:, np.newaxis]
+        index[start:start + block] = blockIndex
+        #for ends
+    np.maximum (dist, 0., dist) #rounding can take points on top of each other below 0
+    return dist, index
+    #neighbors ends
+
+
+def aggregate (labels, method='mean', weights=None):
+    '''
+    @summary: Combines the 'y' values of the neighbors of every query point
+    @param labels: 2D numpy array, row i holds the 'y' values of the neighbors of query point i
+    @param method: 'mean', 'median' or 'mode'. If there is more than one mode then the smallest is returned, as scipy.stats.mode does.
+    @param weights: optional 2D numpy array of the same shape as labels. Gives a weighted mean, the value at half the
+                    total weight as median and the value with the most weight as mode.
+    @return: A numpy array with one value per query point
+    '''
+    labels = np.asarray (labels, dtype=float)
+    rows = np.arange (labels.shape[0])[:, np.newaxis]
+    if (method == 'mean'):
+        if (weights is None):
+            return labels.sum (axis=1) / labels.shape[1]
+        return (labels * weights).sum (axis=1) / weights.sum (axis=1)
+    if (method == 'median'):
+        if (weights is None):
+            return np.median (labels, axis=1)
+        order = labels.argsort (axis=1, kind='mergesort')
+        cumWeights = weights[rows, order].cumsum (axis=1)
+        middle = (cumWeights >= cumWeights[:, -1:] / 2.).argmax (axis=1)
+        return labels[rows[:, 0], order[rows[:, 0], middle]]
+    if (method == 'mode'):
+        if (weights is None):
+            weights = np.ones (labels.shape)
+        order = labels.argsort (axis=1, kind='mergesort')
+        labels = labels[rows, order]
+        cumWeights = weights[rows, order].cumsum (axis=1)
+        #runs of equal values in the sorted rows, the weight of a run is the cumulative weight at its end minus before its start
+        runEnd = np.ones (labels.shape, dtype=bool)
+        runEnd[:, :-1] = labels[:, 1:] != labels[:, :-1]
+        runStart = np.zeros (labels.shape, dtype=int)
+        runStart[:, 1:] = np.where (runEnd[:, :-1], np.arange (1, labels.shape[1]), 0)
+        runStart = np.maximum.accumulate (runStart, axis=1)
+        before = np.where (runStart > 0, cumWeights[rows, runStart - 1], 0.)
+        runWeights = np.where (runEnd, cumWeights - before, -np.inf)
+        #the first of the heaviest runs is the smallest value
+        return labels[rows[:, 0], runWeights.argmax (axis=1)]
+    print "ERROR: Unknown method " + str(method)
+    raise ValueError
+    #aggregate ends
+
+
+class BlockedKNN (object):
+    '''
+    @summary: Brute force k nearest neighbors, with the training data on the object instead of the global data. See neighbors.
+    '''
+    def __init__ (self, k=3, method='mean', maxCells=2**22):
+        '''
+        @param k: default no. of neighbors to consider
+        @param method: default method of combining the 'y' values of the nearest neighbors, 'mean', 'median' or 'mode'
+        @param maxCells: no. of distances computed at a time
+        '''
+        self.k = k
+        self.method = method
+        self.maxCells = maxCells
+        self.data = None #training points with 'y' values in the last column, grown by doubling
+        self.rows = 0
+        self.center = None
+        self.norms = None
     
-    for ctr in range (0, limit): #for every query point...  
-        #if (ctr % 10 == 0):
-         #   print ctr
+    def addEvidence (self, dataX, dataY=None):
+        '''
+        @summary: Adds training data. Can be called any number of times, the data must have the same no. of columns every time.
+        @param dataX: 2D numpy array of training points, with 'y' values as the last column unless dataY is given
+        @param dataY: optional 'y' values of dataX
+        '''
+        dataX = np.atleast_2d (np.asarray (dataX, dtype=float))
+        if (dataY is not None):
+            dataX = np.hstack ((dataX, np.reshape (dataY, (-1, 1))))
+        
+        if (self.data is None):
+            self.data = np.zeros ((max (16, dataX.shape[0]), dataX.shape[1]))
+        elif (self.rows + dataX.shape[0] > self.data.shape[0]):
+            grown = np.zeros ((max (2 * self.data.shape[0], self.rows + dataX.shape[0]), self.data.shape[1]))
+            grown[:self.rows] = self.data[:self.rows]
+            self.data = grown
+            #if ends
+        self.data[self.rows:self.rows + dataX.shape[0]] = dataX
+        self.rows += dataX.shape[0]
+        self.center = None
+        self.norms = None
+    
+    def getData (self):
+        '''
+        @return: The training data added so far, 'y' values in the last column
+        '''
+        if (self.data is None):
+            return np.zeros ((0, 0))
+        return self.data[:self.rows]
+    
+    def neighbors (self, allQueries, k=None):
+        '''
+        @summary: See the neighbors function
+        @return: Tuple of (squared distances, indices into getData()), nearest first
+        '''
+        if (k is None):
+            k = self.k
+        allQueries = np.atleast_2d (allQueries)
+        _checkQuery (self.getData (), allQueries, k)
+        if (self.norms is None):
+            trainX = self.getData ()[:, :-1]
+            self.center = trainX.mean (axis=0)
+            self.norms = ((trainX - self.center) ** 2).sum (axis=1)
+        return neighbors (self.getData ()[:, :-1], allQueries, k, self.norms, self.maxCells, self.center)
+    
+    def query (self, allQueries, k=None, method=None):
+        '''
+        @summary: Estimates the 'y' values of the query points
+        @param allQueries: 2D numpy array, one query point per row
+        @param k: no. of neighbors to consider, self.k if None
+        @param method: 'mean', 'median' or 'mode', self.method if None
+        @return: A numpy array with the predicted 'y' values for the query points
+        '''
+        if (method is None):
+            method = self.method
+        index = self.neighbors (allQueries, k)[1]
+        return aggregate (self.getData ()[index, -1], method)
+
+
+def _initPool (rawData, rawNorms, shape, center):
+    '''
+    @summary: Pool initializer, maps the shared training data in the worker
+    '''
+    _poolData['data'] = np.frombuffer (rawData).reshape (shape)
+    _poolData['norms'] = np.frombuffer (rawNorms)
+    _poolData['center'] = center
+
+
+def _poolQuery (task):
+    '''
+    @summary: Answers one chunk of query points in a KNNPool worker
+    @param task: (first query no., query points, k, method, no. of training rows, maxCells)
+    @return: (first query no., predicted 'y' values)
+    '''
+    start, allQueries, k, method, rows, maxCells = task
+    trainData = _poolData['data'][:rows]
+    index = neighbors (trainData[:, :-1], allQueries, k, _poolData['norms'][:rows], maxCells, _poolData['center'])[1]
+    return start, aggregate (trainData[index, -1], method)
+
+
+class KNNPool (object):
+    '''
+    @summary: Worker processes answering the queries of a BlockedKNN, kept between calls. The training data is copied
+              into shared memory once. Rows added to the learner later are copied in before the next query, the
+              workers are only restarted when the shared memory is full. Distances are taken relative to the mean of
+              the training data when the workers started.
+    '''
+    def __init__ (self, learner, noOfThreads=None, chunksPerThread=4):
+        '''
+        @param learner: BlockedKNN whose training data and defaults are used
+        @param noOfThreads: no. of worker processes. Default value: no. of threads = value returned by cpu_count
+        @param chunksPerThread: no. of chunks the query points are split into per worker, more chunks balance uneven workers
+        '''
+        if (noOfThreads == None):
+            noOfThreads = cpu_count()
+            #if ends
+        self.learner = learner
+        self.noOfThreads = noOfThreads
+        self.chunksPerThread = chunksPerThread
+        self.pool = None
+        self.shared = None
+        self.sharedNorms = None
+        self.center = None
+        self.rows = 0
+    
+    def _publish (self):
+        '''
+        @summary: Copies the learner's new rows into shared memory, starts the workers with room for twice the rows if they do not fit
+        '''
+        trainData = self.learner.getData ()
+        if (self.pool is None or trainData.shape[0] > self.shared.shape[0] or trainData.shape[0] < self.rows):
+            self.close ()
+            shape = (max (16, 2 * trainData.shape[0]), trainData.shape[1])
+            rawData = RawArray (ctypes.c_double, shape[0] * shape[1])
+            rawNorms = RawArray (ctypes.c_double, shape[0])
+            self.shared = np.frombuffer (rawData).reshape (shape)
+            self.sharedNorms = np.frombuffer (rawNorms)
+            self.center = trainData[:, :-1].mean (axis=0)
+            self.rows = 0
+            self.pool = Pool (self.noOfThreads, _initPool, (rawData, rawNorms, shape, self.center))
             #if ends
         
-        #for i in range (0 , data_limit): #for every data point
-        temp1[0:data_limit, :] = data [0:data_limit ,0:omitLastCol] - allQueries[ctr, :]
-        #for loop done
+        if (trainData.shape[0] > self.rows):
+            newData = trainData[self.rows:]
+            self.shared[self.rows:trainData.shape[0]] = newData
+            self.sharedNorms[self.rows:trainData.shape[0]] = ((newData[:, :-1] - self.center) ** 2).sum (axis=1)
+            self.rows = trainData.shape[0]
+            #if ends
+    
+    def query (self, allQueries, k=None, method=None):
+        '''
+        @summary: Estimates the 'y' values of the query points on the workers, see BlockedKNN.query
+        @return: A numpy array with the predicted 'y' values for the query points
+        '''
+        if (k is None):
+            k = self.learner.k
+        if (method is None):
+            method = self.learner.method
+        allQueries = np.atleast_2d (np.asarray (allQueries, dtype=float))
+        _checkQuery (self.learner.getData (), allQueries, k)
+        self._publish ()
         
-        temp1 = temp1*temp1; #square each element in temp1
-        for ctr2 in range (0, data_limit):
-            temp2[ctr2] = math.sqrt(sum (temp1[ctr2,:]))
+        answer = np.zeros (allQueries.shape[0])
+        bounds = _chunkBounds (allQueries.shape[0], self.noOfThreads * self.chunksPerThread)
+        tasks = [(start, allQueries[start:end], k, method, self.rows, self.learner.maxCells)
+                 for start, end in zip (bounds[:-1], bounds[1:])]
+        for start, result in self.pool.imap_unordered (_poolQuery, tasks):
+            answer[start:start + len (result)] = result
             #for ends
-                  
-        index = temp2.argsort () #This is actually overkill because we need to sort only the top 'k' terms- but this sorts all of them     
-        #following loop for debugging only  
-        #for j in range (0, k):
-        #   print str(data [index[j], :])
-            #for ends
-        
-        if (method == 'mean'):
-            #Now we need to find the average of the k top most 'y' values
-            answer[ctr] = sum (data[ index [0:k], -1]) / k  #0 to (k-1)th index will be k values. But for this we have to give [0:k] because it stops one short of the last index
-            #if method == mean ends
-        if (method == 'median'):
-            answer [ctr] = np.median (data[index [0:k], -1])
-            # if median ends
-        if (method == 'mode'):
-            answer [ctr] = sc.stats.mode (data[index[0:k],-1])[0][0]; #The first mode. If there is more than one mode then the only the first mode is returned
-            #endif mode    
-        #for ctr in range (0, limit) ends
-    return answer
-    #getAnswer ends
+        return answer
+    
+    def close (self):
+        '''
+        @summary: Stops the workers, the next query starts new ones
+        '''
+        if (self.pool is not None):
+            self.pool.close ()
+            self.pool.join ()
+            self.pool = None
+    
+    def __enter__ (self):
+        return self
+    
+    def __exit__ (self, excType, excValue, traceback):
+        self.close ()
 
 
 def addEvidence (newData):
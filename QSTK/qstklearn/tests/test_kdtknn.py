@@ -0,0 +1,73 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for the KD-tree kNN learner
+'''
+
+# Python imports
+import unittest
+
+# 3rd party imports
+import numpy as np
+from scipy.spatial import cKDTree
+
+# QSTK imports
+from QSTK.qstklearn import kdtknn
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.na_x = rs.randn(1000, 3)
+        self.na_y = rs.randint(0, 4, 1000).astype(float)
+        self.na_queries = rs.randn(100, 3)
+
+    def test_forest(self):
+        ''' Neighbors over the trees and the delta are those of a single tree '''
+        c_learner = kdtknn.kdtknn(k=5, method='raw', deltasize=64)
+        i_rows = 0
+        i_trees = 0
+        for i_add in [10, 50, 4, 100, 36, 300, 200, 1, 299]:
+            c_learner.addEvidence(self.na_x[i_rows:i_rows + i_add],
+                                  self.na_y[i_rows:i_rows + i_add])
+            i_rows += i_add
+
+            na_dist, na_index = cKDTree(self.na_x[:i_rows]).query(self.na_queries, 5)
+            na_found, na_found_dist = c_learner.query(self.na_queries, method='all')
+            self.assertTrue(np.allclose(na_found_dist, na_dist, rtol=1e-12, atol=0))
+            self.assertTrue(np.all(na_found == self.na_y[na_index]))
+
+            # Each row is in exactly one tree or in the delta
+            l_bounds = [(i_start, i_end) for i_start, i_end, c_tree in c_learner.trees]
+            i_start = 0
+            for i_first, i_end in l_bounds:
+                self.assertEqual(i_first, i_start)
+                i_start = i_end
+            self.assertTrue(i_rows - i_start < c_learner.deltasize)
+            i_trees = max(i_trees, len(l_bounds))
+        self.assertTrue(i_trees > 1)
+
+    def test_query_methods(self):
+        ''' Answers combine the classes of the single tree neighbors '''
+        c_learner = kdtknn.kdtknn(k=7, deltasize=128)
+        c_learner.addEvidence(self.na_x[:600], self.na_y[:600])
+        c_learner.query(self.na_queries)
+        c_learner.addEvidence(np.column_stack((self.na_x[600:], self.na_y[600:])))
+
+        na_dist, na_index = cKDTree(self.na_x).query(self.na_queries, 7)
+        na_classes = self.na_y[na_index]
+        self.assertTrue(np.allclose(c_learner.query(self.na_queries),
+                                    na_classes.mean(axis=1)))
+        self.assertTrue(np.all(c_learner.query(self.na_queries, method='median') ==
+                               np.median(na_classes, axis=1)))
+        na_weighted = (na_classes / na_dist).sum(axis=1) / (1. / na_dist).sum(axis=1)
+        self.assertTrue(np.allclose(c_learner.query(self.na_queries, weighted=True),
+                                    na_weighted))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for the brute force kNN learners
+'''
+
+# Python imports
+import unittest
+
+# 3rd party imports
+import numpy as np
+
+# QSTK imports
+from QSTK.qstklearn import parallelknn
+
+
+def exact_neighbors(na_train, na_queries, i_k):
+    ''' Nearest training rows of each query from the distances themselves '''
+    na_dist = ((na_queries[:, np.newaxis, :] - na_train[np.newaxis, :, :]) ** 2).sum(axis=2)
+    na_index = np.argsort(na_dist, axis=1, kind='mergesort')[:, :i_k]
+    return na_dist[np.arange(na_dist.shape[0])[:, np.newaxis], na_index], na_index
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.na_x = rs.randn(300, 3)
+        self.na_y = rs.randint(0, 4, 300).astype(float)
+        self.na_queries = rs.randn(200, 3)
+
+    def _check_learner(self, f_offset):
+        ''' BlockedKNN answers match the exact neighbors of points moved by f_offset '''
+        na_x = self.na_x + f_offset
+        na_queries = self.na_queries + f_offset
+        c_learner = parallelknn.BlockedKNN(k=5, maxCells=1000)
+        c_learner.addEvidence(na_x, self.na_y)
+
+        na_dist, na_index = exact_neighbors(na_x, na_queries, 5)
+        na_found = c_learner.neighbors(na_queries)[1]
+        self.assertTrue(np.all(na_found == na_index))
+        for s_method in ['mean', 'median', 'mode']:
+            na_expect = parallelknn.aggregate(self.na_y[na_index], s_method)
+            self.assertTrue(np.all(c_learner.query(na_queries, method=s_method) == na_expect))
+
+    def test_blocked_knn(self):
+        ''' Neighbors and answers of data around the origin '''
+        self._check_learner(0.)
+
+    def test_blocked_knn_offset(self):
+        ''' Data far from the origin, like prices or volumes, keeps its precision '''
+        self._check_learner(1e6)
+        self._check_learner(-3e8)
+
+    def test_knn_pool(self):
+        ''' Workers answer like the learner, also after rows are added '''
+        c_learner = parallelknn.BlockedKNN(k=5, method='mode', maxCells=1000)
+        c_learner.addEvidence(self.na_x[:100] + 1e6, self.na_y[:100])
+        na_queries = self.na_queries + 1e6
+        with parallelknn.KNNPool(c_learner, noOfThreads=2) as c_pool:
+            for i_rows in [100, 150, 300]:
+                if i_rows > c_learner.getData().shape[0]:
+                    i_old = c_learner.getData().shape[0]
+                    c_learner.addEvidence(self.na_x[i_old:i_rows] + 1e6,
+                                          self.na_y[i_old:i_rows])
+                na_index = exact_neighbors(self.na_x[:i_rows] + 1e6, na_queries, 5)[1]
+                na_expect = parallelknn.aggregate(self.na_y[na_index], 'mode')
+                self.assertTrue(np.all(c_pool.query(na_queries) == na_expect))
+                self.assertTrue(np.all(c_pool.query(na_queries, 3, 'mean') ==
+                                       c_learner.query(na_queries, 3, 'mean')))
+
+    def test_aggregate(self):
+        ''' Ties in mode go to the smallest value, weights pick the heaviest '''
+        na_labels = np.array([[3., 1., 3., 1., 2.], [5., 5., 4., 4., 4.]])
+        self.assertTrue(np.all(parallelknn.aggregate(na_labels, 'mode') == [1., 4.]))
+        na_weights = np.array([[1., 1., 1., 1., 5.], [3., 3., 1., 1., 1.]])
+        self.assertTrue(np.all(parallelknn.aggregate(na_labels, 'mode', na_weights) == [2., 5.]))
+        self.assertTrue(np.all(parallelknn.aggregate(na_labels, 'median') == [2., 4.]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for the sliding window kNN learner
+'''
+
+# Python imports
+import unittest
+
+# 3rd party imports
+import numpy as np
+from scipy.spatial import cKDTree
+
+# QSTK imports
+from QSTK.qstklearn import windowknn
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.na_x = rs.randn(5000, 3)
+        self.na_y = rs.randint(0, 4, 5000).astype(float)
+        self.na_queries = rs.randn(100, 3)
+        self.l_batches = rs.randint(1, 80, 60)
+
+    def test_window(self):
+        ''' Neighbors are those of a single tree over the live rows '''
+        c_learner = windowknn.WindowKNN(k=5, method='raw', window=12, deltasize=50)
+        na_times = np.zeros(len(self.na_x))
+        i_rows = 0
+        i_partial = 0
+        for i_time, i_add in enumerate(self.l_batches):
+            c_learner.addEvidence(self.na_x[i_rows:i_rows + i_add],
+                                  self.na_y[i_rows:i_rows + i_add], i_time)
+            na_times[i_rows:i_rows + i_add] = i_time
+            i_rows += i_add
+
+            na_live = np.nonzero(na_times[:i_rows] > i_time - 12)[0]
+            self.assertTrue(np.all(c_learner.getData()[:, :-1] == self.na_x[na_live]))
+            self.assertTrue(np.all(c_learner.getTimes() == na_times[na_live]))
+
+            i_k = min(5, len(na_live))
+            na_dist, na_index = cKDTree(self.na_x[na_live]).query(self.na_queries, i_k)
+            na_dist = na_dist.reshape(len(self.na_queries), -1)
+            na_index = na_index.reshape(len(self.na_queries), -1)
+            na_found, na_found_dist = c_learner.query(self.na_queries, k=i_k, method='all')
+            self.assertTrue(np.allclose(na_found_dist, na_dist, rtol=1e-12, atol=0))
+            self.assertTrue(np.all(na_found == self.na_y[na_live][na_index]))
+
+            if c_learner.trees and c_learner.trees[0][0] < c_learner.first:
+                i_partial += 1
+
+        # Queries went through trees holding expired rows
+        self.assertTrue(i_partial > 0)
+
+    def test_fractional_times(self):
+        ''' Rows are kept until they are a whole window older than the newest '''
+        c_learner = windowknn.WindowKNN(k=1, window=2.0, deltasize=2)
+        c_learner.addEvidence(self.na_x[:1], self.na_y[:1], 0.)
+        c_learner.addEvidence(self.na_x[1:2], self.na_y[1:2], 1.5)
+        self.assertEqual(list(c_learner.getTimes()), [0., 1.5])
+        c_learner.addEvidence(self.na_x[2:4], self.na_y[2:4], 1.99)
+        self.assertEqual(list(c_learner.getTimes()), [0., 1.5, 1.99, 1.99])
+        c_learner.addEvidence(self.na_x[4:5], self.na_y[4:5], 2.)
+        self.assertEqual(list(c_learner.getTimes()), [1.5, 1.99, 1.99, 2.])
+        c_learner.addEvidence(self.na_x[5:6], self.na_y[5:6], 3.99)
+        self.assertEqual(list(c_learner.getTimes()), [2., 3.99])
+
+        na_index = cKDTree(self.na_x[4:6]).query(self.na_queries, 1)[1]
+        self.assertTrue(np.all(c_learner.query(self.na_queries) == self.na_y[4:6][na_index]))
+
+    def test_expire(self):
+        ''' Expiring every row leaves nothing to query, later rows are found again '''
+        c_learner = windowknn.WindowKNN(k=3, deltasize=16)
+        c_learner.addEvidence(self.na_x[:100], self.na_y[:100], 0)
+        c_learner.addEvidence(self.na_x[100:150], self.na_y[100:150], 5)
+        self.assertRaises(ValueError, c_learner.addEvidence, self.na_x[:1], self.na_y[:1], 4)
+
+        c_learner.expire(1)
+        self.assertEqual(c_learner.getData().shape[0], 50)
+        c_learner.expire(6)
+        self.assertTrue(c_learner.query(self.na_queries) is None)
+
+        c_learner.addEvidence(self.na_x[150:160], self.na_y[150:160], 6)
+        na_index = cKDTree(self.na_x[150:160]).query(self.na_queries, 3)[1]
+        self.assertTrue(np.allclose(c_learner.query(self.na_queries),
+                                    self.na_y[150:160][na_index].mean(axis=1)))
+
+    def test_halflife(self):
+        ''' Neighbors lose half their weight every halflife '''
+        c_learner = windowknn.WindowKNN(k=2, halflife=2.)
+        c_learner.addEvidence(np.array([[0.], [1.]]), np.array([1., 3.]), 0)
+        c_learner.addEvidence(np.array([[10.]]), np.array([5.]), 4)
+        self.assertAlmostEqual(c_learner.query(np.array([[0.]]))[0], (0.25 + 0.75) / 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+"""
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+KNN over a sliding window of training data, for walk-forward testing
+"""
+import collections
+import numpy
+from scipy.spatial import cKDTree
+from parallelknn import aggregate
+
+class WindowKNN(object):
+    """
+    A KNN learner that only learns from the most recent training data.
+
+    Every row added by 'addEvidence' has a time, by default the number of the
+    call, and 'expire' forgets rows older than a given time. Rows are kept in
+    a ring buffer in the order they are added, so adding and expiring rows is
+    amortized constant time.
+
+    As in kdtknn, the rows are split among a few KD-trees, each at most half as
+    large as the one before, and the newest rows are searched by brute force
+    until there are 'deltasize' of them. Trees that only hold expired rows are
+    dropped. The expired rows of the oldest tree are skipped over in queries,
+    and the tree is rebuilt once more than half of its rows have expired.
+    """
+    def __init__(self,k=3,method='mean',window=None,leafsize=10,deltasize=1024,weighted=False,halflife=None):
+        """
+        Basic setup. If 'window' is not None, 'addEvidence' expires the rows that are
+        'window' or more time units older than the rows it adds. 'weighted' and
+        'method' are as in kdtknn. If 'halflife' is not None, the weight of a
+        neighbor also halves every 'halflife' time units of its age.
+        """
+        self.k = k
+        self.method = method
+        self.window = window
+        self.leafsize = leafsize
+        self.deltasize = deltasize
+        self.weighted = weighted
+        self.halflife = halflife
+        self.buffer = None
+        self.times = None
+        self.first = 0 #sequence number of the oldest live row
+        self.end = 0 #sequence number after the newest row
+        self.tree_end = 0 #sequence number after the last row in a tree
+        self.trees = collections.deque() #(first row, end, tree) of each tree, the oldest may hold expired rows
+        self.clock = None
+
+    def _positions(self,start,end):
+        """
+        Positions in the ring buffer of the rows with sequence numbers start to end.
+        """
+        return numpy.arange(start,end) % self.buffer.shape[0]
+
+    def addEvidence(self,dataX,dataY=None,time=None):
+        """
+        @summary: Add training data
+        @param dataX: Data to add, either entire set with classification as last column, or not if
+                      the Y data is provided explicitly.  Must be same width as previously appended data.
+        @param dataY: Optional, can be used
+        @param time: Time of the data, no earlier than that of earlier calls. Default is one
+                     after the last time, starting from 0.
+        """
+        dataX = numpy.atleast_2d(dataX)
+        if dataY is not None:
+            data = numpy.zeros([dataX.shape[0],dataX.shape[1]+1])
+            data[:,0:dataX.shape[1]]=dataX
+            data[:,(dataX.shape[1])]=dataY
+        else:
+            data = numpy.asarray(dataX,dtype=float)
+
+        if time is None:
+            time = 0 if self.clock is None else self.clock + 1
+        if self.clock is not None and time < self.clock:
+            raise ValueError('Evidence at %s is older than evidence at %s' % (time, self.clock))
+        self.clock = time
+
+        ''' The ring buffer doubles when full, live rows keep their sequence numbers '''
+        rows = data.shape[0]
+        if self.buffer is None:
+            self.buffer = numpy.zeros((max(16, rows), data.shape[1]))
+            self.times = numpy.zeros(self.buffer.shape[0])
+        elif self.end - self.first + rows > self.buffer.shape[0]:
+            live = self._positions(self.first,self.end)
+            buf = numpy.zeros((max(2*self.buffer.shape[0], self.end - self.first + rows), self.buffer.shape[1]))
+            times = numpy.zeros(buf.shape[0])
+            buf[numpy.arange(self.first,self.end) % buf.shape[0]] = self.buffer[live]
+            times[numpy.arange(self.first,self.end) % buf.shape[0]] = self.times[live]
+            self.buffer = buf
+            self.times = times
+
+        positions = self._positions(self.end,self.end + rows)
+        self.buffer[positions] = data
+        self.times[positions] = time
+        self.end += rows
+
+        if self.window is not None:
+            self.expire(time - self.window, through=True)
+
+        if self.end - self.tree_end >= self.deltasize:
+            start = self.tree_end
+            while self.trees and self.trees[-1][1] - self.trees[-1][0] <= self.end - start:
+                start = self.trees.pop()[0]
+            self._addTree(max(start, self.first), self.end)
+            self.tree_end = self.end
+
+    def _addTree(self,start,end,left=False):
+        """
+        Builds a tree over the rows start to end, after the other trees or before them if left.
+        """
+        tree = cKDTree(self.buffer[self._positions(start,end),:-1],leafsize=self.leafsize)
+        if left:
+            self.trees.appendleft((start, end, tree))
+        else:
+            self.trees.append((start, end, tree))
+
+    def expire(self,time,through=False):
+        """
+        @summary: Forgets the rows older than time, and those at time if 'through' is True
+        """
+        ''' Times only increase along the ring, so the first row to keep is found by bisection '''
+        low = self.first
+        high = self.end
+        while low < high:
+            middle = (low + high) // 2
+            row_time = self.times[middle % self.buffer.shape[0]]
+            if row_time < time or (through and row_time == time):
+                low = middle + 1
+            else:
+                high = middle
+        self.first = low
+        self.tree_end = max(self.tree_end, self.first)
+
+        while self.trees and self.trees[0][1] <= self.first:
+            self.trees.popleft()
+        if self.trees and 2*(self.first - self.trees[0][0]) > self.trees[0][1] - self.trees[0][0]:
+            end = self.trees.popleft()[1]
+            self._addTree(self.first, end, left=True)
+
+    def getData(self):
+        """
+        Returns the live rows, oldest first.
+        """
+        if self.buffer is None:
+            return numpy.zeros((0, 0))
+        return self.buffer[self._positions(self.first,self.end)]
+
+    def getTimes(self):
+        """
+        Returns the times of the live rows, oldest first.
+        """
+        if self.buffer is None:
+            return numpy.zeros(0)
+        return self.times[self._positions(self.first,self.end)]
+
+    def _treeNeighbors(self,start,end,tree,points,k):
+        """
+        The k nearest live rows of one tree, or all of them if it has fewer.
+        Returns (distances, sequence numbers), nearest first.
+        """
+        live = end - max(start, self.first)
+        k = min(k, live)
+        if start >= self.first:
+            dist, index = tree.query(points, k)
+            return dist.reshape(points.shape[0], -1), index.reshape(points.shape[0], -1) + start
+
+        ''' Expired rows are skipped, points left with fewer than k live rows ask for twice as many '''
+        na_dist = numpy.zeros((points.shape[0], k))
+        na_seq = numpy.zeros((points.shape[0], k), dtype=int)
+        todo = numpy.arange(points.shape[0])
+        ask = min(end - start, k * (end - start) // live + 1)
+        while todo.size > 0:
+            dist, index = tree.query(points[todo], ask)
+            dist = dist.reshape(todo.size, -1)
+            seq = index.reshape(todo.size, -1) + start
+            alive = seq >= self.first
+            done = alive.sum(axis=1) >= k
+            order = numpy.argsort(~alive[done], axis=1, kind='mergesort')[:,:k]
+            rows = numpy.arange(order.shape[0])[:,numpy.newaxis]
+            na_dist[todo[done]] = dist[done][rows, order]
+            na_seq[todo[done]] = seq[done][rows, order]
+            todo = todo[~done]
+            ask = min(end - start, 2*ask)
+        return na_dist, na_seq
+
+    def _neighbors(self,points,k):
+        """
+        The k nearest live neighbors of each point. Returns (distances, positions in
+        the ring buffer), both shaped like points x k, nearest first.
+        """
+        points = numpy.atleast_2d(points)
+        ldist = []
+        lseq = []
+        for start, end, tree in self.trees:
+            dist, seq = self._treeNeighbors(start, end, tree, points, k)
+            ldist.append(dist)
+            lseq.append(seq)
+
+        ''' Distances of the newest rows are summed one dimension at a time, as the trees do '''
+        delta = self.buffer[self._positions(self.tree_end,self.end),:-1]
+        if delta.shape[0] > 0:
+            dist = numpy.zeros((points.shape[0], delta.shape[0]))
+            for dim in range(delta.shape[1]):
+                diff = points[:,dim:dim+1] - delta[:,dim]
+                dist += diff * diff
+            seq = numpy.tile(numpy.arange(self.tree_end, self.end), (points.shape[0], 1))
+            if delta.shape[0] > k:
+                #only the k nearest of the newest rows can be neighbors
+                rows = numpy.arange(points.shape[0])[:,numpy.newaxis]
+                nearest = numpy.sort(numpy.argpartition(dist, k - 1, axis=1)[:,:k], axis=1)
+                dist = dist[rows, nearest]
+                seq = seq[rows, nearest]
+            ldist.append(numpy.sqrt(dist))
+            lseq.append(seq)
+
+        dist = numpy.hstack(ldist)
+        seq = numpy.hstack(lseq)
+        order = numpy.argsort(dist, axis=1, kind='mergesort')[:,:k]
+        rows = numpy.arange(points.shape[0])[:,numpy.newaxis]
+        return dist[rows, order], seq[rows, order] % self.buffer.shape[0]
+
+    def query(self,points,k=None,method=None,weighted=None):
+        """
+        Classify a set of test points given their k nearest live neighbors.
+
+        Same as kdtknn.query. Returns None if there are no live rows.
+        """
+        if k is None:
+            k = self.k
+        if method is None:
+            method = self.method
+        if weighted is None:
+            weighted = self.weighted
+        if self.end == self.first:
+            return None
+        if k > self.end - self.first:
+            raise ValueError('k is %d but there are only %d live rows' % (k, self.end - self.first))
+
+        na_dist, na_neighbors = self._neighbors(points,k)
+        n_clsses = self.buffer[na_neighbors, -1]
+
+        if method=='raw':
+            return n_clsses
+        elif method=='all':
+            return n_clsses, na_dist
+
+        na_weights = None
+        if weighted:
+            na_exact = na_dist == 0
+            with numpy.errstate(divide='ignore'):
+                na_weights = numpy.where(na_exact.any(axis=1)[:,numpy.newaxis], na_exact, 1. / na_dist)
+        if self.halflife is not None:
+            na_decay = 0.5 ** ((self.clock - self.times[na_neighbors]) / float(self.halflife))
+            na_weights = na_decay if na_weights is None else na_weights * na_decay
+        return aggregate(n_clsses, method, na_weights)
@@ -11,4 +11,5 @@ Created on June 6, 2012
 @summary: Init for simulator code
 
 '''
-from tradesim import _calculate_leverage, tradesim, tradesim_comb
+from tradesim import _calculate_leverage, tradesim, tradesim_comb, tradesim_batch
+from txnlog import TransactionLog, read_transactions
@@ -14,6 +14,7 @@ Created on May 14, 2012
 # Python imports
 import datetime as dt
 import unittest
+import importlib
 
 # 3rd Party Imports
 import pandas as pand
@@ -91,6 +92,49 @@ class Test(unittest.TestCase):
         self.assertTrue(True)
         #self.assertTrue(abs(df_funds[-1] - 10000 * self.i_open_result)<=0.01)
 
+    def test_arrays_match_loop(self):
+        ''' Tests the array simulation against the row by row loop '''
+        tsim = importlib.import_module('QSTK.qstksim.tradesim')
+        t_args = (10000, 10, True, 0.02, 5, 0.02, 1, 3.0)
+
+        t_arrays = tsim.tradesim(self.df_alloc, self.df_close.copy(), *t_args,
+                                 b_exposure=True)
+        fc_fit = tsim._arrays_fit
+        tsim._arrays_fit = lambda alloc, df_historic: False
+        try:
+            t_loop = tsim.tradesim(self.df_alloc, self.df_close.copy(), *t_args,
+                                   b_exposure=True)
+        finally:
+            tsim._arrays_fit = fc_fit
+
+        for o_arrays, o_loop in zip(t_arrays, t_loop):
+            if isinstance(o_loop, pand.Series):
+                self.assertEqual(list(o_arrays.index), list(o_loop.index))
+                o_arrays = o_arrays.values
+                o_loop = o_loop.values
+            np.testing.assert_allclose(o_arrays, o_loop, rtol=1e-9)
+
+    def test_batch(self):
+        ''' Tests tradesim_batch against one tradesim call per scenario '''
+        tsim = importlib.import_module('QSTK.qstksim.tradesim')
+        lf_slippage = [0.0, 0.02, 0.01]
+        lf_rate_borrow = [0.0, 3.0, 1.0]
+        (df_funds, df_leverage, na_commision, na_slippage, na_borrow) = \
+              tsim.tradesim_batch( self.df_alloc, self.df_close.copy(), 10000,
+                           1, True, lf_slippage, 5, 0.02, [1, 1, 2], lf_rate_borrow )
+
+        self.assertEqual(list(df_funds.columns), [0, 1, 2])
+        for i in range(3):
+            (ts_funds, ts_leverage, f_commision, f_slippage, f_borrow) = \
+                  tsim.tradesim( self.df_alloc, self.df_close.copy(), 10000,
+                           1, True, lf_slippage[i], 5, 0.02, [1, 1, 2][i],
+                           lf_rate_borrow[i] )
+            np.testing.assert_allclose(df_funds[i].values, ts_funds.values, rtol=1e-9)
+            np.testing.assert_allclose(df_leverage[i].values, ts_leverage.values,
+                                       rtol=1e-9)
+            np.testing.assert_allclose([na_commision[i], na_slippage[i], na_borrow[i]],
+                                       [f_commision, f_slippage, f_borrow], rtol=1e-9)
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
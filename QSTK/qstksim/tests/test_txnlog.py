@@ -0,0 +1,81 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for the transaction log
+'''
+
+# Python imports
+import os
+import shutil
+import tempfile
+import datetime as dt
+import unittest
+
+# 3rd Party Imports
+import numpy as np
+
+# QSTK imports
+from QSTK.qstksim.txnlog import TransactionLog, read_transactions
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.s_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.s_dir)
+
+    def _write(self, s_format, i_chunk=2):
+        ''' Logs a deposit and two trades, flushing every i_chunk rows '''
+        s_filename = os.path.join(self.s_dir, 'txn.' + s_format)
+        txn_log = TransactionLog(s_filename, s_format, i_chunk)
+        txn_log.deposit(dt.datetime(2012, 3, 1, 16), 10000)
+        txn_log.orders(dt.datetime(2012, 3, 2, 16), ['A', 'B', 'C'],
+                       np.array([10., -5., 2.]), np.array([100., 50., 25.]),
+                       np.array([10., -5., 2.]), 1.5, 0.5, 9990.,
+                       np.array([1., 1., 1.]), 0.254)
+        txn_log.orders(dt.datetime(2012, 3, 5, 16), ['B', 'A'],
+                       np.array([4., -12.]), np.array([48., 101.]),
+                       np.array([-1., -2.]), 0.2, -0.2, 9985.,
+                       np.array([1., 1.2]), 0.1)
+        txn_log.close()
+        return s_filename
+
+    def test_csv(self):
+        ''' CSV log keeps the tradesim layout '''
+        ls_lines = open(self._write(TransactionLog.CSV)).read().splitlines()
+
+        self.assertEqual(len(ls_lines), 7)
+        self.assertEqual(ls_lines[1], "_CASH,_CASH,Cash Deposit,2012-03-01 16:00:00,,,,,10000.0,,")
+        self.assertEqual(ls_lines[3], "B,B,Sell Short,2012-03-02 16:00:00,1.5,0.5,-5.0,50.0,"
+                                      "-250.0,-5.0,9990.0,1.0,0.25,")
+        self.assertEqual([s_line.split(',')[2] for s_line in ls_lines[2:]],
+                         ['Buy', 'Sell Short', 'Buy', 'Buy to Cover', 'Sell Short'])
+
+    def test_fund(self):
+        ''' FUND log has the columns read by csv2fund '''
+        ls_lines = open(self._write(TransactionLog.FUND)).read().splitlines()
+
+        self.assertEqual(ls_lines[0], "Symbol,Name,Type,Date,Shares,Price,Cash value,Commission,Notes")
+        self.assertEqual(ls_lines[1], ",Deposit Cash,Deposit Cash,2012-03-01 16:00:00,,,10000.0,,")
+        self.assertEqual(ls_lines[6], "A,A,Sell Short,2012-03-05 16:00:00,12.0,101.0,1212.0,1.2,")
+
+    def test_binary(self):
+        ''' BINARY log reads back every transaction across chunks '''
+        df_txn = read_transactions(self._write(TransactionLog.BINARY))
+
+        self.assertEqual(list(df_txn['symbol']), ['_CASH', 'A', 'B', 'C', 'B', 'A'])
+        self.assertEqual(list(df_txn['type']), ['Cash Deposit', 'Buy', 'Sell Short',
+                                                'Buy', 'Buy to Cover', 'Sell Short'])
+        self.assertEqual(df_txn['date'][5], dt.datetime(2012, 3, 5, 16))
+        self.assertEqual(df_txn['value'][0], 10000.)
+        self.assertEqual(list(df_txn['value'][1:]), [1000., -250., 50., 192., -1212.])
+        self.assertEqual(df_txn['commission'][5], 1.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,6 +23,7 @@ from copy import deepcopy
 
 # QSTK imports
 from QSTK.qstkutil import tsutil as tsu
+from QSTK.qstksim.txnlog import TransactionLog, _usecs
 
 def _calculate_leverage(values_by_stock, ts_leverage, ts_long_exposure, ts_short_exposure, ts_net_exposure):
     """
@@ -134,10 +135,316 @@ def _nearest_interger(f_x):
     else :
         return np.ceil(f_x)
 
+def _trim_alloc(alloc, df_historic):
+
+    """
+    @summary Drops allocations outside of the historical data
+    @return: allocations within df_historic
+    """
+    if alloc.index[-1] > df_historic.index[-1]:
+        print "Historical Data not sufficient"
+        indices, = np.where(alloc.index <= df_historic.index[-1])
+        alloc = alloc.reindex(index = alloc.index[indices])
+
+    if alloc.index[0] < df_historic.index[0]:
+        print "Historical Data not sufficient"
+        indices, = np.where(alloc.index >= df_historic.index[0])
+        alloc = alloc.reindex(index = alloc.index[indices])
+    return alloc
+
+def _nansum(na_values, axis=None):
+
+    """
+    @summary Sum skipping NaNs like pandas, all NaN gives NaN
+    @param na_values: numpy array
+    @param axis: axis to sum over, None for all values
+    @return: sum of the non NaN values
+    """
+    na_mask = np.isnan(na_values)
+    f_sum = np.where(na_mask, 0.0, na_values).sum(axis)
+    if axis is None:
+        if na_mask.all():
+            return np.NAN
+        return f_sum
+    f_sum[na_mask.all(axis)] = np.NAN
+    return f_sum
+
+def _arrays_fit(alloc, df_historic):
+
+    """
+    @summary Checks that tradesim can run on arrays, the price columns must
+             be the allocation columns in the same order and the price
+             timestamps strictly increasing
+    @param alloc: allocation DataMatrix with _CASH as the last column
+    @param df_historic: prices, including the _CASH column
+    @return: True if _tradesim_arrays gives the same result as the loop
+    """
+    if len(alloc.index) == 0 or list(alloc.columns) != list(df_historic.columns):
+        return False
+    if alloc.columns[-1] != '_CASH':
+        return False
+    na_dates = np.asarray(df_historic.index)
+    return bool(np.all(na_dates[1:] > na_dates[:-1]))
+
+def _align_rows(alloc, df_historic):
+
+    """
+    @summary Finds the price rows used for each allocation. Trades happen on
+             the first price at or after the allocation, predictions use
+             the one before it. Like the loop in tradesim, the last price
+             is used when there is none before.
+    @return: arrays of trade rows and prediction rows, one per allocation
+    """
+    na_trade = df_historic.index.searchsorted(np.asarray(alloc.index))
+    na_pred = na_trade - 1
+    na_pred[na_pred < 0] += len(df_historic.index)
+    return na_trade, na_pred
+
+def _tradesim_arrays(alloc, df_historic, f_start_cash, i_leastcount,
+            b_followleastcount, f_slippage, f_minimumcommision, f_commision_share,
+            i_target_leverage, f_rate_borrow, txn_log, b_exposure):
+
+    """
+    @summary Same simulation as the loop in tradesim, on numpy arrays. Trade
+             and prediction rows are looked up once, shares and cash are
+             kept in arrays and the time series are built at the end.
+    @param txn_log: TransactionLog or None, closed on return
+    @return: the same tuple as tradesim
+    """
+    ls_syms = list(alloc.columns)
+    na_alloc = np.asarray(alloc.values, dtype=float)
+    na_price = np.asarray(df_historic.values, dtype=float)
+    ldt_dates = df_historic.index
+    na_trade, na_pred = _align_rows(alloc, df_historic)
+
+    shares = na_alloc[0] * 0.0
+    shares[-1] = f_start_cash
+
+    f_total_commision = 0.0
+    f_total_slippage = 0.0
+    f_total_borrow = 0.0
+
+    cashleft = 0.0
+    f_fund = f_start_cash
+    f_no_trans_fund = f_start_cash
+    i_last_fund = na_pred[0]
+
+    # Rows of the fund history and the leverage on each of them
+    li_fund_rows = [i_last_fund]
+    lna_fund = [np.array([f_start_cash], dtype=float)]
+    lna_exposure = [np.zeros((1, 4))]
+
+    li_order_rows = []
+    lf_orders = []
+
+    dt_last_date = None
+    f_last_borrow = 0.0
+
+    #log initial cash value
+    if txn_log is not None:
+        txn_log.deposit(ldt_dates[na_pred[0]], f_start_cash)
+
+    for i_row in range(len(na_alloc)):
+
+        i_trade = na_trade[i_row]
+        i_pred = na_pred[i_row]
+        trade_date = ldt_dates[i_trade]
+        na_trade_price = na_price[i_trade]
+        na_pred_price = na_price[i_pred]
+
+        f_borrow_cost = 0.0
+        if i_row > 0:
+            # value the fund on every day up until this trade
+            if i_pred > i_last_fund:
+                values_by_stock = na_price[i_last_fund + 1:i_pred + 1] * shares
+                na_fund = _nansum(values_by_stock, axis=1)
+                li_fund_rows.extend(range(i_last_fund + 1, i_pred + 1))
+                lna_fund.append(na_fund)
+                lna_exposure.append(_exposures(values_by_stock))
+                f_fund = na_fund[-1]
+                f_no_trans_fund = na_fund[-1] - cashleft
+                i_last_fund = i_pred
+
+            if dt_last_date is not None:
+                days_since_alloc = (trade_date - dt_last_date).days
+                f_borrow_cost = abs((days_since_alloc*f_last_borrow*f_rate_borrow)/(100*365))
+                f_total_borrow = f_total_borrow + f_borrow_cost
+
+        #Normalizing the allocations
+        proportion = na_alloc[i_row] / _nansum(np.abs(na_alloc[i_row]))
+        proportion = proportion*i_target_leverage
+
+        # Get shares to be purchased
+        prediction_shares = (proportion*f_fund) / na_pred_price
+        no_trans_shares = (proportion*f_no_trans_fund) / na_pred_price
+
+        if b_followleastcount == True:
+            prediction_shares = _least_count(prediction_shares, i_leastcount)
+            no_trans_shares = _least_count(no_trans_shares, i_leastcount)
+
+        #compare current holding to future holding, both ignoring the last
+        #round of transaction cost and slippage
+        cash_delta_less_shares = shares.copy()
+        cash_delta_less_shares[-1] = cash_delta_less_shares[-1] - cashleft
+        if _same_holding(cash_delta_less_shares, no_trans_shares)[0]:
+            continue
+
+        #Order to be executed
+        order = (prediction_shares - shares)[:-1]
+
+        # Transaction costs, any non zero order pays at least the minimum
+        f_transaction_cost = _commisions(order[order != 0], f_minimumcommision,
+                                         f_commision_share).sum()
+        f_total_commision = f_total_commision + f_transaction_cost
+
+        value_before_trade = _nansum(na_trade_price*shares)
+
+        # Shares that were actually purchased
+        shares = prediction_shares
+
+        # Value after the purchase (change in price at execution)
+        value_after_trade = _nansum(na_trade_price*shares)
+
+        #Slippage Cost
+        f_slippage_cost = np.abs(f_slippage*na_trade_price[:-1]*order)
+        f_slippage_cost[np.isnan(f_slippage_cost)] = 0.0
+        f_slippage_cost = f_slippage_cost.sum()
+
+        #Orders
+        f_order = np.abs((1+f_slippage)*na_trade_price[:-1]*order)
+        f_order[np.isnan(f_order)] = 0.0
+        li_order_rows.append(i_trade)
+        lf_orders.append(f_order.sum())
+
+        f_total_slippage = f_total_slippage + f_slippage_cost
+        # Rebalancing the cash left
+        cashleft = value_before_trade - value_after_trade - f_transaction_cost - f_slippage_cost - f_borrow_cost
+
+        dt_last_date = trade_date
+        f_last_holding = na_trade_price*shares
+        f_last_borrow = abs(f_last_holding[f_last_holding < 0].sum())
+
+        shares = shares.copy()
+        shares[-1] = shares[-1] + cashleft
+
+        if txn_log is not None:
+            money_short = f_last_borrow
+            money_long = abs(f_last_holding[f_last_holding >= 0].sum())
+            GL = (money_long + money_short) / (money_long - money_short + cashleft)
+            NL = (money_long - money_short) / (money_long - money_short + cashleft)
+
+            na_traded = np.where(order != 0)[0]
+            txn_log.orders(trade_date, [ls_syms[i] for i in na_traded], order[na_traded],
+                           na_trade_price[na_traded], shares[na_traded], GL, NL,
+                           value_after_trade, _commisions(order[na_traded],
+                           f_minimumcommision, f_commision_share), f_slippage_cost)
+
+    if txn_log is not None:
+        #deposit nothing at end so that if we reload the transaction history the whole period gets shown
+        txn_log.deposit(ldt_dates[na_pred[-1]], 0)
+        txn_log.close()
+
+    ldt_fund = [ldt_dates[i] for i in li_fund_rows]
+    ts_fund = pand.Series(np.concatenate(lna_fund), index=ldt_fund)
+    na_exposure = np.concatenate(lna_exposure)
+    ts_leverage = pand.Series(na_exposure[:, 0], index=ldt_fund)
+
+    if b_exposure:
+        ts_long_exposure = pand.Series(na_exposure[:, 1], index=ldt_fund)
+        ts_short_exposure = pand.Series(na_exposure[:, 2], index=ldt_fund)
+        ts_net_exposure = pand.Series(na_exposure[:, 3], index=ldt_fund)
+        ts_orders = pand.Series(lf_orders, index=[ldt_dates[i] for i in li_order_rows])
+        ts_turnover = _monthly_turnover(ts_orders, ts_fund)
+        return (ts_fund, ts_leverage, f_total_commision, f_total_slippage, f_total_borrow,
+                        ts_long_exposure, ts_short_exposure, ts_net_exposure, ts_turnover)
+    return (ts_fund, ts_leverage, f_total_commision, f_total_slippage, f_total_borrow)
+
+def _commisions(na_order, f_minimumcommision, f_commision_share):
+
+    """
+    @summary Commision of each order, at least the minimum commision
+    @return: array of commisions
+    """
+    na_commision = f_commision_share*np.abs(na_order)
+    return np.where(na_commision > f_minimumcommision, na_commision, f_minimumcommision)
+
+def _least_count(na_shares, i_leastcount):
+
+    """
+    @summary Rounds share counts towards zero to a multiple of i_leastcount
+    @param na_shares: numpy array of share counts
+    @param i_leastcount: minimum no. of shares per transaction
+    @return: rounded share counts
+    """
+    return np.trunc(na_shares / i_leastcount) * i_leastcount
+
+def _same_holding(na_current, na_future):
+
+    """
+    @summary Compares holdings the way the loop in tradesim does, by the
+             printed value of every share count
+    @param na_current: share counts, symbols or scenarios x symbols
+    @param na_future: share counts, same shape as na_current
+    @return: boolean array, True for each scenario needing no transaction
+    """
+    na_current = np.atleast_2d(na_current)
+    na_future = np.atleast_2d(na_future)
+
+    # Counts further apart than this print differently whatever the float
+    # format, only the scenarios without such a count are compared as text
+    olderr = np.seterr(invalid='ignore')
+    try:
+        na_close = (np.abs(na_current - na_future) <=
+                    1e-10 * np.maximum(np.abs(na_current), np.abs(na_future)))
+    finally:
+        np.seterr(**olderr)
+    na_close |= (na_current == na_future) | \
+                (np.isnan(na_current) & np.isnan(na_future))
+    b_same = na_close.all(axis=1)
+
+    for i in np.where(b_same)[0]:
+        na_a = na_current[i]
+        na_b = na_future[i]
+        na_differ = ~(((na_a == na_b) & (np.signbit(na_a) == np.signbit(na_b))) |
+                      (np.isnan(na_a) & np.isnan(na_b)))
+        for j in np.where(na_differ)[0]:
+            if str(na_a[j]) != str(na_b[j]):
+                b_same[i] = False
+                break
+    return b_same
+
+def _exposures(values_by_stock):
+
+    """
+    @summary Array version of _calculate_leverage
+    @param values_by_stock: days x symbols array of values held, _CASH last
+    @return: days x 4 array of leverage, long, short and net exposure
+    """
+    na_stocks = values_by_stock[:, :-1]
+    f_long = np.where(na_stocks >= 0, na_stocks, 0.0).sum(axis=1)
+    f_short = np.where(na_stocks < 0, na_stocks, 0.0).sum(axis=1)
+    f_total = f_long + values_by_stock[:, -1] + f_short
+
+    na_exposure = np.empty((len(values_by_stock), 4))
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        na_exposure[:, 0] = (f_long + abs(f_short)) / f_total
+        na_exposure[:, 1] = f_long / f_total
+        na_exposure[:, 2] = abs(f_short) / f_total
+        na_exposure[:, 3] = (f_long - abs(f_short)) / f_total
+    finally:
+        np.seterr(**olderr)
+
+    # leverage and net exposure are 0 where there is nothing to divide by
+    na_exposure[np.isnan(na_exposure[:, 0]), 0] = 0
+    na_exposure[np.isnan(na_exposure[:, 3]), 3] = 0
+    return na_exposure
+
 def tradesim( alloc, df_historic, f_start_cash, i_leastcount=1,
             b_followleastcount=False, f_slippage=0.0,
             f_minimumcommision=0.0, f_commision_share=0.0,
-            i_target_leverage=1, f_rate_borrow = 0.0, log="false", b_exposure=False):
+            i_target_leverage=1, f_rate_borrow = 0.0, log="false", b_exposure=False,
+            log_format=TransactionLog.CSV):
 
     """
     @summary Quickly back tests an allocation for certain df_historical data,
@@ -153,6 +460,8 @@ def tradesim( alloc, df_historic, f_start_cash, i_leastcount=1,
     @param f_commision_share: Commision per share
     @param b_followleastcount: False will allow fractional shares
     @param log: CSV file to log transactions to
+    @param log_format: TransactionLog.CSV, TransactionLog.FUND for the
+                       layout read by csv2fund or TransactionLog.BINARY
     @return funds: TimeSeries with fund values for each day in the back test
     @return leverage: TimeSeries with Leverage values for each day in the back test
     @return Commision costs : Total commision costs in the whole backtester
@@ -160,28 +469,25 @@ def tradesim( alloc, df_historic, f_start_cash, i_leastcount=1,
     @rtype TimeSeries
     """
 
-    if alloc.index[-1] > df_historic.index[-1]:
-        print "Historical Data not sufficient"
-        indices, = np.where(alloc.index <= df_historic.index[-1])
-        alloc = alloc.reindex(index = alloc.index[indices])
-
-    if alloc.index[0] < df_historic.index[0]:
-        print "Historical Data not sufficient"
-        indices, = np.where(alloc.index >= df_historic.index[0])
-        alloc = alloc.reindex(index = alloc.index[indices])
-
-    #open log file
-    if log!="false":
-        log_file=open(log,"w")
+    alloc = _trim_alloc(alloc, df_historic)
 
-    #write column headings
+    #open log file, this writes the column headings
+    txn_log = None
     if log!="false":
         print "writing transaction log to "+log
-        log_file.write("Symbol,Company Name,Txn Type,Txn Date/Time, Gross Leverage, Net Leverage,# Shares,Price,Txn Value,Portfolio # Shares,Portfolio Value,Commission,Slippage(10BPS),Comments\n")
+        txn_log = TransactionLog(log, log_format)
 
     #a dollar is always worth a dollar
     df_historic['_CASH'] = 1.0
 
+    # Prices and allocations that line up column for column are simulated on
+    # arrays, anything else goes through the row by row loop below
+    if _arrays_fit(alloc, df_historic):
+        return _tradesim_arrays(alloc, df_historic, f_start_cash, i_leastcount,
+                   b_followleastcount, f_slippage, f_minimumcommision,
+                   f_commision_share, i_target_leverage, f_rate_borrow,
+                   txn_log, b_exposure)
+
     # Shares -> Variable holds the shares to be traded on the next timestamp
     # prediction_shares -> Variable holds the shares that were calculated
                             #for trading based on previous timestamp
@@ -223,8 +529,8 @@ def tradesim( alloc, df_historic, f_start_cash, i_leastcount=1,
 
         if b_first_iter == True:
             #log initial cash value
-            if log!="false":
-                log_file.write("_CASH,_CASH,Cash Deposit,"+str(prediction_date)+",,,,,"+str(f_start_cash)+",,\n")
+            if txn_log is not None:
+                txn_log.deposit(prediction_date, f_start_cash)
 
 
             # Fund Value on start
@@ -388,37 +694,23 @@ def tradesim( alloc, df_historic, f_start_cash, i_leastcount=1,
             NL = (money_long - money_short) / (money_long - money_short + money_cash)
 
 
-            #for all symbols, print required transaction to log
-            for sym in shares:
-                if sym != "_CASH":
-                    f_stock_commission=max(f_minimumcommision, f_commision_share*abs(order[sym]))
-                    order_type="Buy"
-                    if(order[sym]<0):
-                        if(shares[sym]<0):
-                            order_type="Sell Short"
-                        else:
-                            order_type="Sell"
-                    elif shares[sym]<0:
-                        order_type="Buy to Cover"
-
-
-                    if log!="false":
-                        if(abs(order[sym])!=0):
-                            log_file.write(str(sym) + ","+str(sym)+","+order_type+","+str(trade_date)+","+str(GL)+","+str(NL)+\
-                                       ","+str(order[sym])+","+str(trade_price[sym].values[0])+","+\
-                                        str(trade_price[sym].values[0]*order[sym])+","\
-                                       +str(shares[sym].ix[-1])+","+str(value_after_trade)+","+str(f_stock_commission)+","+\
-                                        str(round(f_slippage_cost,2))+",")
-                            log_file.write("\n")
+            #log the orders of all symbols traded
+            if txn_log is not None:
+                ls_traded = [sym for sym in order.index if order[sym] != 0]
+                txn_log.orders(trade_date, ls_traded, order.reindex(ls_traded).values,
+                               trade_price.reindex(columns=ls_traded).values[0],
+                               shares.reindex(columns=ls_traded).values[-1], GL, NL,
+                               value_after_trade, _commisions(order.reindex(ls_traded).values,
+                               f_minimumcommision, f_commision_share), f_slippage_cost)
 
         # End of Loop
 
 
     #close log
-    if log!="false":
+    if txn_log is not None:
         #deposit nothing at end so that if we reload the transaction history the whole period gets shown
-        log_file.write("_CASH,_CASH,Cash Deposit,"+str(prediction_date)+",,,,,"+str(0)+",,")
-        log_file.close()
+        txn_log.deposit(prediction_date, 0)
+        txn_log.close()
     #print ts_fund
     #print ts_leverage
     #print f_total_commision
@@ -433,10 +725,177 @@ def tradesim( alloc, df_historic, f_start_cash, i_leastcount=1,
     return (ts_fund, ts_leverage, f_total_commision, f_total_slippage, f_total_borrow)
 
 
+def tradesim_batch( alloc, df_historic, f_start_cash, i_leastcount=1,
+            b_followleastcount=False, f_slippage=0.0,
+            f_minimumcommision=0.0, f_commision_share=0.0,
+            i_target_leverage=1, f_rate_borrow = 0.0):
+
+    """
+    @summary Back tests several scenarios at once, for parameter sweeps.
+             The price lookups are shared and every scenario is simulated
+             in the same pass over the allocations. Each cost, leverage or
+             allocation argument is either one value for all scenarios or
+             a list with one value per scenario.
+    @param alloc: DataMatrix as for tradesim, or a list of them sharing
+                  timestamps and symbols
+    @param df_historic: df_historic dataframe of equity prices, its columns
+                        must be the allocation symbols in the same order
+    @param f_start_cash: integer specifing initial fund value
+    @param i_leastcount: Minimum no. of shares per transaction, ie: 1, 10, 20
+    @param f_slippage: slippage per share (0.02), or a list
+    @param f_minimumcommision: Minimum commision cost per transaction, or a list
+    @param f_commision_share: Commision per share, or a list
+    @param i_target_leverage: Leverage the allocations are scaled to, or a list
+    @param f_rate_borrow: Yearly borrow rate in percent, or a list
+    @param b_followleastcount: False will allow fractional shares
+    @return funds: DataFrame with the fund value of each scenario (columns)
+                   for each day in the back test
+    @return leverage: DataFrame with the leverage of each scenario
+    @return Commision costs : array of total commision costs per scenario
+    @return Slippage costs : array of total slippage costs per scenario
+    @return Borrow costs : array of total borrow costs per scenario
+    """
+
+    if isinstance(alloc, pand.DataFrame):
+        alloc = [alloc]
+
+    l_params = [f_slippage, f_minimumcommision, f_commision_share,
+                i_target_leverage, f_rate_borrow]
+    i_scenarios = max([len(alloc)] + [np.size(o_param) for o_param in l_params])
+    for i_size in [len(alloc)] + [np.size(o_param) for o_param in l_params]:
+        if i_size not in (1, i_scenarios):
+            raise ValueError("Scenario lists must all have the same length")
+    (na_slippage, na_min_commision, na_commision_share, na_leverage,
+        na_rate_borrow) = [np.ones(i_scenarios) * np.asarray(o_param, dtype=float)
+                           for o_param in l_params]
+
+    #a dollar is always worth a dollar
+    df_historic['_CASH'] = 1.0
+
+    alloc = [_trim_alloc(df_alloc, df_historic) for df_alloc in alloc]
+    for df_alloc in alloc:
+        if not _arrays_fit(df_alloc, df_historic) or \
+                list(df_alloc.index) != list(alloc[0].index):
+            raise ValueError("Allocations must share timestamps and have the "
+                             "price columns with _CASH last")
+
+    # allocations x timestamps x symbols, broadcast against the scenarios
+    na_alloc = np.array([np.asarray(df_alloc.values, dtype=float)
+                         for df_alloc in alloc])
+    na_price = np.asarray(df_historic.values, dtype=float)
+    ldt_dates = df_historic.index
+    na_trade, na_pred = _align_rows(alloc[0], df_historic)
+
+    # Microseconds since the first price, to count days like timedelta does
+    na_usecs = np.array([_usecs(dt_date - ldt_dates[0]) for dt_date in ldt_dates])
+    i_day_usecs = _usecs(timedelta(days=1))
+
+    shares = np.zeros((i_scenarios, na_alloc.shape[2])) + na_alloc[:, 0] * 0.0
+    shares[:, -1] = f_start_cash
+
+    na_total_commision = np.zeros(i_scenarios)
+    na_total_slippage = np.zeros(i_scenarios)
+    na_total_borrow = np.zeros(i_scenarios)
+
+    cashleft = np.zeros(i_scenarios)
+    f_fund = np.ones(i_scenarios) * f_start_cash
+    f_no_trans_fund = f_fund.copy()
+    i_last_fund = na_pred[0]
+
+    li_fund_rows = [i_last_fund]
+    lna_fund = [f_fund.copy()]
+    lna_leverage = [np.zeros(i_scenarios)]
+
+    # Row of the last trade of each scenario, -1 before the first one
+    na_last_trade = -np.ones(i_scenarios, dtype=int)
+    f_last_borrow = np.zeros(i_scenarios)
+
+    for i_row in range(na_alloc.shape[1]):
+
+        i_trade = na_trade[i_row]
+        i_pred = na_pred[i_row]
+        na_trade_price = na_price[i_trade]
+        na_pred_price = na_price[i_pred]
+
+        f_borrow_cost = np.zeros(i_scenarios)
+        if i_row > 0:
+            # value the funds on every day up until this trade
+            if i_pred > i_last_fund:
+                for i_day in range(i_last_fund + 1, i_pred + 1):
+                    values_by_stock = na_price[i_day] * shares
+                    na_fund = _nansum(values_by_stock, axis=1)
+                    li_fund_rows.append(i_day)
+                    lna_fund.append(na_fund)
+                    lna_leverage.append(_exposures(values_by_stock)[:, 0])
+                f_fund = na_fund
+                f_no_trans_fund = na_fund - cashleft
+                i_last_fund = i_pred
+
+            days_since_alloc = (na_usecs[i_trade] - na_usecs[na_last_trade]) // i_day_usecs
+            f_borrow_cost = np.where(na_last_trade >= 0, np.abs(
+                (days_since_alloc*f_last_borrow*na_rate_borrow)/(100*365)), 0.0)
+            na_total_borrow = na_total_borrow + f_borrow_cost
+
+        #Normalizing the allocations and scaling to the leverage
+        proportion = na_alloc[:, i_row]
+        proportion = proportion / _nansum(np.abs(proportion), axis=1)[:, np.newaxis]
+        proportion = proportion*na_leverage[:, np.newaxis]
+
+        # Get shares to be purchased
+        prediction_shares = (proportion*f_fund[:, np.newaxis]) / na_pred_price
+        no_trans_shares = (proportion*f_no_trans_fund[:, np.newaxis]) / na_pred_price
+
+        if b_followleastcount == True:
+            prediction_shares = _least_count(prediction_shares, i_leastcount)
+            no_trans_shares = _least_count(no_trans_shares, i_leastcount)
+
+        cash_delta_less_shares = shares.copy()
+        cash_delta_less_shares[:, -1] = cash_delta_less_shares[:, -1] - cashleft
+        b_trade = ~_same_holding(cash_delta_less_shares, no_trans_shares)
+        if not b_trade.any():
+            continue
+
+        #Orders of every scenario, only the ones in b_trade are executed
+        order = (prediction_shares - shares)[:, :-1]
+
+        na_commision = na_commision_share[:, np.newaxis]*np.abs(order)
+        na_commision = np.where(na_commision > na_min_commision[:, np.newaxis],
+                                na_commision, na_min_commision[:, np.newaxis])
+        f_transaction_cost = np.where(order != 0, na_commision, 0.0).sum(axis=1)
+
+        value_before_trade = _nansum(na_trade_price*shares, axis=1)
+        value_after_trade = _nansum(na_trade_price*prediction_shares, axis=1)
+
+        f_slippage_cost = np.abs(na_slippage[:, np.newaxis]*na_trade_price[:-1]*order)
+        f_slippage_cost[np.isnan(f_slippage_cost)] = 0.0
+        f_slippage_cost = f_slippage_cost.sum(axis=1)
+
+        f_cashleft = value_before_trade - value_after_trade - f_transaction_cost - f_slippage_cost - f_borrow_cost
+
+        f_last_holding = na_trade_price*prediction_shares
+        f_holding_borrow = np.abs(np.where(f_last_holding < 0, f_last_holding, 0.0).sum(axis=1))
+
+        prediction_shares[:, -1] = prediction_shares[:, -1] + f_cashleft
+
+        na_total_commision = na_total_commision + np.where(b_trade, f_transaction_cost, 0.0)
+        na_total_slippage = na_total_slippage + np.where(b_trade, f_slippage_cost, 0.0)
+        cashleft = np.where(b_trade, f_cashleft, cashleft)
+        f_last_borrow = np.where(b_trade, f_holding_borrow, f_last_borrow)
+        na_last_trade = np.where(b_trade, i_trade, na_last_trade)
+        shares = np.where(b_trade[:, np.newaxis], prediction_shares, shares)
+
+    ldt_fund = [ldt_dates[i] for i in li_fund_rows]
+    df_fund = pand.DataFrame(np.array(lna_fund), index=ldt_fund, columns=range(i_scenarios))
+    df_leverage = pand.DataFrame(np.array(lna_leverage), index=ldt_fund, columns=range(i_scenarios))
+
+    return (df_fund, df_leverage, na_total_commision, na_total_slippage, na_total_borrow)
+
+
 def tradesim_comb( df_alloc, d_data, f_start_cash, i_leastcount=1,
                    b_followleastcount=False, f_slippage=0.0,
                    f_minimumcommision=0.0, f_commision_share=0.0,
-                   i_target_leverage=1, f_rate_borrow = 0.0, log="false", b_exposure=False):
+                   i_target_leverage=1, f_rate_borrow = 0.0, log="false", b_exposure=False,
+                   log_format=TransactionLog.CSV):
 
     """
     @summary Same as tradesim, but combines open and close data into one.
@@ -471,7 +930,8 @@ def tradesim_comb( df_alloc, d_data, f_start_cash, i_leastcount=1,
 
     return tradesim(df_alloc, df_combined, f_start_cash, i_leastcount,
                    b_followleastcount, f_slippage, f_minimumcommision,
-                   f_commision_share, i_target_leverage, f_rate_borrow, log, b_exposure)
+                   f_commision_share, i_target_leverage, f_rate_borrow, log, b_exposure,
+                   log_format)
 
 if __name__ == '__main__':
     print "Done"
@@ -0,0 +1,273 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Buffered transaction log for the backtester
+
+'''
+
+# Python imports
+import os
+import datetime as dt
+
+# 3rd Party Imports
+import numpy as np
+import pandas as pand
+
+TXN_TYPES = ['Cash Deposit', 'Buy', 'Sell', 'Sell Short', 'Buy to Cover']
+
+# Columns of the binary format, in the order they are stored
+COLUMNS = ['symbol', 'type', 'date', 'gross_leverage', 'net_leverage', 'shares',
+           'price', 'value', 'holding', 'portfolio_value', 'commission', 'slippage']
+
+_CSV_HEADER = "Symbol,Company Name,Txn Type,Txn Date/Time, Gross Leverage, Net Leverage,# Shares,Price,Txn Value,Portfolio # Shares,Portfolio Value,Commission,Slippage(10BPS),Comments\n"
+_FUND_HEADER = "Symbol,Name,Type,Date,Shares,Price,Cash value,Commission,Notes\n"
+_BINARY_MAGIC = 'qstk-txnlog-1'
+
+_DT_EPOCH = dt.datetime(1970, 1, 1)
+
+
+class TransactionLog(object):
+    '''
+    @summary: Collects transactions into typed column arrays and writes
+    them out a chunk at a time. Symbols and dates are stored once and
+    referred to by number.
+    '''
+    CSV = 'csv'
+    FUND = 'fund'
+    BINARY = 'binary'
+
+    def __init__(self, s_filename, s_format=CSV, i_chunk=65536):
+        '''
+        @param s_filename: File to write the log to
+        @param s_format: CSV for the tradesim layout, FUND for the layout
+                         read by qstktools.csv2fund, BINARY for columns of
+                         numpy arrays, see read_transactions
+        @param i_chunk: Number of transactions buffered between writes
+        '''
+        if s_format not in (self.CSV, self.FUND, self.BINARY):
+            raise ValueError("Unknown transaction log format %s" % s_format)
+
+        self.s_format = s_format
+        self.i_chunk = i_chunk
+        self.ls_symbols = []
+        self.d_symbols = {}
+        self.ldt_dates = []
+        self.ls_dates = []
+        self.i_symbols_written = 0
+        self.i_dates_written = 0
+        self.i_rows = 0
+        self._allocate(i_chunk)
+
+        if s_format == self.BINARY:
+            self.log_file = open(s_filename, 'wb')
+            np.save(self.log_file, np.array([_BINARY_MAGIC] + COLUMNS))
+        else:
+            self.log_file = open(s_filename, 'w')
+            if s_format == self.CSV:
+                self.log_file.write(_CSV_HEADER)
+            else:
+                self.log_file.write(_FUND_HEADER)
+
+    def _allocate(self, i_rows):
+        self.na_symbol = np.zeros(i_rows, dtype=np.int32)
+        self.na_type = np.zeros(i_rows, dtype=np.int8)
+        self.na_date = np.zeros(i_rows, dtype=np.int32)
+        self.na_values = np.zeros((i_rows, len(COLUMNS) - 3))
+
+    def _reserve(self, i_rows):
+        '''
+        @summary: Makes room for i_rows more transactions
+        @return: First free row
+        '''
+        if self.i_rows + i_rows > len(self.na_type):
+            self.flush()
+            if i_rows > len(self.na_type):
+                self._allocate(i_rows)
+        i_start = self.i_rows
+        self.i_rows += i_rows
+        return i_start
+
+    def _date_number(self, dt_date):
+        if len(self.ldt_dates) == 0 or self.ldt_dates[-1] != dt_date:
+            self.ldt_dates.append(dt_date)
+        return len(self.ldt_dates) - 1
+
+    def _symbol_number(self, s_symbol):
+        i_symbol = self.d_symbols.get(s_symbol)
+        if i_symbol is None:
+            i_symbol = len(self.ls_symbols)
+            self.d_symbols[s_symbol] = i_symbol
+            self.ls_symbols.append(s_symbol)
+        return i_symbol
+
+    def deposit(self, dt_date, f_cash):
+        '''
+        @summary: Logs a cash deposit
+        '''
+        i_row = self._reserve(1)
+        self.na_symbol[i_row] = self._symbol_number('_CASH')
+        self.na_type[i_row] = 0
+        self.na_date[i_row] = self._date_number(dt_date)
+        self.na_values[i_row] = np.NAN
+        self.na_values[i_row, 4] = f_cash
+
+    def orders(self, dt_date, ls_symbols, na_shares, na_price, na_holding,
+               f_gross_leverage, f_net_leverage, f_portfolio_value,
+               na_commission, f_slippage):
+        '''
+        @summary: Logs the orders of one trade
+        @param ls_symbols: Symbols traded
+        @param na_shares: Shares bought, negative for sales
+        @param na_price: Execution prices
+        @param na_holding: Shares held after the trade
+        @param f_gross_leverage: Gross leverage after the trade
+        @param f_net_leverage: Net leverage after the trade
+        @param f_portfolio_value: Portfolio value after the trade
+        @param na_commission: Commission of each order
+        @param f_slippage: Slippage cost of the whole trade
+        '''
+        i_rows = len(ls_symbols)
+        if i_rows == 0:
+            return
+        i_start = self._reserve(i_rows)
+        i_end = i_start + i_rows
+
+        na_shares = np.asarray(na_shares, dtype=float)
+        na_holding = np.asarray(na_holding, dtype=float)
+        na_type = np.where(na_holding < 0, 4, 1)
+        na_type[na_shares < 0] = np.where(na_holding[na_shares < 0] < 0, 3, 2)
+
+        self.na_symbol[i_start:i_end] = [self._symbol_number(s_sym) for s_sym in ls_symbols]
+        self.na_type[i_start:i_end] = na_type
+        self.na_date[i_start:i_end] = self._date_number(dt_date)
+        na_values = self.na_values[i_start:i_end]
+        na_values[:, 0] = f_gross_leverage
+        na_values[:, 1] = f_net_leverage
+        na_values[:, 2] = na_shares
+        na_values[:, 3] = na_price
+        na_values[:, 4] = na_values[:, 3] * na_values[:, 2]
+        na_values[:, 5] = na_holding
+        na_values[:, 6] = f_portfolio_value
+        na_values[:, 7] = na_commission
+        na_values[:, 8] = f_slippage
+
+    def flush(self):
+        '''
+        @summary: Writes the buffered transactions
+        '''
+        if self.i_rows == 0:
+            return
+        if self.s_format == self.BINARY:
+            self._write_binary()
+        else:
+            self._write_text()
+        self.i_rows = 0
+        self.i_symbols_written = len(self.ls_symbols)
+        self.i_dates_written = len(self.ldt_dates)
+
+    def _write_text(self):
+        ls_dates = self.ls_dates
+        ls_dates.extend([str(dt_date) for dt_date in self.ldt_dates[len(ls_dates):]])
+
+        na_symbol = self.na_symbol[:self.i_rows]
+        na_type = self.na_type[:self.i_rows]
+        na_values = self.na_values[:self.i_rows]
+        ls_sym = np.array(self.ls_symbols, dtype=object)[na_symbol].tolist()
+        ls_type = np.array(TXN_TYPES, dtype=object)[na_type].tolist()
+        ls_date = np.array(ls_dates, dtype=object)[self.na_date[:self.i_rows]].tolist()
+
+        if self.s_format == self.CSV:
+            ls_slippage = [str(round(f_val, 2)) for f_val in na_values[:, 8]]
+            ls_lines = [",".join(t_row) for t_row in zip(ls_sym, ls_sym, ls_type, ls_date,
+                        *([_strings(na_values[:, i]) for i in range(8)] + [ls_slippage]))]
+            s_deposit = "_CASH,_CASH,Cash Deposit,%s,,,,,%s,"
+        else:
+            ls_lines = [",".join(t_row) for t_row in zip(ls_sym, ls_sym, ls_type, ls_date,
+                        _strings(np.abs(na_values[:, 2])), _strings(na_values[:, 3]),
+                        _strings(np.abs(na_values[:, 4])), _strings(na_values[:, 7]))]
+            s_deposit = ",Deposit Cash,Deposit Cash,%s,,,%s,"
+
+        for i in np.where(na_type == 0)[0]:
+            ls_lines[i] = s_deposit % (ls_date[i], str(na_values[i, 4]))
+        ls_lines.append("")
+        self.log_file.write(",\n".join(ls_lines))
+
+    def _write_binary(self):
+        # New symbols and dates first, then one array per column
+        np.save(self.log_file, np.array(self.ls_symbols[self.i_symbols_written:], dtype='S'))
+        np.save(self.log_file, np.array([_usecs(dt_date - _DT_EPOCH)
+                     for dt_date in self.ldt_dates[self.i_dates_written:]], dtype=np.int64))
+        np.save(self.log_file, self.na_symbol[:self.i_rows])
+        np.save(self.log_file, self.na_type[:self.i_rows])
+        np.save(self.log_file, self.na_date[:self.i_rows])
+        np.save(self.log_file, self.na_values[:self.i_rows])
+
+    def close(self):
+        '''
+        @summary: Writes the remaining transactions and closes the file
+        '''
+        self.flush()
+        self.log_file.close()
+
+
+def read_transactions(s_filename):
+    '''
+    @summary: Reads a log written by TransactionLog in the BINARY format
+    @param s_filename: Log file
+    @return: DataFrame with one row per transaction and the columns in
+             COLUMNS, symbol, type and date hold strings and datetimes
+    '''
+    log_file = open(s_filename, 'rb')
+    try:
+        i_size = os.fstat(log_file.fileno()).st_size
+        ls_header = list(np.load(log_file))
+        if ls_header != [_BINARY_MAGIC] + COLUMNS:
+            raise ValueError("%s is not a binary transaction log" % s_filename)
+
+        ls_symbols = []
+        ldt_dates = []
+        lna_chunks = []
+        while log_file.tell() < i_size:
+            ls_symbols.extend(np.load(log_file))
+            ldt_dates.extend([_DT_EPOCH + dt.timedelta(microseconds=int(i_usecs))
+                              for i_usecs in np.load(log_file)])
+            lna_chunks.append([np.load(log_file) for i in range(4)])
+    finally:
+        log_file.close()
+
+    na_symbol, na_type, na_date, na_values = \
+        [np.concatenate([l_chunk[i] for l_chunk in lna_chunks])
+         if lna_chunks else na_empty
+         for i, na_empty in enumerate([np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                                       np.zeros(0, dtype=int), np.zeros((0, len(COLUMNS) - 3))])]
+
+    d_data = {'symbol': np.array(ls_symbols, dtype=object)[na_symbol],
+              'type': np.array(TXN_TYPES, dtype=object)[na_type],
+              'date': np.array(ldt_dates + [None], dtype=object)[na_date]}
+    for i, s_col in enumerate(COLUMNS[3:]):
+        d_data[s_col] = na_values[:, i]
+    return pand.DataFrame(d_data, columns=COLUMNS)
+
+
+def _strings(na_values):
+    '''
+    @summary: str() of every value, runs of the same value are formatted once
+    @return: list of strings
+    '''
+    if len(na_values) == 0:
+        return []
+    na_start = np.ones(len(na_values), dtype=bool)
+    na_start[1:] = (na_values[1:] != na_values[:-1]) | \
+                   (np.signbit(na_values[1:]) != np.signbit(na_values[:-1]))
+    ls_first = np.array([str(f_val) for f_val in na_values[na_start]], dtype=object)
+    return ls_first[np.cumsum(na_start) - 1].tolist()
+
+
+def _usecs(td_delta):
+    '''
+    @summary: Length of a timedelta in microseconds
+    '''
+    return (td_delta.days * 86400 + td_delta.seconds) * 10**6 + td_delta.microseconds
@@ -0,0 +1,99 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Converts a directory of Yahoo csv files into the columnar store
+          read by DataAccess.DataSource.COLUMNAR
+
+'''
+
+# Python imports
+import os
+import sys
+import shutil
+import datetime as dt
+
+# 3rd Party Imports
+import numpy as np
+
+# QSTK imports
+from QSTK.qstkutil import DataAccess as da
+from QSTK.qstkutil import qsdateutil as du
+
+
+def csv2columnar(s_csv_path, s_out_path, ls_symbols=None):
+    """
+    @summary Writes one dates x symbols float64 file per data item, a symbol
+             index and a date index covering every NYSE day in the data.
+    @param s_csv_path: Directory holding <symbol>.csv files
+    @param s_out_path: Directory for the store, usually QSDATA/Columnar
+    @param ls_symbols: Symbols to convert, defaults to every csv file
+    @return: Number of symbols written
+    """
+    if ls_symbols is None:
+        ls_symbols = sorted([s_file[:-4] for s_file in os.listdir(s_csv_path)
+                             if s_file.endswith('.csv')])
+
+    if not os.path.exists(s_out_path):
+        os.makedirs(s_out_path)
+
+    d_data = {}
+    for s_sym in ls_symbols:
+        f_csv = open(os.path.join(s_csv_path, s_sym + '.csv'), 'rb')
+        d_data[s_sym] = da._read_csv_data(f_csv)
+        f_csv.close()
+
+    # NYSE calendar over the span of the data, plus any odd day in a file
+    na_file_dates = np.concatenate([na_data[:, 0] for na_data in d_data.values()])
+    dt_first = dt.datetime.strptime(str(int(na_file_dates.min())), '%Y%m%d')
+    dt_last = dt.datetime.strptime(str(int(na_file_dates.max())), '%Y%m%d')
+    ldt_timestamps = du.getNYSEdays(dt_first, dt_last + dt.timedelta(days=1),
+                                    dt.timedelta(hours=16))
+    na_dates = np.union1d(da._ts_day_keys(ldt_timestamps),
+                          na_file_dates.astype(np.int64))
+
+    for i, s_item in enumerate(da.COLUMNAR_ITEMS):
+        na_store = np.memmap(os.path.join(s_out_path, s_item + '.dat'),
+                             dtype=np.float64, mode='w+',
+                             shape=(len(na_dates), len(ls_symbols)))
+        na_store[:] = np.NAN
+        for j, s_sym in enumerate(ls_symbols):
+            na_rows, na_file_rows = da._align_day_keys(na_dates, d_data[s_sym][:, 0])
+            na_store[na_rows, j] = d_data[s_sym][na_file_rows, i + 1]
+        na_store.flush()
+        del na_store
+
+    np.save(os.path.join(s_out_path, da.COLUMNAR_DATES), na_dates)
+
+    f_symbols = open(os.path.join(s_out_path, da.COLUMNAR_SYMBOLS), 'w')
+    for s_sym in ls_symbols:
+        f_symbols.write(s_sym + '\n')
+    f_symbols.close()
+
+    # Keep symbol lists working with get_symbols_from_list
+    s_lists = os.path.join(s_csv_path, 'Lists')
+    if os.path.isdir(s_lists):
+        s_out_lists = os.path.join(s_out_path, 'Lists')
+        if os.path.isdir(s_out_lists):
+            shutil.rmtree(s_out_lists)
+        shutil.copytree(s_lists, s_out_lists)
+
+    return len(ls_symbols)
+
+
+def main():
+    s_root = os.path.join(os.path.dirname(da.__file__), '..', 'QSData')
+    s_csv_path = os.path.join(s_root, 'Yahoo')
+    s_out_path = os.path.join(s_root, 'Columnar')
+    if len(sys.argv) > 1:
+        s_csv_path = sys.argv[1]
+    if len(sys.argv) > 2:
+        s_out_path = sys.argv[2]
+
+    i_count = csv2columnar(s_csv_path, s_out_path)
+    print "Wrote {0} symbols to {1}".format(i_count, s_out_path)
+
+if __name__ == '__main__':
+    main()
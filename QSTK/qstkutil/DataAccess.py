@@ -22,6 +22,10 @@ import time
 import datetime as dt
 import dircache
 import tempfile
+import ctypes
+import multiprocessing as mp
+
+from QSTK.qstkutil import utils
 
 
 class Exchange (object):
@@ -53,27 +57,266 @@ class DataSource(object):
     COMPUSTAT = "Compustat"
     CUSTOM = "Custom"
     MLT = "ML4Trading"
+    COLUMNAR = "Columnar"
     #class DataSource ends
 
 
+# Data items kept by the columnar store, in the same order as the columns of
+# a Yahoo CSV file (after the date). Each one is a dates x symbols float64
+# array in <item>.dat, memory mapped on read.
+COLUMNAR_ITEMS = [DataItem.OPEN, DataItem.HIGH, DataItem.LOW,
+                  DataItem.ACTUAL_CLOSE, DataItem.VOL, DataItem.CLOSE]
+COLUMNAR_SYMBOLS = "symbols.txt"
+COLUMNAR_DATES = "dates.npy"
+
+
+def _parse_csv_date(s_date):
+    '''
+    @summary: Converts a single CSV date cell to a YYYYMMDD float.
+    @param s_date: Date string in '%Y-%m-%d' or '%m/%d/%y' format.
+    @return: Float of the form YYYYMMDD.
+    '''
+    try:
+        date = dt.datetime.strptime(s_date, '%Y-%m-%d')
+    except:
+        date = dt.datetime.strptime(s_date, '%m/%d/%y')
+    return float(date.strftime('%Y%m%d'))
+
+
+def _parse_csv_dates(na_dates):
+    '''
+    @summary: Vectorized conversion of a column of CSV date cells to YYYYMMDD floats.
+    @param na_dates: Numpy string array of dates.
+    @return: Numpy float array of the form YYYYMMDD.
+    @note: Zero padded '%Y-%m-%d' cells are converted in bulk, anything else
+    falls back to strptime one cell at a time.
+    '''
+    na_ret = np.zeros(len(na_dates))
+    if len(na_dates) == 0:
+        return na_ret
+
+    na_dash = np.char.find(na_dates, '-', 4, 5) == 4
+    na_dash &= np.char.find(na_dates, '-', 7, 8) == 7
+    na_iso = (np.char.str_len(na_dates) == 10) & na_dash
+
+    if na_iso.any():
+        try:
+            na_ret[na_iso] = np.char.replace(na_dates[na_iso], '-', '').astype(float)
+        except ValueError:
+            # Mangled cell somewhere, let strptime handle (and report) it
+            na_iso[:] = False
+
+    for i in np.nonzero(~na_iso)[0]:
+        na_ret[i] = _parse_csv_date(na_dates[i])
+
+    return na_ret
+
+
+def _is_iso_date(s_date):
+    ''' True for zero padded '%Y-%m-%d' strings '''
+    return len(s_date) == 10 and s_date[4] == '-' and s_date[7] == '-'
+
+
+def _read_csv_data(_file, i_first_day=None):
+    '''
+    @summary: Reads a Yahoo style CSV file into a float array in one pass.
+    @param _file: Open file object, the first line is a header.
+    @param i_first_day: Optional YYYYMMDD int. Files listed newest first
+    are only read down to the first row before this day.
+    @return: Numpy array with one row per day, oldest day first. The first
+    column is the date as a YYYYMMDD float, the rest are the file's columns.
+    '''
+    creader = csv.reader(_file)
+    creader.next()
+    if i_first_day is None:
+        ls_rows = [row for row in creader if len(row) > 0]
+    else:
+        # Zero padded ISO dates compare correctly as strings
+        s_first = '%04d-%02d-%02d' % (i_first_day / 10000,
+                                      i_first_day / 100 % 100, i_first_day % 100)
+        ls_rows = []
+        for row in creader:
+            if len(row) == 0:
+                continue
+            ls_rows.append(row)
+            if row[0] < s_first and len(ls_rows) > 1 \
+                    and _is_iso_date(row[0]) and _is_iso_date(ls_rows[0][0]) \
+                    and ls_rows[1][0] < ls_rows[0][0]:
+                break
+    na_raw = np.array(ls_rows)
+
+    naData = np.zeros(na_raw.shape)
+    naData[:, 0] = _parse_csv_dates(na_raw[:, 0])
+    naData[:, 1:] = na_raw[:, 1:].astype(float)
+
+    # Yahoo files are newest first
+    return naData[::-1]
+
+
+def _ts_day_keys(ts_list):
+    '''
+    @summary: Converts timestamps to YYYYMMDD integer day keys.
+    @param ts_list: List of timestamps.
+    @return: Numpy int array, -1 for timestamps that are not at 16:00 since
+    data files only hold values at the close.
+    '''
+    na_keys = np.zeros(len(ts_list), dtype=np.int64)
+    for i, time_stamp in enumerate(ts_list):
+        if (time_stamp.hour, time_stamp.minute, time_stamp.second,
+            time_stamp.microsecond) == (16, 0, 0, 0):
+            na_keys[i] = time_stamp.year * 10000 + time_stamp.month * 100 \
+                         + time_stamp.day
+        else:
+            na_keys[i] = -1
+    return na_keys
+
+
+def _align_day_keys(na_ts_keys, na_file_dates):
+    '''
+    @summary: Finds the rows of a data file that line up with ts_list.
+    @param na_ts_keys: Day keys of ts_list, from _ts_day_keys.
+    @param na_file_dates: First column of a data file, YYYYMMDD floats.
+    @return: Tuple of (ts_list rows, file rows) such that
+    data[ts_list rows] = file[file rows] fills every matching day.
+    @note: If a day is repeated in the file the first row is used.
+    '''
+    if len(na_file_dates) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    na_file_keys = np.floor(na_file_dates).astype(np.int64)
+    na_order = None
+    if np.any(na_file_keys[1:] < na_file_keys[:-1]):
+        na_order = np.argsort(na_file_keys, kind='mergesort')
+        na_file_keys = na_file_keys[na_order]
+
+    na_pos = np.searchsorted(na_file_keys, na_ts_keys)
+    na_pos[na_pos == len(na_file_keys)] = 0
+    na_match = (na_ts_keys >= 0) & (na_file_keys[na_pos] == na_ts_keys)
+
+    na_file_rows = na_pos[na_match]
+    if na_order is not None:
+        na_file_rows = na_order[na_file_rows]
+    return np.nonzero(na_match)[0], na_file_rows
+
+
+def _cached_frames(ldf_data, symbol_list, bStr):
+    '''
+    @summary: Copies of cached DataFrames, in the form get_data returns them.
+    '''
+    ldf_ret = utils.copy_frames(ldf_data, symbol_list)
+    if bStr:
+        return ldf_ret[0]
+    return ldf_ret
+
+
+def _covers(d_entry, d_meta):
+    '''
+    @summary: Checks if a cached result holds everything a request needs.
+    @param d_entry: Description of the cached result, see DataAccess.get_data.
+    @param d_meta: Description of the request.
+    @return: True if every data item, symbol and timestamp of the request is
+    cached, and the symbols' source files have not changed since.
+    '''
+    for s_field in ('source', 'rootdir', 'bIncDelist'):
+        if d_entry[s_field] != d_meta[s_field]:
+            return False
+
+    for sItem in d_meta['items']:
+        if sItem not in d_entry['items']:
+            return False
+
+    for symbol, f_mtime in d_meta['mtimes'].items():
+        if symbol not in d_entry['mtimes'] or d_entry['mtimes'][symbol] != f_mtime:
+            return False
+
+    ts_entry = d_entry['ts']
+    ts_list = d_meta['ts']
+    if len(ts_list) == 0:
+        return True
+    if len(ts_entry) == 0 or ts_list[0] < ts_entry[0] or ts_list[-1] > ts_entry[-1]:
+        return False
+    set_entry = set(ts_entry)
+    for time_stamp in ts_list:
+        if time_stamp not in set_entry:
+            return False
+    return True
+
+
+def _slice_frames(ldf_data, d_entry, ts_list, symbol_list, ls_items):
+    '''
+    @summary: Cuts a request out of a cached result that covers it.
+    @return: List of DataFrames, one per item in ls_items.
+    '''
+    if len(ls_items) == 0:
+        return []
+
+    d_rows = {}
+    for i, time_stamp in enumerate(d_entry['ts']):
+        d_rows.setdefault(time_stamp, i)
+    li_rows = [d_rows[time_stamp] for time_stamp in ts_list]
+
+    d_cols = {}
+    for i, symbol in enumerate(ldf_data[0].columns):
+        d_cols.setdefault(symbol, i)
+    li_cols = [d_cols[symbol] for symbol in symbol_list]
+
+    ldf_ret = []
+    for sItem in ls_items:
+        df_data = ldf_data[d_entry['items'].index(sItem)]
+        ldf_ret.append(pa.DataFrame(df_data.values[np.ix_(li_rows, li_cols)],
+                                    ts_list, symbol_list))
+    return ldf_ret
+
+
+# State of a get_data_hardread worker process, set once by the pool initializer
+_d_hardread = {}
+
+
+def _init_hardread_worker(c_data, raw_data, t_shape, *l_args):
+    '''
+    @summary: Pool initializer, maps the shared output arrays in the worker.
+    '''
+    _d_hardread['obj'] = c_data
+    _d_hardread['data'] = list(np.frombuffer(raw_data).reshape(t_shape))
+    _d_hardread['args'] = l_args
+
+
+def _hardread_worker(t_block):
+    '''
+    @summary: Reads the symbols in the column block t_block = (start, end).
+    '''
+    symbol_list, list_index, na_ts_keys, i_first_day, verbose, bIncDelist = _d_hardread['args']
+    _d_hardread['obj']._read_symbols(symbol_list, t_block[0], t_block[1],
+        list_index, na_ts_keys, i_first_day, _d_hardread['data'], verbose, bIncDelist)
+
+
 class DataAccess(object):
     '''
     @summary: This class is used to access all the symbol data. It readin in pickled numpy arrays converts them into appropriate pandas objects
     and returns that object. The {main} function currently demonstrates use.
     @note: The earliest time for which this works is platform dependent because the python date functionality is platform dependent.
     '''
+
+    # In memory cache in front of the scratch directory, shared by every
+    # DataAccess object in the process. Resize with memcache.i_max_bytes.
+    memcache = utils.LRUCache()
+    # Descriptions of cached results by key, see get_data
+    cacheindex = {}
     def __init__(self, sourcein=DataSource.YAHOO, s_datapath=None,
                  s_scratchpath=None, cachestalltime=12):
         '''
         @param sourcestr: Specifies the source of the data. Initializes paths based on source.
         @note: No data is actually read in the constructor. Only paths for the source are initialized
         @param: Scratch defaults to a directory in /tmp/QSScratch
+        @param cachestalltime: Hours a cached result is used as is. Older results are refreshed by
+        re-reading only the symbols whose files changed, from their last cached day on.
         '''
 
         self.folderList = list()
         self.folderSubList = list()
         self.cachestalltime = cachestalltime
         self.fileExtensionToRemove = ".pkl"
+        self.columnar = None
 
         try:
             self.rootdir = os.environ['QSDATA']
@@ -131,6 +374,10 @@ class DataAccess(object):
             self.folderList.append(self.rootdir + "/Yahoo/")
             self.fileExtensionToRemove = ".csv"
 
+        elif (sourcein == DataSource.COLUMNAR):
+            self.source = DataSource.COLUMNAR
+            self.folderList.append(self.rootdir + "/Columnar/")
+
         elif (sourcein == DataSource.COMPUSTAT):
             self.source = DataSource.COMPUSTAT
             self.midPath = "/Processed/Compustat"
@@ -148,13 +395,14 @@ class DataAccess(object):
 
         #__init__ ends
 
-    def get_data_hardread(self, ts_list, symbol_list, data_item, verbose=False, bIncDelist=False):
+    def get_data_hardread(self, ts_list, symbol_list, data_item, verbose=False, bIncDelist=False, n_workers=1):
         '''
         Read data into a DataFrame no matter what.
         @param ts_list: List of timestamps for which the data values are needed. Timestamps must be sorted.
         @param symbol_list: The list of symbols for which the data values are needed
         @param data_item: The data_item needed. Like open, close, volume etc.  May be a list, in which case a list of DataFrame is returned.
         @param bIncDelist: If true, delisted securities will be included.
+        @param n_workers: Number of processes reading symbol files, more than one only pays off for large universes.
         @note: If a symbol is not found then a message is printed. All the values in the column for that stock will be NaN. Execution then
         continues as usual. No errors are raised at the moment.
         '''
@@ -165,13 +413,12 @@ class DataAccess(object):
             data_item = [data_item]
             bStr = True
 
-        # init data struct - list of arrays, each member is an array corresponding do a different data type
-        # arrays contain n rows for the timestamps and m columns for each stock
-        all_stocks_data = []
-        for i in range( len(data_item) ):
-            all_stocks_data.append( np.zeros ((len(ts_list), len(symbol_list))) );
-            all_stocks_data[i][:][:] = np.NAN
-        
+        if self.source == DataSource.COLUMNAR:
+            ldmReturn = self._get_columnar_data(ts_list, symbol_list, data_item)
+            if bStr:
+                return ldmReturn[0]
+            return ldmReturn
+
         list_index= []
         
         ''' For each item in the list, add to list_index (later used to delete non-used items) '''
@@ -228,11 +475,55 @@ class DataAccess(object):
                 #end elif
         #end data_item loop
 
+        # Day keys of ts_list, these are shared by every symbol. Older rows
+        # in the files are never used.
+        na_ts_keys = _ts_day_keys(ts_list)
+        i_first_day = None
+        if np.any(na_ts_keys >= 0):
+            i_first_day = int(na_ts_keys[na_ts_keys >= 0].min())
+
+        if n_workers > 1 and len(symbol_list) > 1:
+            all_stocks_data = self._read_symbols_parallel(symbol_list,
+                list_index, na_ts_keys, i_first_day, verbose, bIncDelist, n_workers)
+        else:
+            # init data struct - list of arrays, each member is an array corresponding do a different data type
+            # arrays contain n rows for the timestamps and m columns for each stock
+            all_stocks_data = []
+            for i in range( len(data_item) ):
+                all_stocks_data.append( np.zeros ((len(ts_list), len(symbol_list))) );
+                all_stocks_data[i][:][:] = np.NAN
+            self._read_symbols(symbol_list, 0, len(symbol_list), list_index,
+                na_ts_keys, i_first_day, all_stocks_data, verbose, bIncDelist)
+
+        #print all_stocks_data
+        
+        ldmReturn = [] # List of data matrixes to return
+        for naDataLabel in all_stocks_data:
+            ldmReturn.append( pa.DataFrame( naDataLabel, ts_list, symbol_list) )            
+
+        
+        ''' Contine to support single return type as a non-list '''
+        if bStr:
+            return ldmReturn[0]
+        else:
+            return ldmReturn            
+        
+        #get_data_hardread ends
+
+    def _read_symbols(self, symbol_list, i_start, i_end, list_index, na_ts_keys,
+                      i_first_day, all_stocks_data, verbose=False, bIncDelist=False):
+        '''
+        @summary: Reads the files of symbol_list[i_start:i_end] into those columns
+        of all_stocks_data, see get_data_hardread.
+        @param list_index: Column of each data item in the files.
+        @param na_ts_keys: Day keys of ts_list, from _ts_day_keys.
+        @param i_first_day: First valid day key, older rows are not read.
+        @param all_stocks_data: List of timestamps x symbols arrays, one per data item.
+        '''
         #read in data for a stock
-        symbol_ctr=-1
-        for symbol in symbol_list:
+        for symbol_ctr in range(i_start, i_end):
+            symbol = symbol_list[symbol_ctr]
             _file = None
-            symbol_ctr = symbol_ctr + 1
             #print self.getPathOfFile(symbol)
             try:
                 if (self.source == DataSource.CUSTOM) or (self.source == DataSource.MLT)or (self.source == DataSource.YAHOO):
@@ -262,37 +553,7 @@ class DataAccess(object):
             ''' Open the file only if we have a valid name, otherwise we need delisted data '''
             if _file != None:
                 if (self.source==DataSource.CUSTOM) or (self.source==DataSource.YAHOO)or (self.source==DataSource.MLT):
-                    creader = csv.reader(_file)
-                    row=creader.next()
-                    row=creader.next()
-                    #row.pop(0)
-                    for i, item in enumerate(row):
-                        if i==0:
-                            try:
-                                date = dt.datetime.strptime(item, '%Y-%m-%d')
-                                date = date.strftime('%Y%m%d')
-                                row[i] = float(date)
-                            except:
-                                date = dt.datetime.strptime(item, '%m/%d/%y')
-                                date = date.strftime('%Y%m%d')
-                                row[i] = float(date)
-                        else:
-                            row[i]=float(item)
-                    naData=np.array(row)
-                    for row in creader:
-                        for i, item in enumerate(row):
-                            if i==0:
-                                try:
-                                    date = dt.datetime.strptime(item, '%Y-%m-%d')
-                                    date = date.strftime('%Y%m%d')
-                                    row[i] = float(date)
-                                except:
-                                    date = dt.datetime.strptime(item, '%m/%d/%y')
-                                    date = date.strftime('%Y%m%d')
-                                    row[i] = float(date)
-                            else: 
-                                row[i]=float(item)
-                        naData=np.vstack([np.array(row),naData])
+                    naData = _read_csv_data(_file, i_first_day)
                 else:
                     naData = pkl.load (_file)
                 _file.close()
@@ -322,199 +583,367 @@ class DataAccess(object):
                 
             #print naData
             #print list_index
-            ''' We open the file once, for each data item we need, fill out the array in all_stocks_data '''
+            ''' Map the file's days onto rows of ts_list once, then fill every data item we need '''
+            na_ts_rows, na_file_rows = _align_day_keys(na_ts_keys, naData[:, 0])
             for lLabelNum, lLabelIndex in enumerate(list_index):
-                
-                ts_ctr = 0
-                b_skip = True
-                
-                ''' select timestamps and the data column we want '''
-                temp_np = naData[:,(0,lLabelIndex)]
-                
-                #print temp_np
-                
-                num_rows= temp_np.shape[0]
+                all_stocks_data[lLabelNum][na_ts_rows, symbol_ctr] = naData[na_file_rows, lLabelIndex]
+            #outer for ends
+        #_read_symbols ends
 
-                
-                symbol_ts_list = range(num_rows) # preallocate
-                for i in range (0, num_rows):
+    def _read_symbols_parallel(self, symbol_list, list_index, na_ts_keys,
+                               i_first_day, verbose, bIncDelist, n_workers):
+        '''
+        @summary: Reads symbols on a pool of processes, see _read_symbols.
+        Every process writes its own column blocks straight into arrays in
+        shared memory, so nothing is copied back.
+        @return: List of timestamps x symbols arrays, one per data item.
+        '''
+        t_shape = (len(list_index), len(na_ts_keys), len(symbol_list))
+        raw_data = mp.RawArray(ctypes.c_double, int(np.prod(t_shape)))
+        na_all = np.frombuffer(raw_data).reshape(t_shape)
+        na_all[:] = np.NAN
+
+        # A few blocks per worker so a slow file does not hold up the rest
+        n_workers = min(n_workers, len(symbol_list))
+        i_blocks = min(len(symbol_list), 4 * n_workers)
+        li_bounds = np.linspace(0, len(symbol_list), i_blocks + 1).astype(int)
+
+        pool = mp.Pool(n_workers, _init_hardread_worker, (self, raw_data, t_shape,
+                       symbol_list, list_index, na_ts_keys, i_first_day, verbose, bIncDelist))
+        try:
+            pool.map(_hardread_worker, zip(li_bounds[:-1], li_bounds[1:]))
+        finally:
+            pool.close()
+            pool.join()
 
-                    timebase = temp_np[i][0]
-                    timeyear = int(timebase/10000)
-                    
-                    # Quick hack to skip most of the data
-                    # Note if we skip ALL the data, we still need to calculate
-                    # last time, so we know nothing is valid later in the code
-                    if timeyear < ts_list[0].year and i != num_rows - 1:
-                        continue
-                    elif b_skip == True:
-                        ts_ctr = i
-                        b_skip = False
-                    
-                    
-                    timemonth = int((timebase-timeyear*10000)/100)
-                    timeday = int((timebase-timeyear*10000-timemonth*100))
-                    timehour = 16
-    
-                    #The earliest time it can generate a time for is platform dependent
-                    symbol_ts_list[i]=dt.datetime(timeyear,timemonth,timeday,timehour) # To make the time 1600 hrs on the day previous to this midnight
-                    
-                #for ends
-    
-    
-                #now we have only timestamps and one data column
-                
-                
-                #Skip data from file which is before the first timestamp in ts_list
-    
-                while (ts_ctr < temp_np.shape[0]) and (symbol_ts_list[ts_ctr] < ts_list[0]):
-                    ts_ctr=  ts_ctr+1
-                    
-                    #print "skipping initial data"
-                    #while ends
-                
-                for time_stamp in ts_list:
-                    
-                    if (symbol_ts_list[-1] < time_stamp):
-                        #The timestamp is after the last timestamp for which we have data. So we give up. Note that we don't have to fill in NaNs because that is 
-                        #the default value.
-                        break;
-                    else:
-                        while ((ts_ctr < temp_np.shape[0]) and (symbol_ts_list[ts_ctr]< time_stamp)):
-                            ts_ctr = ts_ctr+1
-                            #while ends
-                        #else ends
-                                            
-                    #print "at time_stamp: " + str(time_stamp) + " and symbol_ts "  + str(symbol_ts_list[ts_ctr])
-                    
-                    if (time_stamp == symbol_ts_list[ts_ctr]):
-                        #Data is present for this timestamp. So add to numpy array.
-                        #print "    adding to numpy array"
-                        if (temp_np.ndim > 1): #This if is needed because if a stock has data for 1 day only then the numpy array is 1-D rather than 2-D
-                            all_stocks_data[lLabelNum][ts_list.index(time_stamp)][symbol_ctr] = temp_np [ts_ctr][1]
-                        else:
-                            all_stocks_data[lLabelNum][ts_list.index(time_stamp)][symbol_ctr] = temp_np [1]
-                        #if ends
-                        
-                        ts_ctr = ts_ctr +1
-                    
-                #inner for ends
-            #outer for ends
-        #print all_stocks_data
-        
-        ldmReturn = [] # List of data matrixes to return
-        for naDataLabel in all_stocks_data:
-            ldmReturn.append( pa.DataFrame( naDataLabel, ts_list, symbol_list) )            
+        return list(na_all)
 
-        
-        ''' Contine to support single return type as a non-list '''
-        if bStr:
-            return ldmReturn[0]
-        else:
-            return ldmReturn            
-        
-        #get_data_hardread ends
+    def _open_columnar(self):
+        '''
+        @summary: Memory maps the columnar store, only done once per object.
+        @return: Dictionary with the symbol index, the date keys and one
+        read only dates x symbols memmap per data item.
+        '''
+        if self.columnar is not None:
+            return self.columnar
+
+        s_path = self.folderList[0]
+        ffile = open(os.path.join(s_path, COLUMNAR_SYMBOLS), 'r')
+        ls_symbols = [s_line.strip() for s_line in ffile if s_line.strip()]
+        ffile.close()
+        na_dates = np.load(os.path.join(s_path, COLUMNAR_DATES))
+
+        self.columnar = {'symbols': ls_symbols,
+                         'symbol_index': dict((s_sym, i) for i, s_sym in enumerate(ls_symbols)),
+                         'dates': na_dates}
+        for s_item in COLUMNAR_ITEMS:
+            self.columnar[s_item] = np.memmap(os.path.join(s_path, s_item + '.dat'),
+                    dtype=np.float64, mode='r', shape=(len(na_dates), len(ls_symbols)))
+        return self.columnar
+
+    def _get_columnar_data(self, ts_list, symbol_list, data_item):
+        '''
+        @summary: Reads data items from the columnar store, see get_data_hardread.
+        @note: Only the window of rows covering ts_list is touched, values are
+        copied out of the memmap once, into the returned DataFrames.
+        '''
+        d_store = self._open_columnar()
+
+        for sItem in data_item:
+            if sItem not in COLUMNAR_ITEMS:
+                raise ValueError ("Incorrect value for data_item %s"%sItem)
+
+        li_cols = []
+        li_found = []
+        for i, symbol in enumerate(symbol_list):
+            if symbol in d_store['symbol_index']:
+                li_cols.append(d_store['symbol_index'][symbol])
+                li_found.append(i)
+            else:
+                print "Did not find " + str(symbol) + " in the columnar store"
+
+        na_ts_rows, na_store_rows = _align_day_keys(_ts_day_keys(ts_list),
+                                                    d_store['dates'])
 
-    def get_data (self, ts_list, symbol_list, data_item, verbose=False, bIncDelist=False):
+        ldmReturn = []
+        for sItem in data_item:
+            naData = np.zeros((len(ts_list), len(symbol_list)))
+            naData[:] = np.NAN
+            if len(na_store_rows) > 0 and len(li_cols) > 0:
+                i_first = na_store_rows[0]
+                na_window = d_store[sItem][i_first:na_store_rows[-1] + 1]
+                naData[np.ix_(na_ts_rows, li_found)] = \
+                        na_window[np.ix_(na_store_rows - i_first, li_cols)]
+            ldmReturn.append(pa.DataFrame(naData, ts_list, symbol_list))
+        return ldmReturn
+
+    def get_data (self, ts_list, symbol_list, data_item, verbose=False, bIncDelist=False, n_workers=1):
         '''
         Read data into a DataFrame, but check to see if it is in a cache first.
         @param ts_list: List of timestamps for which the data values are needed. Timestamps must be sorted.
         @param symbol_list: The list of symbols for which the data values are needed
         @param data_item: The data_item needed. Like open, close, volume etc.  May be a list, in which case a list of DataFrame is returned.
         @param bIncDelist: If true, delisted securities will be included.
+        @param n_workers: Number of processes reading symbol files on a cache miss, see get_data_hardread.
         @note: If a symbol is not found then a message is printed. All the values in the column for that stock will be NaN. Execution then 
         continues as usual. No errors are raised at the moment.
         '''
 
+        # The columnar store is memory mapped, reading it is cheaper than
+        # unpickling a scratch file
+        if self.source == DataSource.COLUMNAR:
+            return self.get_data_hardread(ts_list, symbol_list, data_item,
+                                          verbose, bIncDelist)
+
         # Construct hash -- filename where data may be already
         #
         # The idea here is to create a filename from the arguments provided.
         # We then check to see if the filename exists already, meaning that
         # the data has already been created and we can just read that file.
-
-        # Create the hash for the symbols
-        hashsyms = 0
-        for i in symbol_list:
-            hashsyms = (hashsyms + hash(i)) % 10000000
-
-        # Create the hash for the timestamps
-        hashts = 0
-
-        # print "test point 1: " + str(len(ts_list))
-        # spyfile=os.environ['QSDATA'] + '/Processed/Norgate/Stocks/US/NYSE Arca/SPY.pkl'
-        for i in ts_list:
-            hashts = (hashts + hash(i)) % 10000000
-        hashstr = 'qstk-' + str (self.source)+'-' +str(abs(hashsyms)) + '-' + str(abs(hashts)) \
-            + '-' + str(hash(str(data_item))) #  + '-' + str(hash(str(os.path.getctime(spyfile))))
-
-        # get the directory for scratch files from environment
-        # try:
-        #     scratchdir = os.environ['QSSCRATCH']
-        # except KeyError:
-        #     #self.rootdir = "/hzr71/research/QSData"
-        #     raise KeyError("Please be sure to set the value for QSSCRATCH in config.sh or local.sh")
+        # The key is a digest, so it is the same for any symbol order and in
+        # every interpreter run, and it changes whenever a source file does.
+        bStr = isinstance(data_item, str)
+        if bStr:
+            ls_items = [data_item]
+        else:
+            ls_items = list(data_item)
+        ls_sorted = sorted(symbol_list)
+        lf_mtimes = self._source_mtimes(ls_sorted)
+        hashstr = utils.cache_key('qstk-' + str(self.source), self.rootdir,
+                                  ls_sorted, list(ts_list), ls_items, bIncDelist,
+                                  lf_mtimes)
+
+        # Same request with any version of the source files and any days,
+        # links a cached result to the one it was refreshed from
+        s_base = utils.cache_key('qstk-' + str(self.source), self.rootdir,
+                                 ls_sorted, ls_items, bIncDelist)
+
+        # What this request covers, used to serve later requests for a subset
+        d_meta = {'source': self.source, 'rootdir': self.rootdir,
+                  'bIncDelist': bIncDelist, 'items': ls_items,
+                  'ts': list(ts_list), 'mtimes': dict(zip(ls_sorted, lf_mtimes)),
+                  'base': s_base, 'created': time.time()}
 
         # final complete filename
         cachefilename = self.scratchdir + '/' + hashstr + '.pkl'
         if verbose:
             print "cachefilename is: " + cachefilename
 
-        # now eather read the pkl file, or do a hardread
-        readfile = False  # indicate that we have not yet read the file
+        # Repeated calls in one process are served from memory
+        retval = DataAccess.memcache.get(hashstr)
+        if retval is not None:
+            if verbose:
+                print "memory cache hit"
+            return _cached_frames(retval, symbol_list, bStr)
 
-        #check if the cachestall variable is defined.
-        # try:
-        #     catchstall=dt.timedelta(hours=int(os.environ['CACHESTALLTIME']))
-        # except:
-        #     catchstall=dt.timedelta(hours=1)
-        cachestall = dt.timedelta(hours=self.cachestalltime)
+        # now eather read the pkl file, or slice a cached superset of the
+        # request, or refresh an older version of it, or do a hardread
+        retval = self._read_scratch(cachefilename, verbose)
 
-        # Check if the file is older than the cachestalltime
-        if os.path.exists(cachefilename):
-            if ((dt.datetime.now() - dt.datetime.fromtimestamp(os.path.getmtime(cachefilename))) < cachestall):
+        if retval is None:
+            t_superset = self._find_superset(d_meta, verbose)
+            if t_superset is not None:
                 if verbose:
-                    print "cache hit"
-                try:
-                    cachefile = open(cachefilename, "rb")
-                    start = time.time() # start timer
-                    retval = pkl.load(cachefile)
-                    elapsed = time.time() - start # end timer
-                    readfile = True # remember success
-                    cachefile.close()
-                except IOError:
-                    if verbose:
-                        print "error reading cache: " + cachefilename
-                        print "recovering..."
-                except EOFError:
-                    if verbose:
-                        print "error reading cache: " + cachefilename
-                        print "recovering..."
-        if (readfile!=True):
+                    print "superset cache hit"
+                retval = _slice_frames(t_superset[0], t_superset[1], ts_list,
+                                       symbol_list, ls_items)
+
+        if retval is None:
+            t_previous = self._find_previous(s_base, list(ts_list), verbose)
+            if t_previous is not None:
+                s_previous, ldf_previous, d_previous = t_previous
+                # Only symbols whose files changed are read, from their last
+                # cached day on, and the days past the cached ones
+                ls_changed = [symbol for symbol, f_mtime in d_meta['mtimes'].items()
+                              if d_previous['mtimes'].get(symbol, -1) != f_mtime]
+                if verbose:
+                    print "refreshing cache, symbols changed: " + str(ls_changed)
+                start = time.time() # start timer
+                retval = utils.refresh_frames(ldf_previous, ls_changed,
+                    lambda ts_tail, ls_read: self.get_data_hardread(ts_tail,
+                        ls_read, ls_items, verbose, bIncDelist, n_workers),
+                    list(ts_list))
+                elapsed = time.time() - start # end timer
+                self._write_scratch(cachefilename, retval, d_meta, verbose)
+                if s_previous != hashstr:
+                    self._remove_scratch(s_previous)
+                if verbose:
+                    print "refresh took " + str(elapsed) + " seconds"
+
+        if retval is None:
             if verbose:
                 print "cache miss"
                 print "beginning hardread"
             start = time.time() # start timer
             if verbose:
-                print "data_item(s): " + str(data_item)
+                print "data_item(s): " + str(ls_items)
                 print "symbols to read: " + str(symbol_list)
             retval = self.get_data_hardread(ts_list, 
-                symbol_list, data_item, verbose, bIncDelist)
+                symbol_list, ls_items, verbose, bIncDelist, n_workers)
             elapsed = time.time() - start # end timer
             if verbose:
                 print "end hardread"
-                print "saving to cache"
-            try:
-                cachefile = open(cachefilename,"wb")
-                pkl.dump(retval, cachefile, -1)
-                os.chmod(cachefilename,0666)
-            except IOError:
-                print "error writing cache: " + cachefilename
-            if verbose:
-                print "end saving to cache"
+            self._write_scratch(cachefilename, retval, d_meta, verbose)
             if verbose:
                 print "reading took " + str(elapsed) + " seconds"
+
+        DataAccess.memcache.put(hashstr, retval)
+        DataAccess.cacheindex[hashstr] = d_meta
+        return _cached_frames(retval, symbol_list, bStr)
+
+    def _write_scratch(self, cachefilename, retval, d_meta, verbose=False):
+        '''
+        @summary: Saves a result to the scratch directory along with its description.
+        '''
+        if verbose:
+            print "saving to cache"
+        try:
+            cachefile = open(cachefilename,"wb")
+            pkl.dump(retval, cachefile, -1)
+            cachefile.close()
+            os.chmod(cachefilename,0666)
+            # Written last, so other processes only see complete entries
+            indexfile = open(cachefilename[:-4] + '.idx', "wb")
+            pkl.dump(d_meta, indexfile, -1)
+            indexfile.close()
+        except IOError:
+            print "error writing cache: " + cachefilename
+        if verbose:
+            print "end saving to cache"
+
+    def _remove_scratch(self, s_key):
+        '''
+        @summary: Drops a cached result that has been superseded.
+        '''
+        DataAccess.memcache.pop(s_key)
+        DataAccess.cacheindex.pop(s_key, None)
+        for s_ext in ('.idx', '.pkl'):
+            try:
+                os.remove(self.scratchdir + '/' + s_key + s_ext)
+            except OSError:
+                pass
+
+    def _read_scratch(self, cachefilename, verbose=False, bStale=False):
+        '''
+        @summary: Loads a scratch file if it is younger than cachestalltime.
+        @param bStale: If true, older files are loaded as well.
+        @return: The cached list of DataFrames, None if the file is missing,
+        stale or unreadable.
+        '''
+        cachestall = dt.timedelta(hours=self.cachestalltime)
+
+        # Check if the file is older than the cachestalltime
+        if not os.path.exists(cachefilename):
+            return None
+        if not bStale and ((dt.datetime.now() - dt.datetime.fromtimestamp(os.path.getmtime(cachefilename))) >= cachestall):
+            return None
+
+        if verbose:
+            print "cache hit"
+        try:
+            cachefile = open(cachefilename, "rb")
+            retval = pkl.load(cachefile)
+            cachefile.close()
+        except (IOError, EOFError):
+            if verbose:
+                print "error reading cache: " + cachefilename
+                print "recovering..."
+            return None
         return retval
 
+    def _load_cacheindex(self):
+        '''
+        @summary: Adds descriptions of results cached by other processes to cacheindex.
+        '''
+        s_prefix = 'qstk-' + str(self.source) + '-'
+        try:
+            ls_files = os.listdir(self.scratchdir)
+        except OSError:
+            ls_files = []
+        for s_file in ls_files:
+            s_key = s_file[:-4]
+            if s_file.startswith(s_prefix) and s_file.endswith('.idx') \
+                    and s_key not in DataAccess.cacheindex:
+                try:
+                    indexfile = open(os.path.join(self.scratchdir, s_file), "rb")
+                    DataAccess.cacheindex[s_key] = pkl.load(indexfile)
+                    indexfile.close()
+                except (IOError, EOFError, pkl.UnpicklingError):
+                    pass
+
+    def _find_previous(self, s_base, ts_list, verbose=False):
+        '''
+        @summary: Looks for a cached result of the same request made against
+        older source files, or for the first days of ts_list, stale results
+        included. Results covering more days are tried first, then newer ones.
+        @param s_base: Key of the request without file mtimes and days, see get_data.
+        @param ts_list: Days of the request.
+        @return: Tuple of (key, cached list of DataFrames, its description),
+        None if there is no such result.
+        '''
+        self._load_cacheindex()
+        lt_found = [(-len(d_entry['ts']), -d_entry.get('created', 0), s_key)
+                    for s_key, d_entry in DataAccess.cacheindex.items()
+                    if d_entry.get('base') == s_base
+                    and list(d_entry['ts']) == ts_list[:len(d_entry['ts'])]]
+        lt_found.sort()
+
+        for _, _, s_key in lt_found:
+            retval = DataAccess.memcache.get(s_key)
+            if retval is None:
+                retval = self._read_scratch(self.scratchdir + '/' + s_key + '.pkl',
+                                            verbose, bStale=True)
+            if retval is not None:
+                return s_key, retval, DataAccess.cacheindex[s_key]
+        return None
+
+    def _find_superset(self, d_meta, verbose=False):
+        '''
+        @summary: Looks for a cached result that covers a request, in memory
+        first and then in the scratch directory. Smaller results are tried first.
+        @param d_meta: Description of the request, see get_data.
+        @return: Tuple of (cached list of DataFrames, its description), None
+        if nothing covers the request.
+        '''
+        self._load_cacheindex()
+
+        lt_found = []
+        for s_key, d_entry in DataAccess.cacheindex.items():
+            if _covers(d_entry, d_meta):
+                i_cells = len(d_entry['ts']) * len(d_entry['mtimes']) * len(d_entry['items'])
+                lt_found.append((s_key not in DataAccess.memcache, i_cells, s_key))
+        lt_found.sort()
+
+        for _, _, s_key in lt_found:
+            retval = DataAccess.memcache.get(s_key)
+            if retval is None:
+                retval = self._read_scratch(self.scratchdir + '/' + s_key + '.pkl', verbose)
+                if retval is None:
+                    continue
+                DataAccess.memcache.put(s_key, retval)
+            return retval, DataAccess.cacheindex[s_key]
+        return None
+
+    def _source_mtimes(self, symbol_list):
+        '''
+        @summary: Modification times of the files backing each symbol, looked
+        up in the same order as getPathOfFile. None when there is no file.
+        '''
+        lf_mtimes = []
+        for symbol in symbol_list:
+            f_mtime = None
+            for path in self.folderList:
+                for s_ext in ('.pkl', '.csv'):
+                    try:
+                        f_mtime = os.path.getmtime(str(path) + str(symbol) + s_ext)
+                        break
+                    except OSError:
+                        pass
+                if f_mtime is not None:
+                    break
+            lf_mtimes.append(f_mtime)
+        return lf_mtimes
+
     def getPathOfFile(self, symbol_name, bDelisted=False):
         '''
         @summary: Since a given pkl file can exist in any of the folders- we need to look for it in each one until we find it. Thats what this function does.
@@ -570,6 +999,9 @@ class DataAccess(object):
         if (len(self.folderList) == 0):
             raise ValueError("DataAccess source not set")
 
+        if self.source == DataSource.COLUMNAR:
+            return list(self._open_columnar()['symbols'])
+
         for path in self.folderList:
             stocksAtThisPath = list()
             #print str(path)
@@ -713,6 +1145,13 @@ class DataAccess(object):
             retstr = retstr + "Attempts to load a custom data set, assuming each stock has\n"
             retstr = retstr + "a csv file with the name and first column as the stock ticker,\ date in second column, and data in following columns.\n"
             retstr = retstr + "everything should be located in QSDATA/Processed/ML4Trading\n"
+        elif (self.source == DataSource.COLUMNAR):
+            retstr = "Columnar:\n"
+            retstr = retstr + "Memory mapped dates x symbols array per data item, converted\n"
+            retstr = retstr + "from Yahoo csv files with qstktools/csv2columnar.py\n"
+            retstr = retstr + "Valid data items include: \n"
+            retstr = retstr + "\t" + ", ".join(COLUMNAR_ITEMS) + "\n"
+            retstr = retstr + "everything should be located in QSDATA/Columnar\n"
         else:
             retstr = "DataAccess internal error\n"
 
@@ -20,6 +20,7 @@ import numpy
 import datetime
 import MySQLdb
 import qsdateutil as du
+import utils
 from operator import itemgetter
 from dateutil.relativedelta import relativedelta
 
@@ -465,6 +466,11 @@ class _MySQL(DriverInterface):
 
 
 class _ScratchCache(object):
+    # In memory cache in front of the scratch directory
+    memcache = utils.LRUCache()
+    # Key and days of the newest result of each request, by a key without days
+    generations = {}
+
     @staticmethod
     def try_cache(ts_list, symbol_list, data_item, verbose=False,
                 include_delisted=False, cache_miss_function=None, source=None):
@@ -484,19 +490,14 @@ class _ScratchCache(object):
         # We then check to see if the filename exists already, meaning that
         # the data has already been created and we can just read that file.
 
-        # Create the hash for the symbols
-        hashsyms = 0
-        for i in symbol_list:
-            hashsyms = (hashsyms + hash(i)) % 10000000
-
-        # Create the hash for the timestamps
-        hashts = 0
+        # The key is a digest, so it is the same for any symbol order and
+        # in every interpreter run
+        hashstr = utils.cache_key('qstk-' + str(source), sorted(symbol_list),
+                                  list(ts_list), list(data_item), include_delisted)
 
-        # print "test point 1: " + str(len(ts_list))
-        for i in ts_list:
-            hashts = (hashts + hash(i)) % 10000000
-        hashstr = 'qstk-' + str(source) + '-' + str(abs(hashsyms)) + '-' + str(abs(hashts)) \
-            + '-' + str(hash(str(data_item)))
+        # Same request for any days, links a result to the one for fewer days
+        s_base = utils.cache_key('qstk-' + str(source), sorted(symbol_list),
+                                 list(data_item), include_delisted)
 
         # get the directory for scratch files from environment
         try:
@@ -512,6 +513,7 @@ class _ScratchCache(object):
 
         # now eather read the pkl file, or do a hardread
         readfile = False  # indicate that we have not yet read the file
+        dt_read = datetime.datetime.now()
 
         #check if the cachestall variable is defined.
 
@@ -521,9 +523,29 @@ class _ScratchCache(object):
         except:
             catchstall = datetime.timedelta(hours=12)
 
+        # Repeated calls in one process are served from memory, there are no
+        # source files to check so entries age out like the scratch files
+        t_cached = _ScratchCache.memcache.get(hashstr)
+        if t_cached is not None and datetime.datetime.now() - t_cached[0] < catchstall:
+            if verbose:
+                print "memory cache hit"
+            return utils.copy_frames(t_cached[1], symbol_list)
+
+        # An expired result is refreshed rather than read again in full
+        stale = None
+        if t_cached is not None:
+            stale = t_cached[1]
+
         # Check if the file is older than the cachestalltime
         if os.path.exists(cachefilename):
-            if((datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(cachefilename))) < catchstall):
+            if stale is None and ((datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(cachefilename))) >= catchstall):
+                try:
+                    cachefile = open(cachefilename, "rb")
+                    stale = pickle.load(cachefile)
+                    cachefile.close()
+                except (IOError, EOFError):
+                    stale = None
+            elif((datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(cachefilename))) < catchstall):
                 if verbose:
                     print "cache hit"
                 try:
@@ -533,6 +555,7 @@ class _ScratchCache(object):
                     elapsed = time.time() - start  # end timer
                     readfile = True  # remember success
                     cachefile.close()
+                    dt_read = datetime.datetime.fromtimestamp(os.path.getmtime(cachefilename))
                 except IOError:
                     if verbose:
                         print "error reading cache: " + cachefilename
@@ -541,7 +564,26 @@ class _ScratchCache(object):
                     if verbose:
                         print "error reading cache: " + cachefilename
                         print "recovering..."
-        if (readfile != True):
+        # A result for the first days of ts_list is extended rather than
+        # read again in full
+        if readfile != True and stale is None:
+            stale = _ScratchCache._read_previous(scratchdir, s_base, hashstr, ts_list)
+
+        if (readfile != True and stale is not None):
+            if verbose:
+                print "cache expired"
+                print "reading rows from the last cached day on"
+                start = time.time()  # start timer
+            # Drivers return frames for the days they have, align them
+            fc_read = lambda ts_tail, ls_read: [
+                df_tail.reindex(index=ts_tail, columns=ls_read) for df_tail in
+                cache_miss_function(ts_tail, ls_read, data_item, verbose, include_delisted)]
+            retval = utils.refresh_frames(stale, symbol_list, fc_read, ts_list)
+            if verbose:
+                elapsed = time.time() - start  # end timer
+                print "end refresh"
+                print "saving to cache"
+        elif (readfile != True):
             if verbose:
                 print "cache miss"
                 print "beginning hardread"
@@ -554,6 +596,7 @@ class _ScratchCache(object):
                 elapsed = time.time() - start  # end timer
                 print "end hardread"
                 print "saving to cache"
+        if (readfile != True):
             try:
                 cachefile = open(cachefilename, "wb")
                 pickle.dump(retval, cachefile, -1)
@@ -563,7 +606,54 @@ class _ScratchCache(object):
             if verbose:
                 print "end saving to cache"
                 print "reading took " + str(elapsed) + " seconds"
-        return retval
+            _ScratchCache._write_generation(scratchdir, s_base, hashstr, ts_list)
+
+        _ScratchCache.memcache.put(hashstr, (dt_read, retval))
+        return utils.copy_frames(retval, symbol_list)
+
+    @staticmethod
+    def _write_generation(scratchdir, s_base, hashstr, ts_list):
+        '''
+        @summary: Records hashstr as the newest result of the request s_base.
+        '''
+        t_gen = (hashstr, list(ts_list))
+        _ScratchCache.generations[s_base] = t_gen
+        try:
+            genfile = open(scratchdir + '/' + s_base + '.gen', "wb")
+            pickle.dump(t_gen, genfile, -1)
+            genfile.close()
+        except IOError:
+            print "error writing cache: " + scratchdir + '/' + s_base + '.gen'
+
+    @staticmethod
+    def _read_previous(scratchdir, s_base, hashstr, ts_list):
+        '''
+        @summary: Loads the newest result of the request s_base if its days are
+        the first days of ts_list, stale or not.
+        @return: The cached list of DataFrames, None if there is no such result.
+        '''
+        t_gen = _ScratchCache.generations.get(s_base)
+        if t_gen is None:
+            try:
+                genfile = open(scratchdir + '/' + s_base + '.gen', "rb")
+                t_gen = pickle.load(genfile)
+                genfile.close()
+            except (IOError, EOFError, pickle.UnpicklingError):
+                return None
+        s_previous, ts_previous = t_gen
+        if s_previous == hashstr or ts_previous != list(ts_list)[:len(ts_previous)]:
+            return None
+
+        t_cached = _ScratchCache.memcache.get(s_previous)
+        if t_cached is not None:
+            return t_cached[1]
+        try:
+            cachefile = open(scratchdir + '/' + s_previous + '.pkl', "rb")
+            stale = pickle.load(cachefile)
+            cachefile.close()
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        return stale
 
 
 class DataAccess(object):
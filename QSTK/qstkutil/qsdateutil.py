@@ -117,6 +117,25 @@ def getLastOptionClose(day, trade_days):
         day= day - dt.timedelta(days=1)
     return(getNextOptionClose(day, trade_days))
 
+def getOptionCloses(startday, endday, trade_days):
+    '''
+    @summary: Option closes of every month from the one before startday to
+    the one after endday, as returned by getNextOptionClose. Any day between
+    startday and endday has its last close and next close in the list.
+    @param startday: First day to cover
+    @param endday: Last day to cover
+    @param trade_days: Trading days, decides when the third friday is a holiday
+    @return list: of option closes in increasing order
+    '''
+    i_month = startday.year * 12 + startday.month - 2
+    i_last = endday.year * 12 + endday.month
+    ldt_closes = []
+    while i_month <= i_last:
+        first = dt.datetime(i_month // 12, i_month % 12 + 1, 1)
+        ldt_closes.append(getNextOptionClose(first, trade_days))
+        i_month += 1
+    return ldt_closes
+
 
 def getNYSEoffset(mark, offset):
     ''' Returns NYSE date offset by number of days '''
@@ -0,0 +1,184 @@
+'''
+(c) 2011, 2012 Georgia Tech Research Corporation
+This source code is released under the New BSD license.  Please see
+http://wiki.quantsoftware.org/index.php?title=QSTK_License
+for license details.
+
+@summary: Test cases for DataAccess
+
+'''
+
+# Python imports
+import os
+import shutil
+import tempfile
+import datetime as dt
+import unittest
+from StringIO import StringIO
+
+# 3rd party imports
+import numpy as np
+
+# QSTK imports
+import QSTK.qstkutil.DataAccess as da
+from QSTK.qstktools.csv2columnar import csv2columnar
+
+
+class Test(unittest.TestCase):
+
+    s_csv = "Date,Open,High,Low,Close,Volume,Adj Close\n" \
+            "2012-09-12,666.85,669.90,656.00,669.79,25410600,669.79\n" \
+            "09/11/12,665.11,670.10,656.50,660.59,17987400,660.59\n" \
+            "2012-09-10,680.45,683.29,662.10,662.74,17428500,662.74\n"
+
+    def test_read_csv_data(self):
+        ''' Bulk CSV reader returns oldest day first with YYYYMMDD dates '''
+        na_data = da._read_csv_data(StringIO(self.s_csv))
+
+        self.assertEqual(na_data.shape, (3, 7))
+        self.assertEqual(list(na_data[:, 0]), [20120910., 20120911., 20120912.])
+        self.assertEqual(na_data[2, 1], 666.85)
+        self.assertEqual(na_data[1, 5], 17987400.)
+
+    def test_read_csv_single_row(self):
+        ''' A single row file is still returned as a 2D array '''
+        s_csv = self.s_csv.split('\n')
+        na_data = da._read_csv_data(StringIO('\n'.join(s_csv[:2])))
+
+        self.assertEqual(na_data.shape, (1, 7))
+        self.assertTrue(np.all(na_data[0, 1:] == [666.85, 669.90, 656.00,
+                                                  669.79, 25410600, 669.79]))
+
+    def test_align_day_keys(self):
+        ''' Only days at 16:00 in ts_list are matched, first duplicate wins '''
+        ldt_timestamps = [dt.datetime(2012, 9, 10, 16),
+                          dt.datetime(2012, 9, 11, 9),
+                          dt.datetime(2012, 9, 11, 16),
+                          dt.datetime(2012, 9, 13, 16),
+                          dt.datetime(2012, 9, 14, 16)]
+        na_ts_keys = da._ts_day_keys(ldt_timestamps)
+        self.assertEqual(list(na_ts_keys),
+                         [20120910, -1, 20120911, 20120913, 20120914])
+
+        na_dates = np.array([20120907., 20120910., 20120911., 20120911.,
+                             20120912., 20120913.])
+        na_ts_rows, na_file_rows = da._align_day_keys(na_ts_keys, na_dates)
+        self.assertEqual(list(na_ts_rows), [0, 2, 3])
+        self.assertEqual(list(na_file_rows), [1, 2, 5])
+
+    def test_covers(self):
+        ''' Cached results serve requests for fewer days, symbols and items '''
+        ldt_timestamps = [dt.datetime(2012, 9, i, 16) for i in range(4, 15)]
+        d_entry = {'source': 'Yahoo', 'rootdir': '/data', 'bIncDelist': False,
+                   'items': ['close', 'open'], 'ts': ldt_timestamps,
+                   'mtimes': {'AAA': 1.0, 'BBB': 2.0}}
+        d_meta = dict(d_entry, items=['open'], ts=ldt_timestamps[2:5],
+                      mtimes={'BBB': 2.0})
+        self.assertTrue(da._covers(d_entry, d_meta))
+
+        self.assertFalse(da._covers(d_entry, dict(d_meta, items=['volume'])))
+        self.assertFalse(da._covers(d_entry, dict(d_meta, mtimes={'BBB': 3.0})))
+        self.assertFalse(da._covers(d_entry, dict(d_meta, mtimes={'CCC': 2.0})))
+        self.assertFalse(da._covers(d_entry, dict(d_meta,
+                         ts=[dt.datetime(2012, 9, 5, 9)])))
+        self.assertFalse(da._covers(d_entry, dict(d_meta,
+                         ts=ldt_timestamps + [dt.datetime(2012, 9, 17, 16)])))
+
+    @unittest.skipIf('QSDATA' in os.environ, 'QSDATA overrides s_datapath')
+    def test_columnar_store(self):
+        ''' Columnar store returns the same frames as the Yahoo csv files '''
+        s_root = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(s_root, 'Yahoo'))
+            for s_sym in ['AAA', 'BBB']:
+                f_csv = open(os.path.join(s_root, 'Yahoo', s_sym + '.csv'), 'w')
+                f_csv.write(self.s_csv)
+                f_csv.close()
+            csv2columnar(os.path.join(s_root, 'Yahoo'),
+                         os.path.join(s_root, 'Columnar'), ['AAA'])
+
+            ldt_timestamps = [dt.datetime(2012, 9, 7, 16),
+                              dt.datetime(2012, 9, 10, 16),
+                              dt.datetime(2012, 9, 11, 16),
+                              dt.datetime(2012, 9, 12, 16)]
+            ls_items = ['open', 'volume', 'close']
+            c_yahoo = da.DataAccess(da.DataSource.YAHOO, s_datapath=s_root)
+            c_columnar = da.DataAccess(da.DataSource.COLUMNAR, s_datapath=s_root)
+            ldf_yahoo = c_yahoo.get_data_hardread(ldt_timestamps,
+                                                  ['AAA', 'BBB'], ls_items)
+            ldf_columnar = c_columnar.get_data(ldt_timestamps,
+                                               ['AAA', 'BBB'], ls_items)
+
+            self.assertEqual(c_columnar.get_all_symbols(), ['AAA'])
+            for df_yahoo, df_columnar in zip(ldf_yahoo, ldf_columnar):
+                self.assertTrue(np.all(np.isnan(df_columnar['BBB'].values)))
+                na_yahoo = df_yahoo['AAA'].values
+                na_columnar = df_columnar['AAA'].values
+                self.assertTrue(np.all(np.isnan(na_yahoo) == np.isnan(na_columnar)))
+                self.assertTrue(np.all(na_yahoo[1:] == na_columnar[1:]))
+        finally:
+            shutil.rmtree(s_root)
+
+    @unittest.skipIf('QSDATA' in os.environ, 'QSDATA overrides s_datapath')
+    def test_parallel_hardread(self):
+        ''' Reading symbols on several processes gives the serial frames '''
+        s_root = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(s_root, 'Yahoo'))
+            ls_symbols = ['S%d' % i for i in range(5)]
+            for s_sym in ls_symbols[1:]:
+                f_csv = open(os.path.join(s_root, 'Yahoo', s_sym + '.csv'), 'w')
+                f_csv.write(self.s_csv)
+                f_csv.close()
+
+            ldt_timestamps = [dt.datetime(2012, 9, i, 16) for i in range(7, 13)]
+            ls_items = ['open', 'volume', 'close']
+            c_data = da.DataAccess(da.DataSource.YAHOO, s_datapath=s_root)
+            ldf_serial = c_data.get_data_hardread(ldt_timestamps, ls_symbols, ls_items)
+            ldf_parallel = c_data.get_data_hardread(ldt_timestamps, ls_symbols,
+                                                    ls_items, n_workers=2)
+
+            for df_serial, df_parallel in zip(ldf_serial, ldf_parallel):
+                self.assertEqual(list(df_parallel.columns), ls_symbols)
+                na_serial = df_serial.values
+                na_parallel = df_parallel.values
+                self.assertTrue(np.all(np.isnan(na_serial) == np.isnan(na_parallel)))
+                self.assertTrue(np.all(na_serial[~np.isnan(na_serial)] ==
+                                       na_parallel[~np.isnan(na_parallel)]))
+        finally:
+            shutil.rmtree(s_root)
+
+    @unittest.skipIf('QSDATA' in os.environ, 'QSDATA overrides s_datapath')
+    def test_refresh_new_days(self):
+        ''' A cached result for the first days of a request is extended '''
+        s_root = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(s_root, 'Yahoo'))
+            os.mkdir(os.path.join(s_root, 'Scratch'))
+            for s_sym in ['AAA', 'BBB']:
+                f_csv = open(os.path.join(s_root, 'Yahoo', s_sym + '.csv'), 'w')
+                f_csv.write(self.s_csv)
+                f_csv.close()
+
+            ldt_timestamps = [dt.datetime(2012, 9, i, 16) for i in range(10, 13)]
+            c_data = da.DataAccess(da.DataSource.YAHOO, s_datapath=s_root,
+                                   s_scratchpath=os.path.join(s_root, 'Scratch'))
+            l_calls = []
+            fc_hardread = c_data.get_data_hardread
+            def fc_record(ts_list, symbol_list, *l_args, **d_args):
+                l_calls.append((len(ts_list), list(symbol_list)))
+                return fc_hardread(ts_list, symbol_list, *l_args, **d_args)
+            c_data.get_data_hardread = fc_record
+
+            c_data.get_data(ldt_timestamps[:2], ['AAA', 'BBB'], 'close')
+            df_close = c_data.get_data(ldt_timestamps, ['AAA', 'BBB'], 'close')
+
+            self.assertEqual(l_calls, [(2, ['AAA', 'BBB']), (1, ['AAA', 'BBB'])])
+            self.assertEqual(list(df_close['AAA'].values), [662.74, 660.59, 669.79])
+            self.assertEqual(list(df_close['BBB'].values), [662.74, 660.59, 669.79])
+        finally:
+            shutil.rmtree(s_root)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,11 +13,16 @@ Created on May 14, 2012
 '''
 
 # Python imports
+import datetime as dt
 import unittest
 
 # 3rd party imports
+import numpy as np
+import pandas as pd
 
 # QSTK imports
+from QSTK.qstkutil import utils
+import QSTK.qstkutil.qsdateutil as du
 
 
 
@@ -36,7 +41,94 @@ class Test(unittest.TestCase):
         # Silly example to test current error in loading utils
         import qstkutil.utils as utils
         self.assertTrue(True)
-        
+
+    def test_cache_key(self):
+        ''' Keys only depend on the values passed in '''
+        s_key = utils.cache_key('qstk-Yahoo', ['AAPL', 'GOOG'], 'close')
+        self.assertEqual(s_key, utils.cache_key('qstk-Yahoo', ['AAPL', 'GOOG'], 'close'))
+        self.assertNotEqual(s_key, utils.cache_key('qstk-Yahoo', ['AAPL', 'GOOG'], 'open'))
+        self.assertTrue(s_key.startswith('qstk-Yahoo-'))
+
+    def test_refresh_frames(self):
+        ''' Only rows from the last cached day on are read again '''
+        ldt_timestamps = [dt.datetime(2012, 9, i, 16) for i in range(3, 8)]
+        na_fresh = np.arange(10, dtype=float).reshape(5, 2)
+        df_fresh = pd.DataFrame(na_fresh, ldt_timestamps, ['A', 'B'])
+        na_cached = na_fresh.copy()
+        na_cached[3:, :] = np.NAN
+        na_cached[1:, 1] = np.NAN
+        df_cached = pd.DataFrame(na_cached, ldt_timestamps, ['A', 'B'])
+
+        l_calls = []
+        def fc_read(ts_list, ls_symbols):
+            l_calls.append((len(ts_list), ls_symbols))
+            return [df_fresh.reindex(index=ts_list, columns=ls_symbols)]
+
+        df_ret = utils.refresh_frames([df_cached], ['A', 'B'], fc_read)[0]
+        self.assertTrue(np.all(df_ret.values == na_fresh))
+        self.assertEqual(l_calls, [(5, ['B']), (3, ['A'])])
+
+        # A different value on the last cached day means the history changed
+        l_calls = []
+        na_cached[:, 1] = na_fresh[:, 1]
+        na_cached[2, 0] = -1
+        df_cached = pd.DataFrame(na_cached, ldt_timestamps, ['A', 'B'])
+        df_ret = utils.refresh_frames([df_cached], ['A'], fc_read)[0]
+        self.assertTrue(np.all(df_ret.values == na_fresh))
+        self.assertEqual(l_calls, [(3, ['A']), (5, ['A'])])
+
+    def test_refresh_frames_new_days(self):
+        ''' Days past the cached ones are read for every symbol '''
+        ldt_timestamps = [dt.datetime(2012, 9, i, 16) for i in range(3, 8)]
+        na_fresh = np.arange(15, dtype=float).reshape(5, 3)
+        na_fresh[:, 2] = np.NAN
+        df_fresh = pd.DataFrame(na_fresh, ldt_timestamps, ['A', 'B', 'C'])
+        na_cached = na_fresh[:3].copy()
+        na_cached[2, 0] = np.NAN
+        df_cached = pd.DataFrame(na_cached, ldt_timestamps[:3], ['A', 'B', 'C'])
+
+        l_calls = []
+        def fc_read(ts_list, ls_symbols):
+            l_calls.append((len(ts_list), ls_symbols))
+            return [df_fresh.reindex(index=ts_list, columns=ls_symbols)]
+
+        # C has no data, it is read in full without pulling A back as well
+        df_ret = utils.refresh_frames([df_cached], ['A', 'C'], fc_read,
+                                      ldt_timestamps)[0]
+        self.assertEqual(list(df_ret.index), ldt_timestamps)
+        self.assertTrue(np.all(df_ret.values[:, :2] == na_fresh[:, :2]))
+        self.assertTrue(np.all(np.isnan(df_ret.values[:, 2])))
+        self.assertEqual(l_calls, [(5, ['C']), (4, ['A']), (2, ['B'])])
+
+        self.assertRaises(ValueError, utils.refresh_frames, [df_cached], ['A'],
+                          fc_read, ldt_timestamps[1:])
+
+    def test_lru_cache(self):
+        ''' Oldest entries are evicted once the byte limit is passed '''
+        c_cache = utils.LRUCache(i_max_bytes=3 * 800)
+        for s_key in ['a', 'b', 'c']:
+            c_cache.put(s_key, np.zeros(100))
+        c_cache.get('a')
+        c_cache.put('d', np.zeros(100))
+
+        self.assertTrue('a' in c_cache)
+        self.assertFalse('b' in c_cache)
+        self.assertEqual(c_cache.i_bytes, 3 * 800)
+
+        c_cache.put('e', np.zeros(1000))
+        self.assertFalse('e' in c_cache)
+        self.assertEqual(len(c_cache), 3)
+
+    def test_option_closes(self):
+        ''' Closes agree with getLastOptionClose and getNextOptionClose '''
+        ldt_days = du.getNYSEdays(dt.datetime(2011, 11, 25), dt.datetime(2012, 2, 3),
+                                  dt.timedelta(hours=16))
+        ldt_closes = du.getOptionCloses(ldt_days[0], ldt_days[-1], ldt_days)
+        self.assertEqual(ldt_closes, sorted(ldt_closes))
+        for dt_day in ldt_days:
+            self.assertTrue(du.getLastOptionClose(dt_day, ldt_days) in ldt_closes)
+            self.assertTrue(du.getNextOptionClose(dt_day, ldt_days) in ldt_closes)
+
 
 
 if __name__ == "__main__":
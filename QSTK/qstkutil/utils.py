@@ -14,6 +14,12 @@ Created on Apr 22, 2011
 
 import dircache
 import os
+import sys
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
 
 def clean_paths (paths_to_clean):
  '''
@@ -37,3 +43,200 @@ def clean_paths (paths_to_clean):
  #outer for ends   
     
 #clean_output_paths  ends
+
+
+def cache_key(s_prefix, *l_parts):
+    '''
+    @summary: Builds a cache key that is stable across interpreter runs.
+    @param s_prefix: Readable prefix for the key, e.g. 'qstk-Yahoo'
+    @param l_parts: Anything with a deterministic repr (strings, numbers,
+                    datetimes and lists/tuples of them).
+    @return: s_prefix followed by a sha1 digest of the parts.
+    '''
+    c_hash = hashlib.sha1()
+    for part in l_parts:
+        c_hash.update(repr(part))
+        c_hash.update('\0')
+    return s_prefix + '-' + c_hash.hexdigest()
+
+
+def nbytes(value):
+    '''
+    @summary: Rough size in bytes of arrays, DataFrames and lists of them.
+    '''
+    if isinstance(value, (list, tuple)):
+        return sum([nbytes(item) for item in value])
+    if isinstance(value, dict):
+        return sum([nbytes(item) for item in value.values()])
+    if hasattr(value, 'values') and hasattr(value, 'index'):
+        return nbytes(value.values) + 8 * len(value.index)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+def copy_frames(ldf_data, ls_columns):
+    '''
+    @summary: Copies cached DataFrames so callers can modify them freely.
+    @param ldf_data: List of DataFrames sharing the same columns.
+    @param ls_columns: The same columns in the order the caller asked for,
+                       the copies are returned in this order.
+    @return: List of DataFrames.
+    '''
+    if len(ldf_data) == 0:
+        return []
+
+    ls_cached = list(ldf_data[0].columns)
+    if ls_cached == list(ls_columns):
+        return [df_data.copy() for df_data in ldf_data]
+
+    # Columns may repeat, take them in turn
+    d_pos = {}
+    for i, s_col in enumerate(ls_cached):
+        d_pos.setdefault(s_col, []).append(i)
+    li_order = [d_pos[s_col].pop(0) for s_col in ls_columns]
+
+    return [pd.DataFrame(df_data.values[:, li_order], df_data.index, list(ls_columns))
+            for df_data in ldf_data]
+
+
+def last_valid_rows(ldf_data):
+    '''
+    @summary: Finds the last row holding data in each column.
+    @param ldf_data: List of DataFrames sharing the same index and columns.
+    @return: Numpy int array with one entry per column, -1 if the column is
+             NaN in every DataFrame.
+    '''
+    na_valid = np.zeros(ldf_data[0].values.shape, dtype=bool)
+    for df_data in ldf_data:
+        na_valid |= ~np.isnan(df_data.values.astype(float))
+
+    i_rows = na_valid.shape[0]
+    na_last = i_rows - 1 - np.argmax(na_valid[::-1], axis=0)
+    na_last[~na_valid.any(axis=0)] = -1
+    return na_last
+
+
+def refresh_frames(ldf_data, ls_symbols, fc_read, ts_list=None):
+    '''
+    @summary: Brings cached DataFrames up to date by reading only the rows from
+              the last date each symbol had data on.
+    @param ldf_data: Cached list of DataFrames sharing the same index and columns.
+    @param ls_symbols: Symbols whose source data changed.
+    @param fc_read: Called as fc_read(ts_list, symbol_list) to read fresh data,
+                    returns a list of DataFrames in the same order as ldf_data,
+                    indexed by ts_list with symbol_list as columns.
+    @param ts_list: Index of the refreshed DataFrames, the cached index followed
+                    by new days. Every symbol is read for the new days. Default
+                    is the cached index.
+    @return: Refreshed copies of ldf_data.
+    @note: Each changed symbol is read from its own last cached row on, or in
+           full if it has no cached data. The last cached row is read again.
+           If it no longer matches, the history was adjusted and the whole
+           column is re-read.
+    '''
+    ts_cached = list(ldf_data[0].index)
+    if ts_list is None:
+        ts_list = ts_cached
+    ts_list = list(ts_list)
+    if ts_list[:len(ts_cached)] != ts_cached:
+        raise ValueError("Cached days are not the first days of ts_list")
+    i_cached = len(ts_cached)
+
+    ls_columns = list(ldf_data[0].columns)
+    lna_data = []
+    for df_data in ldf_data:
+        na_data = np.empty((len(ts_list), len(ls_columns)))
+        na_data[:i_cached] = df_data.values.astype(float)
+        na_data[i_cached:] = np.NAN
+        lna_data.append(na_data)
+
+    # Row each column is read from, past the end if it is up to date
+    set_symbols = set(ls_symbols)
+    na_changed = np.array([s_col in set_symbols for s_col in ls_columns], dtype=bool)
+    na_last = last_valid_rows(ldf_data) if i_cached > 0 else -np.ones(len(ls_columns), dtype=int)
+    na_start = np.where(na_changed, np.maximum(na_last, 0), i_cached)
+
+    li_full = []
+    for i_start in np.unique(na_start):
+        if i_start >= len(ts_list):
+            continue
+        li_cols = list(np.nonzero(na_start == i_start)[0])
+        ldf_tail = fc_read(ts_list[i_start:], [ls_columns[j] for j in li_cols])
+        for k, j in enumerate(li_cols):
+            if not na_changed[j] or na_last[j] < 0:
+                continue
+            for na_data, df_tail in zip(lna_data, ldf_tail):
+                f_old = na_data[na_last[j], j]
+                f_new = float(df_tail.values[na_last[j] - i_start, k])
+                if f_old != f_new and not (np.isnan(f_old) and np.isnan(f_new)):
+                    li_full.append(j)
+                    break
+        for na_data, df_tail in zip(lna_data, ldf_tail):
+            na_data[i_start:, li_cols] = df_tail.values.astype(float)
+
+    if len(li_full) > 0:
+        ldf_full = fc_read(ts_list, [ls_columns[j] for j in li_full])
+        for na_data, df_full in zip(lna_data, ldf_full):
+            na_data[:, li_full] = df_full.values.astype(float)
+
+    return [pd.DataFrame(na_data, ts_list, ls_columns) for na_data in lna_data]
+
+
+class LRUCache(object):
+    '''
+    @summary: In memory least recently used cache bounded by total bytes.
+    '''
+
+    def __init__(self, i_max_bytes=512 * 1024 * 1024):
+        '''
+        @param i_max_bytes: Entries are evicted oldest first past this size,
+                            values larger than it are never stored.
+        '''
+        self.i_max_bytes = i_max_bytes
+        self.i_bytes = 0
+        self.d_entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.d_entries
+
+    def __len__(self):
+        return len(self.d_entries)
+
+    def get(self, key, default=None):
+        '''
+        @summary: Returns the value for key and marks it most recently used.
+        '''
+        if key not in self.d_entries:
+            return default
+        value, i_size = self.d_entries.pop(key)
+        self.d_entries[key] = (value, i_size)
+        return value
+
+    def put(self, key, value):
+        '''
+        @summary: Stores value under key, evicting old entries as needed.
+        '''
+        self.pop(key)
+        i_size = nbytes(value)
+        if i_size > self.i_max_bytes:
+            return
+        self.d_entries[key] = (value, i_size)
+        self.i_bytes += i_size
+        while self.i_bytes > self.i_max_bytes:
+            _, (_, i_old) = self.d_entries.popitem(last=False)
+            self.i_bytes -= i_old
+
+    def pop(self, key, default=None):
+        '''
+        @summary: Removes key from the cache and returns its value.
+        '''
+        if key not in self.d_entries:
+            return default
+        value, i_size = self.d_entries.pop(key)
+        self.i_bytes -= i_size
+        return value
+
+    def clear(self):
+        self.d_entries.clear()
+        self.i_bytes = 0